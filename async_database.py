@@ -0,0 +1,219 @@
+"""Pool MySQL bất đồng bộ (aiomysql) cho chế độ phục vụ asyncio (async_server.py).
+
+Cùng giao diện với DatabaseManager trong database.py nhưng các hàm là coroutine:
+chờ MySQL không giữ thread nào nên một event loop phục vụ được hàng trăm request
+đồng thời. Dùng chung DB_CONFIG và DB_POOL_CONFIG (pool_size, checkout_timeout,
+max_lifetime) với pool đồng bộ.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+
+from database import DB_CONFIG, DB_POOL_CONFIG, PoolTimeout, restamp_ids, restamp_version_query
+from metrics import observe_stages, stage_timer
+
+try:
+    import aiomysql
+except ImportError:  # chỉ cần khi chạy async_server.py
+    aiomysql = None
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncDatabaseManager:
+    def __init__(self, config=None, pool_config=None):
+        self.config = config or DB_CONFIG
+        self.pool_config = pool_config or DB_POOL_CONFIG
+        self._pool = None
+        self._pool_lock = None
+        self._last_error = None
+        self._metrics = {
+            'checkouts': 0,
+            'timeouts': 0,
+            'discarded': 0,
+            'checkout_seconds_total': 0.0,
+            'checkout_seconds_max': 0.0,
+        }
+
+    async def _get_pool(self):
+        if self._pool is not None:
+            return self._pool
+        if aiomysql is None:
+            raise RuntimeError('Chế độ async cần cài aiomysql: pip install aiomysql')
+        if self._pool_lock is None:
+            self._pool_lock = asyncio.Lock()
+        async with self._pool_lock:
+            if self._pool is None:
+                with stage_timer('db_connect'):
+                    self._pool = await aiomysql.create_pool(
+                        minsize=0,
+                        maxsize=self.pool_config['pool_size'],
+                        host=self.config['host'],
+                        port=self.config['port'],
+                        user=self.config['user'],
+                        password=self.config['password'],
+                        db=self.config['database'],
+                        charset=self.config.get('charset', 'utf8mb4'),
+                        autocommit=False,
+                        # Connection sống quá max_lifetime được đóng và tạo lại khi mượn
+                        pool_recycle=int(self.pool_config['max_lifetime']),
+                    )
+        return self._pool
+
+    @asynccontextmanager
+    async def connection(self):
+        """Mượn connection, chờ tối đa checkout_timeout giây nếu pool đã dùng hết"""
+        started = time.monotonic()
+        try:
+            pool = await self._get_pool()
+            connection = await asyncio.wait_for(pool.acquire(), self.pool_config['checkout_timeout'])
+        except asyncio.TimeoutError:
+            self._metrics['timeouts'] += 1
+            raise PoolTimeout(f"Không lấy được connection sau {self.pool_config['checkout_timeout']}s "
+                              f"(pool_size={self.pool_config['pool_size']})") from None
+        except Exception as e:
+            self._last_error = str(e)
+            raise
+        self._last_error = None
+        elapsed = time.monotonic() - started
+        self._metrics['checkouts'] += 1
+        self._metrics['checkout_seconds_total'] += elapsed
+        self._metrics['checkout_seconds_max'] = max(self._metrics['checkout_seconds_max'], elapsed)
+        observe_stages([('db_checkout', elapsed)])
+
+        discard = False
+        try:
+            yield connection
+        except (aiomysql.OperationalError, aiomysql.InterfaceError):
+            discard = True
+            raise
+        finally:
+            if not discard and not connection.closed:
+                try:
+                    # Kết thúc transaction còn mở để lần mượn sau không đọc snapshot cũ
+                    if connection.get_transaction_status():
+                        await connection.rollback()
+                except Exception:
+                    discard = True
+            if discard or connection.closed:
+                self._metrics['discarded'] += 1
+                connection.close()
+            pool.release(connection)
+
+    def pool_stats(self):
+        stats = dict(self._metrics)
+        checkouts = stats['checkouts']
+        total = stats.pop('checkout_seconds_total')
+        pool = self._pool
+        stats.update({
+            'pool_size': self.pool_config['pool_size'],
+            'open': pool.size if pool else 0,
+            'idle': pool.freesize if pool else 0,
+            'in_use': pool.size - pool.freesize if pool else 0,
+            'checkout_ms_avg': round(total / checkouts * 1000, 3) if checkouts else 0.0,
+            'checkout_ms_max': round(stats.pop('checkout_seconds_max') * 1000, 3),
+            'last_error': self._last_error,
+        })
+        return stats
+
+    async def execute_query(self, query, params=None, fetch=True):
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor(aiomysql.DictCursor) as cursor:
+                    with stage_timer('db_query'):
+                        await cursor.execute(query, params)
+                        if fetch:
+                            # DictCursor trả tuple; đổi sang list như mysql.connector để sửa/sắp xếp được
+                            return list(await cursor.fetchall())
+                        await connection.commit()
+                        return cursor.rowcount
+        except Exception as e:
+            logger.error(f"Query execution error: {e}")
+            return None
+
+    async def execute_insert(self, query, params=None):
+        """Chạy một câu INSERT và commit; trả về lastrowid, None nếu lỗi"""
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    with stage_timer('db_query'):
+                        await cursor.execute(query, params)
+                        await connection.commit()
+                    return cursor.lastrowid
+        except Exception as e:
+            logger.error(f"Insert execution error: {e}")
+            return None
+
+    async def execute_batch(self, query, params_seq, restamp=None):
+        """Trả về (rowcount, lastrowid) của từng bộ tham số trong một transaction; None nếu lỗi (đã rollback).
+        ``restamp`` như DatabaseManager.execute_batch"""
+        params_seq = list(params_seq)
+        if not params_seq:
+            return []
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    results = []
+                    with stage_timer('db_batch'):
+                        for params in params_seq:
+                            await cursor.execute(query, params)
+                            results.append((cursor.rowcount, cursor.lastrowid))
+                        ids = restamp_ids(params_seq, results, restamp) if restamp else []
+                        if ids:
+                            await cursor.execute(restamp_version_query(len(ids)), ids)
+                        await connection.commit()
+                    return results
+        except Exception as e:
+            logger.error(f"Batch execution error ({len(params_seq)} rows): {e}")
+            return None
+
+    async def execute_statements(self, statements):
+        """Chạy [(query, params_seq)] theo thứ tự trong một transaction; rowcount từng câu lệnh, None nếu lỗi"""
+        statements = [(query, list(params_seq)) for query, params_seq in statements]
+        try:
+            async with self.connection() as connection:
+                async with connection.cursor() as cursor:
+                    rowcounts = []
+                    with stage_timer('db_batch'):
+                        for query, params_seq in statements:
+                            if params_seq:
+                                await cursor.executemany(query, params_seq)
+                            rowcounts.append(cursor.rowcount if params_seq else 0)
+                        await connection.commit()
+                    return rowcounts
+        except Exception as e:
+            logger.error(f"Statements execution error ({len(statements)} statements): {e}")
+            return None
+
+    async def iter_query(self, query, params=None, batch_size=500):
+        """Đọc kết quả theo lô bằng cursor không buffer (SSDictCursor), bộ nhớ không tăng theo bảng.
+
+        Nếu bị dừng giữa chừng, connection còn kết quả chưa đọc nên bị đóng thay vì trả lại pool.
+        """
+        async with self.connection() as connection:
+            cursor = await connection.cursor(aiomysql.SSDictCursor)
+            completed = False
+            try:
+                with stage_timer('db_query'):
+                    await cursor.execute(query, params)
+                while True:
+                    rows = await cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for row in rows:
+                        yield row
+                await cursor.close()
+                completed = True
+            finally:
+                if not completed:
+                    connection.close()
+
+    async def close(self):
+        if self._pool is not None:
+            self._pool.close()
+            await self._pool.wait_closed()
+            self._pool = None
+
+
+async_db_manager = AsyncDatabaseManager()
@@ -0,0 +1,880 @@
+"""Chạy các API của server.py trên asyncio (aiohttp + aiomysql).
+
+Cùng route và cùng định dạng response với server.py, nhưng mỗi request là một
+coroutine: chờ MySQL (async_database.py) hay chờ worker inference
+(InferencePool.run_async) không giữ thread nào, nên hàng trăm camera gọi đồng
+thời chỉ cần một event loop và một executor nhỏ cố định. Executor
+(ASYNC_SERVE_THREADS thread) chỉ chạy các việc tốn CPU hoặc còn dùng thư viện
+đồng bộ: hash ảnh/cache embedding, so khớp gallery, dựng JSON của response lớn,
+nạp lại gallery/chỉ mục tên và bulk enroll (các việc này vẫn dùng pool MySQL
+đồng bộ của database.py).
+
+    pip install aiohttp aiomysql
+    INFERENCE_WORKERS=4 INFERENCE_MAX_QUEUE=64 python async_server.py
+"""
+import asyncio
+import logging
+import os
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import aclosing
+
+# Ở chế độ async inference luôn chạy trong pool tiến trình nếu không cấu hình khác
+os.environ.setdefault('INFERENCE_WORKERS', '2')
+
+try:
+    from aiohttp import web
+except ImportError:  # chỉ cần khi chạy chế độ async
+    web = None
+
+from async_database import async_db_manager
+from attendance_stream import (INSERT_EVENT_QUERY, AttendanceStreams, CameraBusy, FrameStreamParser, StreamFormatError,
+                               event_rows, frame_timestamp)
+from bulk_enroll import BULK_ENROLL_CONFIG, ImageSource, bulk_enroll
+from face_pipeline import MIN_DET_SCORE, embed_largest_face, encode_frames_bytes, encode_image_bytes, track_frame_bytes
+from face_gallery import MATCH_THRESHOLD
+from face_templates import (FACE_TEMPLATE_CONFIG, SELECT_STUDENT_TEMPLATES_QUERY, TemplateCaptures, capture_statements,
+                            enroll_statements)
+from inference_pool import INFERENCE_POOL_CONFIG, FutureTimeout, QueueFull
+from metrics import CONTENT_TYPE, HTTP_REQUEST_SECONDS, count_rejection, registry, stage_timer
+from recognition_batcher import BatcherQueueFull
+from server import (ARCHIVE_CONTENT_TYPES, CHANGE_FEED_SETTLE_US, CHANGE_FEED_UPPER_QUERY, DB_CONFIG, ENCODE_FIELDS,
+                    IDENTIFY_BATCH_MAX_FRAMES, IDENTIFY_MAX_FACES_PER_FRAME, INSERT_STUDENT_QUERY,
+                    RAW_IMAGE_CONTENT_TYPES, UPDATE_VECTOR_QUERY, VectorCodecError, apply_vector_updates, app,
+                    base64_to_bytes, build_list_query, changes_args, changes_query, changes_response,
+                    decode_json_frames, decode_string_to_vector, embedding_cache, encode_response, face_gallery,
+                    format_student_vectors, format_vector_output, health_response, identify_params,
+                    identify_batch_response, identify_response, inference_pool, inserted_student_id, list_response,
+                    name_index, parse_templates_input, parse_vector_input, prepare_student_inserts,
+                    prepare_vector_updates, search_query, search_response, split_cached_faces, student_insert_params,
+                    updated_student_id, validate_batch_items, vector_write_params)
+
+logger = logging.getLogger(__name__)
+
+SERVE_HOST = os.environ.get('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.environ.get('SERVE_PORT', 5002))
+ASYNC_SERVE_THREADS = int(os.environ.get('ASYNC_SERVE_THREADS', 4))
+# Số dòng NDJSON gom lại cho mỗi lần ghi xuống socket
+NDJSON_WRITE_ROWS = 200
+
+# Dùng JSON provider của Flask app để response giống hệt server.py (sort_keys, datetime...)
+json_provider = app.json
+
+# Trạng thái track theo camera cho luồng điểm danh, giữ giữa các request của cùng một camera
+attendance_streams = AttendanceStreams(face_gallery)
+# Lưu thêm template từ các lần nhận diện chắc chắn ở luồng điểm danh
+template_captures = TemplateCaptures(face_gallery)
+
+
+def json_response(payload, status=200):
+    return web.Response(text=json_provider.dumps(payload), status=status, content_type='application/json')
+
+
+async def run_blocking(fn, *args):
+    """Chạy hàm đồng bộ trong executor cố định của loop"""
+    return await asyncio.get_running_loop().run_in_executor(None, fn, *args)
+
+
+async def json_response_blocking(payload_fn, *args, status=200):
+    """Dựng và serialize payload lớn (hàng nghìn vector) trong executor, không chặn event loop"""
+    text = await run_blocking(lambda: json_provider.dumps(payload_fn(*args)))
+    return web.Response(text=text, status=status, content_type='application/json')
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except Exception:
+        return None
+
+
+def server_error(e, label):
+    logger.error(f"{label} error: {e}")
+    return json_response({
+        'success': False,
+        'message': f'Lỗi server: {str(e)}'
+    }, 500)
+
+
+def queue_full_response(request, e):
+    logger.warning(f"⏳ {e}, trả 503.")
+    count_rejection(request.match_info.route.name, 503, 'queue_full')
+    return json_response({'success': False, 'message': 'Server đang quá tải, vui lòng thử lại sau.', 'error_code': 503}, 503)
+
+
+def inference_timeout_response(request):
+    logger.warning(f"⏳ Inference quá {INFERENCE_POOL_CONFIG['timeout']}s, trả 504.")
+    count_rejection(request.match_info.route.name, 504, 'inference_timeout')
+    return json_response({'success': False, 'message': 'Xử lý ảnh quá thời gian chờ, vui lòng thử lại sau.',
+                          'error_code': 504}, 504)
+
+
+def decode_json_images(data, fields):
+    with stage_timer('base64_decode'):
+        return {field: (base64_to_bytes(data[field]) or b'') if data.get(field) else None for field in fields}
+
+
+async def read_request_images(request, fields, raw_field):
+    """Bản async của server.read_request_images: multipart, body nhị phân thô hoặc JSON base64"""
+    content_type = request.content_type or ''
+    if content_type.startswith('multipart/'):
+        form = await request.post()
+        if not any(isinstance(value, web.FileField) for value in form.values()):
+            return None, None
+        images = {}
+        for field in fields:
+            part = form.get(field)
+            images[field] = part.file.read() if isinstance(part, web.FileField) else None
+        return images, form
+    if content_type.startswith(RAW_IMAGE_CONTENT_TYPES):
+        data = await request.read()
+        if not data:
+            return None, None
+        images = {field: None for field in fields}
+        images[raw_field] = data
+        return images, request.query
+    body = await request.read()
+    with stage_timer('json_parse'):
+        try:
+            data = json_provider.loads(body) if body else None
+        except ValueError:
+            data = None
+    if not data or not isinstance(data, dict):
+        return None, None
+    # base64 lỗi -> b'' để phân biệt với thiếu ảnh (None), worker sẽ báo không đọc được ảnh (402)
+    return await run_blocking(decode_json_images, data, fields), data
+
+
+async def health_check(request):
+    """Kiểm tra trạng thái API"""
+    pool = async_db_manager.pool_stats()
+    if pool['open'] == 0:
+        try:
+            async with async_db_manager.connection():
+                pass
+        except Exception as e:
+            logger.error(f"Database connection error: {e}")
+        pool = async_db_manager.pool_stats()
+    return json_response(dict(health_response(pool), attendance=attendance_streams.stats(),
+                              face_templates=template_captures.stats()))
+
+
+async def search_student(request):
+    """Tìm kiếm học sinh theo tên (không phân biệt dấu, có phân trang) hoặc ID"""
+    try:
+        if not request.query.get('name') and not request.query.get('id'):
+            return json_response({
+                'success': False,
+                'message': 'Cần cung cấp tên hoặc ID để tìm kiếm'
+            }, 400)
+        try:
+            # Chỉ mục tên có thể phải nạp lại từ database (đồng bộ) nên chạy trong executor
+            query, params, page_ids, limit, offset, total = await run_blocking(search_query, request.query)
+        except ValueError as e:
+            return json_response({
+                'success': False,
+                'message': f'Tham số không hợp lệ: {e}'
+            }, 400)
+
+        results = await async_db_manager.execute_query(query, params) if query else []
+        if results is None:
+            return json_response({
+                'success': False,
+                'message': 'Lỗi truy vấn database'
+            }, 500)
+        return json_response(search_response(results, page_ids, limit, offset, total))
+
+    except Exception as e:
+        return server_error(e, 'Search')
+
+
+async def store_enroll_templates(students):
+    """Như server.store_enroll_templates, ghi qua pool async"""
+    if not FACE_TEMPLATE_CONFIG['enabled'] or not students:
+        return False
+    if await async_db_manager.execute_statements(enroll_statements(students)) is None:
+        logger.error(f"❌ Không ghi được template khuôn mặt của {len(students)} học sinh")
+        face_gallery.invalidate()
+        return False
+    return True
+
+
+async def update_student_vector(request):
+    """Cập nhật vector encode cho học sinh"""
+    try:
+        data = await read_json(request)
+        if not data:
+            return json_response({
+                'success': False,
+                'message': 'Không có dữ liệu được gửi'
+            }, 400)
+
+        student_id = data.get('id')
+        if not student_id:
+            return json_response({
+                'success': False,
+                'message': 'ID học sinh là bắt buộc'
+            }, 400)
+        try:
+            encoded_vector = parse_vector_input(data.get('vector_face'))
+        except VectorCodecError as e:
+            return json_response({
+                'success': False,
+                'message': f'vector_face không hợp lệ: {e}'
+            }, 400)
+        try:
+            templates = parse_templates_input(data.get('templates')) if encoded_vector else []
+        except VectorCodecError as e:
+            return json_response({
+                'success': False,
+                'message': f'templates không hợp lệ: {e}'
+            }, 400)
+
+        result = await async_db_manager.execute_query(
+            UPDATE_VECTOR_QUERY, vector_write_params(encoded_vector) + (student_id,), fetch=False)
+        if result is None:
+            return json_response({
+                'success': False,
+                'message': 'Lỗi cập nhật database'
+            }, 500)
+        if result == 0:
+            return json_response({
+                'success': False,
+                'message': 'Không tìm thấy học sinh'
+            }, 404)
+
+        stored = await store_enroll_templates([(int(student_id), templates)])
+        gallery_templates = [vector for _, vector, _ in templates] if stored else None
+        await run_blocking(lambda: face_gallery.upsert(int(student_id), decode_string_to_vector(encoded_vector),
+                                                       templates=gallery_templates))
+        return json_response({
+            'success': True,
+            'message': 'Cập nhật vector thành công',
+            'updated_rows': result
+        })
+
+    except Exception as e:
+        return server_error(e, 'Update vector')
+
+
+async def update_student_vectors_batch(request):
+    """Cập nhật vector cho nhiều học sinh trong một transaction: {"items": [{"id", "vector_face"}, ...]}"""
+    try:
+        items, message = validate_batch_items(await read_json(request))
+        if message:
+            return json_response({'success': False, 'message': message}, 400)
+
+        results, params = prepare_vector_updates(items)
+        written = await async_db_manager.execute_batch(UPDATE_VECTOR_QUERY, params, restamp=updated_student_id)
+        if written is None:
+            return json_response({
+                'success': False,
+                'message': 'Lỗi cập nhật database'
+            }, 500)
+
+        apply_vector_updates(results, written)
+        updated = sum(1 for result in results if result['success'])
+        if updated:
+            await store_enroll_templates([(int(result['id']), []) for result in results if result['success']])
+            face_gallery.invalidate()
+        return json_response({
+            'success': True,
+            'message': f'Đã cập nhật {updated}/{len(items)} học sinh',
+            'updated_rows': updated,
+            'results': results
+        })
+
+    except Exception as e:
+        return server_error(e, 'Batch update vector')
+
+
+async def create_student(request):
+    """Tạo học sinh mới, trả về id vừa tạo"""
+    try:
+        data = await read_json(request)
+        if not data or not data.get('full_name'):
+            return json_response({
+                'success': False,
+                'message': 'Tên học sinh là bắt buộc'
+            }, 400)
+        try:
+            params = student_insert_params(data)
+        except VectorCodecError as e:
+            return json_response({
+                'success': False,
+                'message': f'vector_face không hợp lệ: {e}'
+            }, 400)
+        try:
+            templates = parse_templates_input(data.get('templates')) if params[5] else []
+        except VectorCodecError as e:
+            return json_response({
+                'success': False,
+                'message': f'templates không hợp lệ: {e}'
+            }, 400)
+
+        student_id = await async_db_manager.execute_insert(INSERT_STUDENT_QUERY, params)
+        if student_id is None:
+            return json_response({
+                'success': False,
+                'message': 'Lỗi tạo học sinh'
+            }, 500)
+
+        name_index.upsert(student_id, params[0])
+        encoded_vector = params[5]
+        if encoded_vector:
+            stored = bool(templates) and await store_enroll_templates([(student_id, templates)])
+            gallery_templates = [vector for _, vector, _ in templates] if stored else None
+            await run_blocking(lambda: face_gallery.upsert(student_id, decode_string_to_vector(encoded_vector),
+                                                           full_name=params[0], templates=gallery_templates))
+        return json_response({
+            'success': True,
+            'message': 'Tạo học sinh thành công',
+            'data': {'id': student_id}
+        })
+
+    except Exception as e:
+        return server_error(e, 'Create student')
+
+
+async def create_students_batch(request):
+    """Tạo nhiều học sinh trong một transaction: {"items": [{"full_name", ...}, ...]}, trả về id theo thứ tự"""
+    try:
+        items, message = validate_batch_items(await read_json(request))
+        if not message:
+            params, message = prepare_student_inserts(items)
+        if message:
+            return json_response({'success': False, 'message': message}, 400)
+
+        written = await async_db_manager.execute_batch(INSERT_STUDENT_QUERY, params, restamp=inserted_student_id)
+        if written is None:
+            return json_response({
+                'success': False,
+                'message': 'Lỗi tạo học sinh'
+            }, 500)
+
+        ids = [lastrowid for _, lastrowid in written]
+        for student_id, row in zip(ids, params):
+            name_index.upsert(student_id, row[0])
+        if any(row[5] for row in params):
+            face_gallery.invalidate()
+        return json_response({
+            'success': True,
+            'message': f'Đã tạo {len(ids)} học sinh',
+            'data': {'ids': ids}
+        })
+
+    except Exception as e:
+        return server_error(e, 'Batch create student')
+
+
+async def get_student_vector(request):
+    """Lấy vector encode của học sinh"""
+    try:
+        student_id = int(request.match_info['student_id'])
+        result = await async_db_manager.execute_query(
+            "SELECT id, full_name, vector_face FROM students WHERE id = %s", (student_id,))
+        if not result:
+            return json_response({
+                'success': False,
+                'message': 'Không tìm thấy học sinh'
+            }, 404)
+
+        student = result[0]
+        student['vector_face'] = format_vector_output(student['vector_face'], request.query.get('vector_format', 'list'))
+        return json_response({
+            'success': True,
+            'data': student
+        })
+
+    except Exception as e:
+        return server_error(e, 'Get vector')
+
+
+async def stream_students_ndjson(request, query, params, vector_format):
+    """Ghi từng học sinh thành một dòng JSON ngay khi đọc được từ cursor không buffer"""
+    response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+    await response.prepare(request)
+    lines = []
+    try:
+        async with aclosing(async_db_manager.iter_query(query, params)) as students:
+            async for student in students:
+                format_student_vectors((student,), vector_format)
+                lines.append(json_provider.dumps(student) + '\n')
+                if len(lines) >= NDJSON_WRITE_ROWS:
+                    await response.write(''.join(lines).encode())
+                    lines = []
+    except (ConnectionResetError, asyncio.CancelledError):
+        raise
+    except Exception as e:
+        logger.error(f"Stream students error: {e}")
+        lines.append(json_provider.dumps({'success': False, 'message': f'Lỗi server: {str(e)}'}) + '\n')
+    if lines:
+        await response.write(''.join(lines).encode())
+    await response.write_eof()
+    return response
+
+
+async def list_students(request):
+    """Lấy thông tin học sinh (tham số như server.list_students)"""
+    try:
+        try:
+            query, params, limit = build_list_query(request.query)
+        except ValueError as e:
+            return json_response({
+                'success': False,
+                'message': f'Tham số không hợp lệ: {e}'
+            }, 400)
+        vector_format = request.query.get('vector_format', 'list')
+
+        if request.query.get('format') == 'ndjson':
+            return await stream_students_ndjson(request, query, params, vector_format)
+
+        results = await async_db_manager.execute_query(query, params)
+        if results is None:
+            return json_response({
+                'success': False,
+                'message': 'Lỗi truy vấn database'
+            }, 500)
+        return await json_response_blocking(list_response, results, vector_format, limit)
+
+    except Exception as e:
+        return server_error(e, 'List students')
+
+
+async def student_changes(request):
+    """Change feed cho camera đồng bộ tăng dần (tham số như server.student_changes)"""
+    try:
+        try:
+            since, after_id, limit, columns = changes_args(request.query)
+        except ValueError as e:
+            return json_response({
+                'success': False,
+                'message': f'Tham số không hợp lệ: {e}'
+            }, 400)
+        vector_format = request.query.get('vector_format', 'list')
+
+        bound = await async_db_manager.execute_query(CHANGE_FEED_UPPER_QUERY, (CHANGE_FEED_SETTLE_US,))
+        if bound is None:
+            return json_response({
+                'success': False,
+                'message': 'Lỗi truy vấn database'
+            }, 500)
+        upper = int(bound[0]['upper'])
+        query, params, deleted_query, deleted_params = changes_query(since, after_id, limit, columns, upper)
+
+        upserts, deleted = await asyncio.gather(async_db_manager.execute_query(query, params),
+                                                async_db_manager.execute_query(deleted_query, deleted_params))
+        if upserts is None or deleted is None:
+            return json_response({
+                'success': False,
+                'message': 'Lỗi truy vấn database'
+            }, 500)
+        return await json_response_blocking(changes_response, upserts, deleted, vector_format, since, upper, limit)
+
+    except Exception as e:
+        return server_error(e, 'Student changes')
+
+
+async def encode_face_from_images_get(request):
+    logger.warning("❌ [GET] /api/face_vector_encode được truy cập bằng GET thay vì POST.")
+    return json_response({
+        'success': False,
+        'message': 'Vui lòng sử dụng phương thức POST với dữ liệu JSON để truy cập API này.',
+        'error_code': 405
+    }, 405)
+
+
+async def encode_face_from_images(request):
+    """API nhận 1-3 ảnh và trả về vector trung bình các mặt hợp lệ (như server.encode_face_from_images)"""
+    try:
+        direction_param = request.query.get('direction', 'front')
+        uploaded, _ = await read_request_images(request, ENCODE_FIELDS, f'image_{direction_param}')
+        if uploaded is None:
+            logger.warning("📭 Không có dữ liệu gửi lên (body rỗng hoặc sai định dạng).")
+            return json_response({'success': False, 'message': 'Không có dữ liệu gửi lên', 'error_code': 400}, 400)
+
+        image_bytes, cached, misses = await run_blocking(split_cached_faces, uploaded)
+        accepted, rejected = [], []
+        if misses:
+            try:
+                accepted, rejected = await inference_pool.run_async(encode_image_bytes, misses, 'largest')
+            except (QueueFull, BatcherQueueFull) as e:
+                return queue_full_response(request, e)
+            except FutureTimeout:
+                return inference_timeout_response(request)
+        payload, status = await run_blocking(encode_response, image_bytes, cached, misses, accepted, rejected)
+        return json_response(payload, status)
+
+    except Exception as e:
+        logger.exception(f"🔥 Lỗi encode face: {e}")
+        return json_response({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}, 500)
+
+
+async def identify_face(request):
+    """API nhận 1 ảnh, trả về top-k học sinh khớp nhất với khuôn mặt lớn nhất (như server.identify_face)"""
+    try:
+        uploaded, data = await read_request_images(request, ['image'], 'image')
+        if uploaded is None or uploaded['image'] is None:
+            logger.warning("📭 Không có ảnh gửi lên để nhận diện.")
+            return json_response({'success': False, 'message': 'Thiếu ảnh cần nhận diện (image)', 'error_code': 400}, 400)
+
+        try:
+            top_k, threshold, _ = identify_params(data, default_top_k=5)
+        except ValueError as e:
+            return json_response({'success': False, 'message': f'Tham số không hợp lệ: {e}', 'error_code': 400}, 400)
+
+        largest_face, error_code = await run_blocking(embedding_cache.get, uploaded['image'], 'largest'), None
+        if largest_face is None:
+            try:
+                largest_face, error_code = await inference_pool.run_async(embed_largest_face, uploaded['image'])
+            except (QueueFull, BatcherQueueFull) as e:
+                return queue_full_response(request, e)
+            except FutureTimeout:
+                return inference_timeout_response(request)
+            if largest_face is not None:
+                await run_blocking(embedding_cache.put, uploaded['image'], 'largest', largest_face)
+        payload, status = await run_blocking(identify_response, largest_face, error_code, top_k, threshold)
+        return json_response(payload, status)
+
+    except Exception as e:
+        logger.exception(f"🔥 Lỗi nhận diện khuôn mặt: {e}")
+        return json_response({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}, 500)
+
+
+async def read_request_frames(request):
+    """Bản async của server.read_request_frames"""
+    content_type = request.content_type or ''
+    if content_type.startswith('multipart/'):
+        form = await request.post()
+        parts = form.getall('images', []) + form.getall('image', [])
+        return [part.file.read() for part in parts if isinstance(part, web.FileField)], form
+    if content_type.startswith(RAW_IMAGE_CONTENT_TYPES):
+        data = await request.read()
+        return ([data] if data else []), request.query
+    body = await request.read()
+    with stage_timer('json_parse'):
+        try:
+            data = json_provider.loads(body) if body else None
+        except ValueError:
+            data = None
+    if not isinstance(data, dict):
+        return [], {}
+    return await run_blocking(decode_json_frames, data), data
+
+
+async def identify_faces_batch(request):
+    """Nhận diện mọi khuôn mặt trong một hoặc nhiều khung hình (như server.identify_faces_batch)"""
+    try:
+        frames, params = await read_request_frames(request)
+        if not frames:
+            logger.warning("📭 Không có khung hình gửi lên để nhận diện.")
+            return json_response({'success': False, 'message': 'Thiếu ảnh cần nhận diện (images)', 'error_code': 400}, 400)
+        if len(frames) > IDENTIFY_BATCH_MAX_FRAMES:
+            return json_response({'success': False, 'message': f'Tối đa {IDENTIFY_BATCH_MAX_FRAMES} khung hình mỗi request',
+                                  'error_code': 400}, 400)
+        try:
+            top_k, threshold, include_embedding = identify_params(params, default_threshold=MATCH_THRESHOLD)
+        except ValueError as e:
+            return json_response({'success': False, 'message': f'Tham số không hợp lệ: {e}', 'error_code': 400}, 400)
+
+        try:
+            results = await inference_pool.run_async(encode_frames_bytes, frames, MIN_DET_SCORE,
+                                                     IDENTIFY_MAX_FACES_PER_FRAME)
+        except (QueueFull, BatcherQueueFull) as e:
+            return queue_full_response(request, e)
+        except FutureTimeout:
+            return inference_timeout_response(request)
+        payload, status = await run_blocking(identify_batch_response, results, top_k, threshold, include_embedding)
+        return json_response(payload, status)
+
+    except Exception as e:
+        logger.exception(f"🔥 Lỗi nhận diện batch: {e}")
+        return json_response({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}, 500)
+
+
+def open_attendance_stream(args, content_type):
+    """Kiểm tra tham số luồng điểm danh, trả về (camera_id, parser, tracker) hoặc (lỗi payload, status)"""
+    camera_id = (args.get('camera_id') or '').strip()
+    if not camera_id or len(camera_id) > 64:
+        return None, ({'success': False, 'message': 'camera_id là bắt buộc (tối đa 64 ký tự)', 'error_code': 400}, 400)
+    try:
+        parser = FrameStreamParser(content_type) if content_type is not None else None
+    except StreamFormatError as e:
+        return None, ({'success': False, 'message': str(e), 'error_code': 400}, 400)
+    try:
+        tracker = attendance_streams.acquire(camera_id)
+    except CameraBusy as e:
+        return None, ({'success': False, 'message': str(e), 'error_code': 409}, 409)
+    return (camera_id, parser, tracker), None
+
+
+def track_frame_args(tracker, data):
+    """Tham số của track_frame_bytes cho khung hình tiếp theo của camera"""
+    return data, tracker.known_boxes(), tracker.config['iou_threshold'], MIN_DET_SCORE
+
+
+def attendance_frame_events(tracker, result, timestamp, counters):
+    """Cập nhật track theo kết quả detect của một khung hình, trả về sự kiện điểm danh mới"""
+    if 'error_code' in result:
+        counters['rejected'] += 1
+        count_rejection('attendance_stream', result['error_code'], result['reason'])
+        return []
+    counters['frames'] += 1
+    with stage_timer('attendance_track'):
+        events = tracker.update(result['faces'], timestamp)
+    counters['events'] += len(events)
+    return events
+
+
+def attendance_summary(tracker, counters):
+    return dict(counters, type='summary', camera_id=tracker.camera_id, camera=dict(tracker.stats))
+
+
+async def attendance_frame(tracker, data, timestamp, counters):
+    """Detect/track một khung hình của luồng điểm danh, ghi và trả về sự kiện mới"""
+    try:
+        result = await inference_pool.run_async(track_frame_bytes, *track_frame_args(tracker, data))
+    except (QueueFull, BatcherQueueFull, FutureTimeout):
+        counters['dropped'] += 1
+        return []
+    # update có thể so khớp gallery (và nạp lại gallery từ database) nên chạy trong executor
+    events = await run_blocking(attendance_frame_events, tracker, result, timestamp, counters)
+    if events and await async_db_manager.execute_batch(INSERT_EVENT_QUERY, event_rows(events)) is None:
+        logger.error(f"❌ Không ghi được {len(events)} sự kiện điểm danh vào database")
+    await store_template_captures(tracker)
+    return events
+
+
+async def store_template_captures(tracker):
+    """Ghi các capture đáng lưu của camera thành template rồi nạp lại template của học sinh vào gallery;
+    chọn capture so với template trong gallery nên chạy trong executor"""
+    for student_id, embedding, score in await run_blocking(template_captures.select, tracker.pop_captures()):
+        if await async_db_manager.execute_statements(capture_statements(student_id, embedding, score)) is None:
+            logger.error(f"❌ Không ghi được template capture của học sinh {student_id}")
+            continue
+        rows = await async_db_manager.execute_query(SELECT_STUDENT_TEMPLATES_QUERY, (student_id,))
+        if rows is not None:
+            await run_blocking(face_gallery.set_templates, student_id,
+                               [decode_string_to_vector(row['vector']) for row in rows])
+
+
+async def attendance_stream(request):
+    """Nhận luồng khung hình của một camera (?camera_id=...) qua chunked HTTP, trả NDJSON
+    các sự kiện điểm danh ngay khi phát hiện và một dòng summary khi luồng kết thúc.
+
+    Khung hình dạng MJPEG (multipart/x-mixed-replace) hoặc 4 byte độ dài + JPEG; xem
+    attendance_stream.py. Camera có thể gửi luồng thành nhiều request ngắn liên tiếp,
+    track được giữ giữa các request. Khi hàng đợi inference đầy, khung hình bị bỏ qua.
+    Chỉ phục vụ ở đây: WSGI server (serve.py) đọc hết body trước khi gọi app nên không
+    xử lý được luồng theo thời gian thực.
+    """
+    opened, error = open_attendance_stream(request.query, request.headers.get('Content-Type', ''))
+    if error:
+        return json_response(*error)
+    camera_id, parser, tracker = opened
+    logger.info(f"📹 Bắt đầu nhận luồng điểm danh của camera {camera_id}")
+    counters = {'frames': 0, 'dropped': 0, 'rejected': 0, 'events': 0}
+    try:
+        response = web.StreamResponse(headers={'Content-Type': 'application/x-ndjson'})
+        await response.prepare(request)
+        try:
+            async for chunk in request.content.iter_any():
+                for data, headers in parser.feed(chunk):
+                    for event in await attendance_frame(tracker, data, frame_timestamp(headers), counters):
+                        await response.write((json_provider.dumps(event) + '\n').encode())
+            for data, headers in parser.close():
+                for event in await attendance_frame(tracker, data, frame_timestamp(headers), counters):
+                    await response.write((json_provider.dumps(event) + '\n').encode())
+        except StreamFormatError as e:
+            await response.write((json_provider.dumps({'type': 'error', 'message': str(e), 'error_code': 400}) + '\n').encode())
+        except (ConnectionResetError, asyncio.CancelledError):
+            raise
+        except Exception as e:
+            logger.exception(f"🔥 Lỗi luồng điểm danh camera {camera_id}: {e}")
+            await response.write((json_provider.dumps({'type': 'error', 'message': f'Lỗi server: {str(e)}',
+                                                       'error_code': 500}) + '\n').encode())
+        logger.info(f"📹 Kết thúc luồng camera {camera_id}: {counters}")
+        await response.write((json_provider.dumps(attendance_summary(tracker, counters)) + '\n').encode())
+        await response.write_eof()
+        return response
+    finally:
+        attendance_streams.release(camera_id)
+
+
+async def attendance_websocket(request):
+    """Luồng điểm danh qua WebSocket (?camera_id=...): mỗi message nhị phân là một ảnh JPEG,
+    server gửi lại mỗi sự kiện là một message JSON và summary khi client đóng kết nối"""
+    opened, error = open_attendance_stream(request.query, None)
+    if error:
+        return json_response(*error)
+    camera_id, _, tracker = opened
+    counters = {'frames': 0, 'dropped': 0, 'rejected': 0, 'events': 0}
+    try:
+        ws = web.WebSocketResponse(max_msg_size=app.config['MAX_CONTENT_LENGTH'])
+        await ws.prepare(request)
+        logger.info(f"📹 Camera {camera_id} kết nối WebSocket điểm danh")
+        async for message in ws:
+            if message.type != web.WSMsgType.BINARY:
+                continue
+            for event in await attendance_frame(tracker, message.data, time.time(), counters):
+                await ws.send_str(json_provider.dumps(event))
+        logger.info(f"📹 Camera {camera_id} ngắt WebSocket: {counters}")
+        if not ws.closed:
+            await ws.send_str(json_provider.dumps(attendance_summary(tracker, counters)))
+            await ws.close()
+        return ws
+    finally:
+        attendance_streams.release(camera_id)
+
+
+async def copy_upload(request, archive):
+    """Chép file nén (multipart ``archive`` hoặc body nhị phân) vào ``archive``; trả False nếu không có file"""
+    limit = BULK_ENROLL_CONFIG['max_upload_bytes']
+    if (request.content_type or '').startswith('multipart/'):
+        reader = await request.multipart()
+        while True:
+            stream = await reader.next()
+            if stream is None:
+                return False
+            if stream.name == 'archive':
+                break
+    elif (request.content_type or '').startswith(ARCHIVE_CONTENT_TYPES):
+        stream = request.content
+    else:
+        return False
+
+    size = 0
+    while True:
+        chunk = await (stream.read_chunk() if hasattr(stream, 'read_chunk') else stream.readany())
+        if not chunk:
+            return True
+        size += len(chunk)
+        if size > limit:
+            raise web.HTTPRequestEntityTooLarge(max_size=limit, actual_size=size)
+        archive.write(chunk)
+
+
+def run_bulk_enroll(archive, dry_run):
+    try:
+        source = ImageSource(fileobj=archive)
+    except ValueError as e:
+        return None, str(e)
+    try:
+        if not source.students:
+            return None, 'Không có ảnh học sinh nào trong file nén'
+        logger.info(f"📦 Bulk enroll {len(source.students)} học sinh (dry_run={dry_run})")
+        config = dict(BULK_ENROLL_CONFIG, concurrency=BULK_ENROLL_CONFIG['concurrency'] or INFERENCE_POOL_CONFIG['workers'])
+        return bulk_enroll(inference_pool.run, source, dry_run=dry_run, config=config), None
+    finally:
+        source.close()
+
+
+async def bulk_enroll_students(request):
+    """API nhận file zip/tar ảnh theo học sinh (như server.bulk_enroll_students).
+
+    Đọc/encode cả file nén là việc đồng bộ dài nên chạy trọn trong một thread của executor.
+    """
+    try:
+        dry_run = request.query.get('dry_run', '0').lower() in ('1', 'true', 'yes')
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as archive:
+            if not await copy_upload(request, archive):
+                return json_response({'success': False, 'message': 'Thiếu file nén ảnh (archive)', 'error_code': 400}, 400)
+            archive.seek(0)
+            try:
+                result, message = await run_blocking(run_bulk_enroll, archive, dry_run)
+            except (QueueFull, BatcherQueueFull) as e:
+                return queue_full_response(request, e)
+            except FutureTimeout:
+                return inference_timeout_response(request)
+        if message:
+            return json_response({'success': False, 'message': message, 'error_code': 400}, 400)
+
+        report, vectors = result
+        if vectors and not dry_run:
+            face_gallery.invalidate()
+        logger.info(f"✅ Bulk enroll xong: {report['summary']}")
+        return json_response({'success': True, 'data': report})
+
+    except web.HTTPException:
+        raise
+    except Exception as e:
+        logger.exception(f"🔥 Lỗi bulk enroll: {e}")
+        return json_response({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}, 500)
+
+
+async def metrics(request):
+    return web.Response(body=registry.render().encode(), headers={'Content-Type': CONTENT_TYPE})
+
+
+if web is not None:
+    @web.middleware
+    async def metrics_middleware(request, handler):
+        """Đo thời gian request theo endpoint, cùng tên endpoint với server.py"""
+        started = time.perf_counter()
+        status = 500
+        try:
+            response = await handler(request)
+            status = response.status
+            return response
+        except web.HTTPException as e:
+            status = e.status
+            raise
+        finally:
+            route = request.match_info.route
+            if route.name != 'metrics':
+                HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=route.name or 'unknown',
+                                             method=request.method, status=status)
+
+
+def create_app():
+    application = web.Application(client_max_size=app.config['MAX_CONTENT_LENGTH'], middlewares=[metrics_middleware])
+    routes = [
+        ('GET', '/api/health', health_check),
+        ('GET', '/api/student/search', search_student),
+        ('POST', '/api/student/update-vector', update_student_vector),
+        ('POST', '/api/student/update-vector/batch', update_student_vectors_batch),
+        ('POST', '/api/student/create', create_student),
+        ('POST', '/api/student/create/batch', create_students_batch),
+        ('GET', '/api/student/get-vector/{student_id:\\d+}', get_student_vector),
+        ('GET', '/api/student/list', list_students),
+        ('GET', '/api/student/changes', student_changes),
+        ('GET', '/api/face_vector_encode', encode_face_from_images_get),
+        ('POST', '/api/face_vector_encode', encode_face_from_images),
+        ('POST', '/api/face/identify', identify_face),
+        ('POST', '/api/face/identify/batch', identify_faces_batch),
+        ('POST', '/api/student/bulk-enroll', bulk_enroll_students),
+        ('POST', '/api/attendance/stream', attendance_stream),
+        ('GET', '/api/attendance/ws', attendance_websocket),
+        ('GET', '/metrics', metrics),
+    ]
+    for method, path, handler in routes:
+        # Tên route = tên hàm, trùng với endpoint Flask để nhãn /metrics giống nhau ở hai chế độ
+        application.router.add_route(method, path, handler, name=handler.__name__)
+
+    async def on_startup(application):
+        loop = asyncio.get_running_loop()
+        loop.set_default_executor(ThreadPoolExecutor(ASYNC_SERVE_THREADS, thread_name_prefix='async-serve'))
+        logger.info(f"🚀 Khởi động {INFERENCE_POOL_CONFIG['workers']} worker inference...")
+        await run_blocking(inference_pool.start)
+
+    async def on_cleanup(application):
+        await async_db_manager.close()
+        await run_blocking(inference_pool.shutdown)
+
+    application.on_startup.append(on_startup)
+    application.on_cleanup.append(on_cleanup)
+    return application
+
+
+def main():
+    if web is None:
+        raise SystemExit('Chế độ async cần aiohttp và aiomysql: pip install aiohttp aiomysql')
+    logger.info(f"Database Host: {DB_CONFIG['host']}:{DB_CONFIG['port']}")
+    logger.info(f"🚀 Server async chạy tại http://{SERVE_HOST}:{SERVE_PORT} "
+                f"(executor {ASYNC_SERVE_THREADS} thread)")
+    web.run_app(create_app(), host=SERVE_HOST, port=SERVE_PORT, print=None)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,356 @@
+"""Nhận luồng khung hình từ camera và sinh sự kiện điểm danh đã khử trùng lặp.
+
+Mỗi khung hình chỉ chạy detect; khuôn mặt được nối qua các khung hình bằng IoU
+của bbox (track), và recognition chỉ chạy cho track mới hoặc track chưa nhận
+ra ai (tối đa ``max_attempts`` lần, cách nhau ``retry_frames`` khung hình).
+Track mất dấu vài giây rồi xuất hiện lại được nối lại bằng embedding nên không
+sinh sự kiện mới. Sự kiện "học sinh X xuất hiện lúc T" của cùng một camera chỉ
+phát lại sau ``dedup_seconds``.
+
+Khung hình gửi lên theo một trong hai dạng:
+- ``multipart/x-mixed-replace; boundary=...`` (MJPEG, vd. ``ffmpeg -f mpjpeg``),
+  mỗi part có thể kèm header ``X-Timestamp`` (giây epoch)
+- ``application/octet-stream``: mỗi khung hình là 4 byte độ dài (big-endian) + ảnh JPEG
+
+Cấu hình qua biến môi trường ATTENDANCE_*, xem ATTENDANCE_CONFIG.
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+from face_gallery import MATCH_THRESHOLD, l2_normalize
+from face_pipeline import box_iou
+from image_preprocess import IMAGE_MAX_BYTES
+
+logger = logging.getLogger(__name__)
+
+ATTENDANCE_CONFIG = {
+    # IoU tối thiểu để coi detection là cùng track với khung hình trước
+    'iou_threshold': float(os.environ.get('ATTENDANCE_IOU_THRESHOLD', 0.3)),
+    # Track không thấy quá số khung hình này thì coi là mất dấu
+    'max_missed_frames': int(os.environ.get('ATTENDANCE_MAX_MISSED_FRAMES', 10)),
+    # Track mất dấu được giữ để nối lại bằng embedding trong số giây này
+    'reid_seconds': float(os.environ.get('ATTENDANCE_REID_SECONDS', 10)),
+    'reid_threshold': float(os.environ.get('ATTENDANCE_REID_THRESHOLD', 0.6)),
+    # Điểm cosine tối thiểu với gallery để tính là đã nhận ra học sinh (mặc định FACE_MATCH_THRESHOLD)
+    'match_threshold': float(os.environ.get('ATTENDANCE_MATCH_THRESHOLD', MATCH_THRESHOLD)),
+    'retry_frames': int(os.environ.get('ATTENDANCE_RETRY_FRAMES', 5)),
+    'max_attempts': int(os.environ.get('ATTENDANCE_MAX_ATTEMPTS', 3)),
+    # Cùng học sinh, cùng camera: không phát sự kiện mới trong số giây này
+    'dedup_seconds': float(os.environ.get('ATTENDANCE_DEDUP_SECONDS', 300)),
+    # Trạng thái track của camera bị xóa sau số giây không có khung hình nào
+    'idle_seconds': float(os.environ.get('ATTENDANCE_IDLE_SECONDS', 60)),
+}
+
+INSERT_EVENT_QUERY = ("INSERT INTO attendance_events (camera_id, student_id, score, seen_at, track_id) "
+                      "VALUES (%s, %s, %s, %s, %s)")
+
+
+class StreamFormatError(ValueError):
+    pass
+
+
+class FrameStreamParser:
+    """Tách luồng byte nhận dần (chunked HTTP) thành các khung hình (bytes, headers)"""
+
+    def __init__(self, content_type, max_frame_bytes=IMAGE_MAX_BYTES):
+        self.max_frame_bytes = max_frame_bytes
+        self._buffer = bytearray()
+        self._boundary = None
+        mimetype, _, options = (content_type or '').partition(';')
+        if mimetype.strip().startswith('multipart/'):
+            for option in options.split(';'):
+                key, _, value = option.strip().partition('=')
+                if key.lower() == 'boundary' and value:
+                    self._boundary = b'--' + value.strip('"').encode()
+            if self._boundary is None:
+                raise StreamFormatError('Thiếu boundary của multipart')
+
+    def feed(self, chunk):
+        self._buffer += chunk
+        frames = []
+        while True:
+            frame = self._next_multipart() if self._boundary else self._next_length_prefixed()
+            if frame is None:
+                break
+            frames.append(frame)
+        if len(self._buffer) > self.max_frame_bytes + 4096:
+            raise StreamFormatError(f'Khung hình vượt quá {self.max_frame_bytes} byte')
+        return frames
+
+    def close(self):
+        """Kết thúc luồng: trả về khung multipart cuối nếu chưa có boundary đóng (MJPEG không Content-Length)"""
+        frames = []
+        if self._boundary and self._buffer.find(self._boundary) >= 0:
+            self._buffer += b'\r\n' + self._boundary
+            frame = self._next_multipart()
+            if frame is not None and frame[0]:
+                frames.append(frame)
+        self._buffer.clear()
+        return frames
+
+    def _next_length_prefixed(self):
+        if len(self._buffer) < 4:
+            return None
+        length = int.from_bytes(self._buffer[:4], 'big')
+        if length > self.max_frame_bytes:
+            raise StreamFormatError(f'Khung hình vượt quá {self.max_frame_bytes} byte')
+        if len(self._buffer) < 4 + length:
+            return None
+        data = bytes(self._buffer[4:4 + length])
+        del self._buffer[:4 + length]
+        return data, {}
+
+    def _next_multipart(self):
+        start = self._buffer.find(self._boundary)
+        if start < 0:
+            return None
+        header_end = self._buffer.find(b'\r\n\r\n', start)
+        if header_end < 0:
+            return None
+        headers = {}
+        for line in bytes(self._buffer[start + len(self._boundary):header_end]).decode('latin-1').split('\r\n'):
+            key, sep, value = line.partition(':')
+            if sep:
+                headers[key.strip().lower()] = value.strip()
+        body_start = header_end + 4
+        if 'content-length' in headers:
+            end = body_start + int(headers['content-length'])
+            if len(self._buffer) < end:
+                return None
+        else:
+            end = self._buffer.find(b'\r\n' + self._boundary, body_start)
+            if end < 0:
+                return None
+        data = bytes(self._buffer[body_start:end])
+        del self._buffer[:end]
+        return data, headers
+
+
+def frame_timestamp(headers):
+    try:
+        return float(headers['x-timestamp'])
+    except (KeyError, ValueError):
+        return time.time()
+
+
+class Track:
+    __slots__ = ('track_id', 'bbox', 'embedding', 'student_id', 'full_name', 'score',
+                 'last_seen', 'missed', 'attempts', 'last_attempt_frame')
+
+    def __init__(self, track_id, bbox, timestamp):
+        self.track_id = track_id
+        self.bbox = bbox
+        self.embedding = None
+        self.student_id = None
+        self.full_name = None
+        self.score = None
+        self.last_seen = timestamp
+        self.missed = 0
+        self.attempts = 0
+        self.last_attempt_frame = None
+
+
+class AttendanceLog:
+    """Nhớ lần cuối mỗi (camera, học sinh) được điểm danh để bỏ sự kiện trùng trong dedup_seconds"""
+
+    def __init__(self, dedup_seconds):
+        self.dedup_seconds = dedup_seconds
+        self._last_seen = {}
+        self._lock = threading.Lock()
+
+    def should_emit(self, camera_id, student_id, timestamp):
+        key = (camera_id, student_id)
+        with self._lock:
+            last = self._last_seen.get(key)
+            # Chỉ ghi nhận lần được phát sự kiện, nếu không cửa sổ sẽ trượt theo mỗi lần bị bỏ
+            # và học sinh được track lại liên tục sẽ không bao giờ có sự kiện mới
+            if last is not None and timestamp - last < self.dedup_seconds:
+                return False
+            self._last_seen[key] = timestamp
+            if len(self._last_seen) > 100000:
+                # Dọn các mục đã quá hạn để bộ nhớ không tăng mãi
+                cutoff = timestamp - self.dedup_seconds
+                self._last_seen = {k: t for k, t in self._last_seen.items() if t >= cutoff}
+            return True
+
+
+class FaceTracker:
+    """Trạng thái track của một camera; gọi ``known_boxes`` trước và ``update`` sau mỗi khung hình"""
+
+    def __init__(self, camera_id, gallery, log, config=None):
+        self.camera_id = camera_id
+        self.config = config or ATTENDANCE_CONFIG
+        self._gallery = gallery
+        self._log = log
+        self._tracks = []
+        self._lost = []
+        self._next_id = 1
+        self.frame_index = 0
+        self.last_active = time.monotonic()
+        # Nhận diện thành công chưa xử lý (student_id, embedding, score), xem pop_captures
+        self._captures = []
+        self.stats = {'frames': 0, 'faces': 0, 'recognitions': 0, 'tracks': 0, 'reidentified': 0, 'events': 0}
+
+    def _needs_embedding(self, track):
+        if track.student_id is not None or track.attempts >= self.config['max_attempts']:
+            return False
+        return (track.last_attempt_frame is None
+                or self.frame_index - track.last_attempt_frame >= self.config['retry_frames'])
+
+    def known_boxes(self):
+        """bbox của các track không cần recognition ở khung hình tới (worker bỏ qua các mặt trùng)"""
+        boxes = [track.bbox for track in self._tracks if not self._needs_embedding(track)]
+        return np.array(boxes, dtype=np.float32).reshape(-1, 4)
+
+    def _reidentify(self, embedding):
+        """Nối lại track vừa mất dấu có embedding giống nhất, None nếu không có"""
+        candidates = [t for t in self._lost if t.embedding is not None]
+        if not candidates:
+            return None
+        scores = l2_normalize(np.stack([t.embedding for t in candidates])) @ l2_normalize(embedding)
+        best = int(np.argmax(scores))
+        if scores[best] < self.config['reid_threshold']:
+            return None
+        track = candidates[best]
+        self._lost.remove(track)
+        self.stats['reidentified'] += 1
+        return track
+
+    def update(self, faces, timestamp):
+        """Cập nhật track theo các mặt của khung hình (kết quả track_frame_bytes), trả về sự kiện mới"""
+        self.frame_index += 1
+        self.stats['frames'] += 1
+        self.stats['faces'] += len(faces)
+        self.last_active = time.monotonic()
+
+        matched_tracks, matched_faces = set(), set()
+        if self._tracks and faces:
+            iou = box_iou(np.stack([t.bbox for t in self._tracks]), np.stack([f['bbox'] for f in faces]))
+            # Ghép tham lam theo IoU giảm dần
+            for flat in np.argsort(-iou, axis=None):
+                ti, fi = divmod(int(flat), iou.shape[1])
+                if iou[ti, fi] < self.config['iou_threshold']:
+                    break
+                if ti in matched_tracks or fi in matched_faces:
+                    continue
+                matched_tracks.add(ti)
+                matched_faces.add(fi)
+                self._attach(self._tracks[ti], faces[fi], timestamp)
+
+        alive = []
+        for index, track in enumerate(self._tracks):
+            if index not in matched_tracks:
+                track.missed += 1
+                if track.missed > self.config['max_missed_frames']:
+                    self._lost.append(track)
+                    continue
+            alive.append(track)
+        self._tracks = alive
+        self._lost = [t for t in self._lost if timestamp - t.last_seen <= self.config['reid_seconds']]
+
+        for index, face in enumerate(faces):
+            if index in matched_faces:
+                continue
+            track = self._reidentify(face['embedding']) if face['embedding'] is not None else None
+            if track is None:
+                track = Track(self._next_id, face['bbox'], timestamp)
+                self._next_id += 1
+                self.stats['tracks'] += 1
+            track.missed = 0
+            self._attach(track, face, timestamp)
+            self._tracks.append(track)
+
+        return self._identify(timestamp)
+
+    def _attach(self, track, face, timestamp):
+        track.bbox = face['bbox']
+        track.last_seen = timestamp
+        track.missed = 0
+        if face['embedding'] is not None and track.student_id is None:
+            track.embedding = face['embedding']
+            track.last_attempt_frame = self.frame_index
+            track.attempts += 1
+
+    def _identify(self, timestamp):
+        """So khớp gallery một lần cho mọi track vừa có embedding mới và chưa biết là ai"""
+        pending = [t for t in self._tracks if t.student_id is None and t.last_attempt_frame == self.frame_index]
+        if not pending:
+            return []
+        self.stats['recognitions'] += len(pending)
+        matches = self._gallery.search_batch(np.stack([t.embedding for t in pending]), top_k=1)
+        events = []
+        for track, candidates in zip(pending, matches):
+            if not candidates or candidates[0]['score'] < self.config['match_threshold']:
+                continue
+            best = candidates[0]
+            track.student_id, track.full_name, track.score = best['id'], best['full_name'], best['score']
+            self._captures.append((track.student_id, track.embedding, track.score))
+            if self._log.should_emit(self.camera_id, track.student_id, timestamp):
+                self.stats['events'] += 1
+                events.append({
+                    'type': 'attendance',
+                    'camera_id': self.camera_id,
+                    'student_id': track.student_id,
+                    'full_name': track.full_name,
+                    'score': track.score,
+                    'track_id': track.track_id,
+                    'bbox': [float(x) for x in track.bbox],
+                    'timestamp': timestamp,
+                    'seen_at': datetime.fromtimestamp(timestamp).isoformat(timespec='milliseconds'),
+                })
+        return events
+
+    def pop_captures(self):
+        """Lấy và xóa các lần nhận diện thành công kể từ lần gọi trước (ứng viên template, xem face_templates)"""
+        captures, self._captures = self._captures, []
+        return captures
+
+
+class CameraBusy(Exception):
+    pass
+
+
+class AttendanceStreams:
+    """Giữ FaceTracker theo camera_id giữa các request (camera gửi từng đoạn luồng ngắn),
+    mỗi camera chỉ một luồng tại một thời điểm"""
+
+    def __init__(self, gallery, config=None):
+        self.config = config or ATTENDANCE_CONFIG
+        self._gallery = gallery
+        self.log = AttendanceLog(self.config['dedup_seconds'])
+        self._trackers = {}
+        self._busy = set()
+        self._lock = threading.Lock()
+
+    def acquire(self, camera_id):
+        now = time.monotonic()
+        with self._lock:
+            if camera_id in self._busy:
+                raise CameraBusy(f'Camera {camera_id} đang có một luồng khác')
+            for key in [k for k, t in self._trackers.items()
+                        if k not in self._busy and now - t.last_active > self.config['idle_seconds']]:
+                del self._trackers[key]
+            tracker = self._trackers.get(camera_id)
+            if tracker is None:
+                tracker = self._trackers[camera_id] = FaceTracker(camera_id, self._gallery, self.log, self.config)
+            self._busy.add(camera_id)
+            return tracker
+
+    def release(self, camera_id):
+        with self._lock:
+            self._busy.discard(camera_id)
+
+    def stats(self):
+        with self._lock:
+            return {'cameras': len(self._trackers), 'streaming': len(self._busy)}
+
+
+def event_rows(events):
+    """Tham số INSERT_EVENT_QUERY cho các sự kiện"""
+    return [(e['camera_id'], e['student_id'], e['score'], datetime.fromtimestamp(e['timestamp']), e['track_id'])
+            for e in events]
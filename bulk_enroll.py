@@ -0,0 +1,290 @@
+"""Đăng ký khuôn mặt hàng loạt từ thư mục hoặc file nén ảnh theo từng học sinh.
+
+Bố cục ảnh được chấp nhận (id là students.id, hướng là front/left/right):
+
+    <id>/front.jpg, <id>/left.jpg, <id>/right.jpg
+    <id>_front.jpg, <id>_left.jpg, <id>_right.jpg
+    <id>.jpg                                        (chỉ ảnh front)
+
+Ảnh của nhiều học sinh được gom thành một việc cho inference pool (một lần chạy
+recognition cho cả nhóm), các nhóm chạy song song trên các worker. Vector được ghi
+bằng ``executemany`` theo từng phần ``write_chunk`` học sinh, mỗi phần một transaction
+ngắn để version commit kịp trong cửa sổ CHANGE_FEED_SETTLE_MS của change feed; mỗi
+ảnh hợp lệ được lưu thêm thành template theo hướng (xem face_templates.py); kết quả
+trả về là báo cáo thành công/thất bại của từng học sinh.
+
+Cách dùng:
+    python bulk_enroll.py anh_hoc_sinh/                 # thư mục
+    python bulk_enroll.py truong_abc.zip --report out.json
+    python bulk_enroll.py truong_abc.tar.gz --dry-run   # chỉ encode, không ghi database
+"""
+import argparse
+import json
+import logging
+import os
+import os.path as osp
+import tarfile
+import time
+import zipfile
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from operator import itemgetter
+
+import numpy as np
+
+from database import UPDATE_VECTOR_QUERY, VECTOR_STORAGE_DTYPE, db_manager, vector_write_params
+from face_pipeline import MIN_DET_SCORE, encode_image_bytes
+from face_templates import FACE_TEMPLATE_CONFIG, enroll_statements
+from vector_codec import encode_vector
+
+logger = logging.getLogger(__name__)
+
+BULK_ENROLL_CONFIG = {
+    # Số học sinh gom trong một việc gửi inference pool (tối đa 3 ảnh mỗi học sinh)
+    'students_per_batch': int(os.environ.get('BULK_ENROLL_BATCH', 16)),
+    # Số việc chạy đồng thời (0 = bằng số worker inference, tối thiểu 1)
+    'concurrency': int(os.environ.get('BULK_ENROLL_CONCURRENCY', 0)),
+    # Dung lượng tối đa file nén gửi lên API (trường học lớn nên dùng CLI)
+    'max_upload_bytes': int(os.environ.get('BULK_ENROLL_MAX_UPLOAD_MB', 1024)) * 1024 * 1024,
+    # Số học sinh ghi trong một transaction
+    'write_chunk': int(os.environ.get('BULK_ENROLL_WRITE_CHUNK', 200)),
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.bmp')
+DIRECTIONS = ('front', 'left', 'right')
+ID_CHUNK = 1000
+
+
+def parse_image_path(path):
+    """Tên file trong thư mục/file nén -> (student_key, direction); None nếu không phải ảnh học sinh"""
+    path = path.replace('\\', '/')
+    stem, ext = osp.splitext(osp.basename(path))
+    if ext.lower() not in IMAGE_EXTENSIONS or stem.startswith('.'):
+        return None
+    if stem.lower() in DIRECTIONS:
+        parent = osp.basename(osp.dirname(path))
+        return (parent, stem.lower()) if parent else None
+    if '_' in stem:
+        key, direction = stem.rsplit('_', 1)
+        if direction.lower() in DIRECTIONS:
+            return key, direction.lower()
+    return stem, 'front'
+
+
+class ImageSource:
+    """Danh sách ảnh theo học sinh; bytes ảnh chỉ được đọc khi tới lượt encode"""
+
+    def __init__(self, path=None, fileobj=None):
+        self._zip = self._tar = None
+        self._root = None
+        if path is not None and osp.isdir(path):
+            self._root = path
+            names = [osp.relpath(osp.join(d, f), path) for d, _, files in os.walk(path) for f in files]
+        elif zipfile.is_zipfile(fileobj if fileobj is not None else path):
+            self._zip = zipfile.ZipFile(fileobj if fileobj is not None else path)
+            names = [info.filename for info in self._zip.infolist() if not info.is_dir()]
+        else:
+            if fileobj is not None:
+                fileobj.seek(0)
+            try:
+                self._tar = tarfile.open(name=path, fileobj=fileobj)
+            except tarfile.TarError:
+                raise ValueError('Không nhận ra file nén (chỉ hỗ trợ thư mục, zip, tar, tar.gz)')
+            names = [member.name for member in self._tar.getmembers() if member.isfile()]
+
+        self.students = {}
+        for name in sorted(names):
+            parsed = parse_image_path(name)
+            if parsed is None:
+                continue
+            key, direction = parsed
+            # Trùng hướng (vd. front.jpg và front.png): giữ file đầu tiên theo thứ tự tên
+            self.students.setdefault(key, {}).setdefault(direction, name)
+
+    def read(self, name):
+        if self._root is not None:
+            with open(osp.join(self._root, name), 'rb') as f:
+                return f.read()
+        if self._zip is not None:
+            return self._zip.read(name)
+        return self._tar.extractfile(name).read()
+
+    def close(self):
+        for archive in (self._zip, self._tar):
+            if archive is not None:
+                archive.close()
+
+
+def encode_student_batch(face_app, students, min_det_score=MIN_DET_SCORE):
+    """Chạy trong inference pool: [(student_id, [(direction, bytes)])] -> kết quả theo học sinh.
+
+    Ảnh của cả nhóm đi qua một lần encode_image_bytes, tức một batch recognition.
+    """
+    images = [((student_id, direction), data) for student_id, items in students for direction, data in items]
+    accepted, rejected = encode_image_bytes(face_app, images, select='largest', min_det_score=min_det_score,
+                                            quality_direction=itemgetter(1))
+
+    results = {student_id: {'id': student_id, 'used_directions': [], 'rejected': [], 'templates': []}
+               for student_id, _ in students}
+    for face in accepted:
+        student_id, direction = face['direction']
+        results[student_id]['used_directions'].append(direction)
+        results[student_id]['templates'].append((direction, face['embedding'], face['det_score']))
+    for item in rejected:
+        student_id, direction = item['direction']
+        results[student_id]['rejected'].append({'direction': direction, 'error_code': item['error_code'],
+                                                'reason': item['reason']})
+
+    for result in results.values():
+        embeddings = [embedding for _, embedding, _ in result['templates']]
+        result['vector'] = np.mean(embeddings, axis=0) if embeddings else None
+    return list(results.values())
+
+
+def existing_student_ids(student_ids):
+    """Các id có trong bảng students; None nếu lỗi database"""
+    found = set()
+    student_ids = sorted(student_ids)
+    for start in range(0, len(student_ids), ID_CHUNK):
+        chunk = student_ids[start:start + ID_CHUNK]
+        rows = db_manager.execute_query(
+            f"SELECT id FROM students WHERE id IN ({', '.join(['%s'] * len(chunk))})", tuple(chunk))
+        if rows is None:
+            return None
+        found.update(row['id'] for row in rows)
+    return found
+
+
+def write_vectors(vectors, report, chunk_size):
+    """Ghi {student_id: vector} theo từng phần ``chunk_size`` học sinh, mỗi phần một transaction.
+
+    Học sinh thuộc phần ghi lỗi được đánh dấu db_error trong ``report``; trả về vectors đã ghi.
+    """
+    written = {}
+    student_ids = list(vectors)
+    for start in range(0, len(student_ids), chunk_size):
+        chunk = student_ids[start:start + chunk_size]
+        rows = [vector_write_params(encode_vector(vectors[student_id], dtype=VECTOR_STORAGE_DTYPE)) + (student_id,)
+                for student_id in chunk]
+        if db_manager.execute_many(UPDATE_VECTOR_QUERY, rows) is None:
+            failed = set(chunk)
+            for result in report:
+                if result['id'] in failed:
+                    result.update({'status': 'db_error', 'message': 'Lỗi ghi database, học sinh chưa được cập nhật'})
+            continue
+        written.update((student_id, vectors[student_id]) for student_id in chunk)
+    return written
+
+
+def bulk_enroll(run, source, dry_run=False, config=None):
+    """Encode mọi học sinh trong ``source`` qua ``run(fn, *args)`` (InferencePool.run) rồi ghi vector.
+
+    Trả về (report, vectors): report gồm summary và students (trạng thái từng học sinh),
+    vectors là {student_id: vector} của các học sinh đã ghi.
+    """
+    config = config or BULK_ENROLL_CONFIG
+    started = time.perf_counter()
+    report = []
+
+    # Học sinh có tên thư mục/file không phải id số hoặc không tồn tại: báo lỗi, không encode
+    candidates = {}
+    for key, files in source.students.items():
+        try:
+            candidates[int(key)] = files
+        except ValueError:
+            report.append({'id': key, 'status': 'invalid_id', 'message': 'Tên thư mục/file không phải ID học sinh'})
+    existing = existing_student_ids(candidates) if candidates else set()
+    if existing is None:
+        raise RuntimeError('Không kiểm tra được danh sách học sinh trong database')
+    for student_id in sorted(set(candidates) - existing):
+        report.append({'id': student_id, 'status': 'not_found', 'message': 'Không tìm thấy học sinh'})
+    student_ids = sorted(existing)
+
+    batch_size = max(1, config['students_per_batch'])
+    concurrency = max(1, config['concurrency'])
+    encoded = []
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        pending = set()
+        for start in range(0, len(student_ids), batch_size):
+            # Bytes ảnh được đọc ở đây theo từng nhóm để bộ nhớ không phụ thuộc số học sinh
+            batch = [(student_id, [(direction, source.read(name))
+                                   for direction, name in sorted(candidates[student_id].items(),
+                                                                 key=lambda item: DIRECTIONS.index(item[0]))])
+                     for student_id in student_ids[start:start + batch_size]]
+            pending.add(executor.submit(run, encode_student_batch, batch))
+            if len(pending) >= concurrency * 2:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    encoded.extend(future.result())
+            logger.info(f"📦 Đã gửi encode {min(start + batch_size, len(student_ids))}/{len(student_ids)} học sinh")
+        for future in pending:
+            encoded.extend(future.result())
+    encode_seconds = time.perf_counter() - started
+
+    vectors, templates = {}, {}
+    for result in encoded:
+        templates[result['id']] = result.pop('templates')
+        vector = result.pop('vector')
+        if vector is None:
+            result.update({'status': 'no_valid_face', 'message': 'Không có ảnh hợp lệ nào để lấy embedding'})
+        else:
+            result['status'] = 'dry_run' if dry_run else 'updated'
+            vectors[result['id']] = vector
+        report.append(result)
+
+    if vectors and not dry_run:
+        vectors = write_vectors(vectors, report, max(1, config['write_chunk']))
+        if vectors and FACE_TEMPLATE_CONFIG['enabled']:
+            # Mỗi ảnh hợp lệ thành một template theo hướng, thay cho template cũ của học sinh
+            statements = enroll_statements([(student_id, templates[student_id]) for student_id in vectors])
+            if db_manager.execute_statements(statements) is None:
+                logger.error(f"❌ Không ghi được template khuôn mặt của {len(vectors)} học sinh")
+
+    summary = {'students': len(report), 'images': sum(len(files) for files in source.students.values()),
+               'encode_seconds': round(encode_seconds, 2),
+               'total_seconds': round(time.perf_counter() - started, 2)}
+    for result in report:
+        summary[result['status']] = summary.get(result['status'], 0) + 1
+    report.sort(key=lambda result: str(result['id']))
+    return {'summary': summary, 'students': report}, vectors
+
+
+def main():
+    from inference_pool import INFERENCE_POOL_CONFIG, InferencePool
+    from face_models import FACE_MODEL_CONFIG, FaceModelManager
+
+    parser = argparse.ArgumentParser(description='Đăng ký khuôn mặt hàng loạt từ thư mục hoặc file nén')
+    parser.add_argument('source', help='Thư mục hoặc file zip/tar chứa ảnh theo học sinh')
+    parser.add_argument('--workers', type=int, default=INFERENCE_POOL_CONFIG['workers'] or os.cpu_count() or 1,
+                        help='Số tiến trình inference (0 = chạy trong tiến trình hiện tại)')
+    parser.add_argument('--batch-size', type=int, default=BULK_ENROLL_CONFIG['students_per_batch'],
+                        help='Số học sinh mỗi batch inference')
+    parser.add_argument('--report', help='Ghi báo cáo JSON ra file')
+    parser.add_argument('--dry-run', action='store_true', help='Chỉ encode, không ghi database')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    pool_config = dict(INFERENCE_POOL_CONFIG, workers=args.workers, timeout=None,
+                       max_queue=max(1, args.workers) * 2)
+    pool = InferencePool(FaceModelManager(FACE_MODEL_CONFIG), pool_config)
+    source = ImageSource(path=args.source)
+    logger.info(f"🚀 {len(source.students)} học sinh, {args.workers} worker, {args.batch_size} học sinh/batch")
+    try:
+        pool.start()
+        report, _ = bulk_enroll(pool.run, source, dry_run=args.dry_run,
+                                config=dict(BULK_ENROLL_CONFIG, students_per_batch=args.batch_size,
+                                            concurrency=max(1, args.workers)))
+    finally:
+        source.close()
+        pool.shutdown()
+
+    for result in report['students']:
+        if result['status'] not in ('updated', 'dry_run'):
+            logger.warning(f"❌ Học sinh {result['id']}: {result['status']} {result.get('message', '')} {result.get('rejected', '')}")
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    logger.info(f"✅ Hoàn tất: {report['summary']}")
+
+
+if __name__ == '__main__':
+    main()
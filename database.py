@@ -0,0 +1,369 @@
+import mysql.connector
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from metrics import observe_stages, stage_timer
+from vector_codec import vector_metadata
+
+logger = logging.getLogger(__name__)
+
+# Cấu hình database - CẬP NHẬT
+DB_CONFIG = {
+    'host': '172.16.33.4',
+    'port': 3306,
+    'user': 'tranmanh_cameraai',
+    'password': 'nWoNuPubC',
+    'database': 'tranmanh_cameraai',
+    'charset': 'utf8mb4'
+}
+
+# Cấu hình connection pool
+DB_POOL_CONFIG = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+    # Thời gian tối đa (giây) chờ lấy connection khi pool đã dùng hết
+    'checkout_timeout': float(os.environ.get('DB_POOL_CHECKOUT_TIMEOUT', 5)),
+    # Connection rảnh quá số giây này sẽ được ping trước khi cho mượn
+    'ping_after': float(os.environ.get('DB_POOL_PING_AFTER', 30)),
+    # Connection sống quá số giây này sẽ bị đóng và tạo lại
+    'max_lifetime': float(os.environ.get('DB_POOL_MAX_LIFETIME', 3600)),
+}
+
+# Kiểu dữ liệu lưu vector_face trong database (float32 hoặc float16)
+VECTOR_STORAGE_DTYPE = os.environ.get('VECTOR_STORAGE_DTYPE', 'float32')
+
+# version của bảng students (micro giây epoch) lấy theo đồng hồ database, cùng biểu thức với trigger
+# ở migrations/001_student_version.sql, nên ghi qua API và sửa trực tiếp trong database so sánh được với nhau
+STUDENT_VERSION_SQL = "CAST(UNIX_TIMESTAMP(NOW(6)) * 1000000 AS UNSIGNED)"
+
+# Ghi vector_face luôn kèm metadata (migrations/002_vector_metadata.sql) để API đọc không phải giải mã vector
+UPDATE_VECTOR_QUERY = ("UPDATE students SET vector_face = %s, vector_dim = %s, vector_dtype = %s, "
+                       f"vector_norm = %s, vector_checksum = %s, version = {STUDENT_VERSION_SQL} WHERE id = %s")
+
+
+def vector_write_params(encoded_vector):
+    """(vector_face, vector_dim, vector_dtype, vector_norm, vector_checksum) để ghi vào bảng students"""
+    return (encoded_vector,) + vector_metadata(encoded_vector)
+
+
+def restamp_version_query(count):
+    """UPDATE đóng dấu lại version của ``count`` học sinh theo thời điểm chạy câu lệnh"""
+    return f"UPDATE students SET version = {STUDENT_VERSION_SQL} WHERE id IN ({', '.join(['%s'] * count)})"
+
+
+def restamp_ids(params_seq, results, restamp):
+    """Id học sinh cần đóng dấu lại version: ``restamp(params, lastrowid)`` của các dòng có ghi"""
+    return [restamp(params, lastrowid) for params, (rowcount, lastrowid) in zip(params_seq, results) if rowcount > 0]
+
+
+# Lỗi cho thấy connection đã hỏng, không được trả lại pool
+STALE_CONNECTION_ERRORS = (mysql.connector.errors.OperationalError, mysql.connector.errors.InterfaceError)
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _PooledConnection:
+    __slots__ = ('connection', 'created_at', 'last_used')
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.created_at = self.last_used = time.monotonic()
+
+
+class DatabaseManager:
+    def __init__(self, config=None, pool_config=None):
+        self.config = config or DB_CONFIG
+        self.pool_config = pool_config or DB_POOL_CONFIG
+        self._idle = deque()
+        self._cond = threading.Condition()
+        self._open = 0
+        self._in_use = 0
+        self._last_error = None
+        self._metrics = {
+            'checkouts': 0,
+            'waits': 0,
+            'timeouts': 0,
+            'connects': 0,
+            'reconnects': 0,
+            'discarded': 0,
+            'checkout_seconds_total': 0.0,
+            'checkout_seconds_max': 0.0,
+        }
+
+    def get_connection(self):
+        """Mở một connection riêng, không qua pool (dùng cho script chạy một lần)"""
+        try:
+            connection = mysql.connector.connect(**self.config)
+            self._last_error = None
+            return connection
+        except Exception as e:
+            self._last_error = str(e)
+            logger.error(f"Database connection error: {e}")
+            return None
+
+    def _connect(self):
+        with stage_timer('db_connect'):
+            connection = mysql.connector.connect(**self.config)
+        with self._cond:
+            self._metrics['connects'] += 1
+        self._last_error = None
+        return _PooledConnection(connection)
+
+    def _is_healthy(self, pooled):
+        now = time.monotonic()
+        if now - pooled.created_at > self.pool_config['max_lifetime']:
+            return False
+        if now - pooled.last_used > self.pool_config['ping_after']:
+            try:
+                pooled.connection.ping(reconnect=False)
+            except Exception:
+                return False
+        return True
+
+    def _close_quietly(self, pooled):
+        try:
+            pooled.connection.close()
+        except Exception:
+            pass
+
+    def acquire(self, timeout=None):
+        """Mượn một connection từ pool; tạo mới nếu pool chưa đầy, chờ nếu đã đầy"""
+        timeout = self.pool_config['checkout_timeout'] if timeout is None else timeout
+        started = time.monotonic()
+        deadline = started + timeout
+        waited = False
+        with self._cond:
+            while not self._idle and self._open >= self.pool_config['pool_size']:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._metrics['timeouts'] += 1
+                    raise PoolTimeout(f"Không lấy được connection sau {timeout}s (pool_size={self.pool_config['pool_size']})")
+                waited = True
+                self._cond.wait(remaining)
+            # LIFO: ưu tiên connection vừa dùng, connection rảnh lâu sẽ bị ping/đóng
+            pooled = self._idle.pop() if self._idle else None
+            if pooled is None:
+                self._open += 1
+            self._in_use += 1
+            if waited:
+                self._metrics['waits'] += 1
+
+        try:
+            if pooled is not None and not self._is_healthy(pooled):
+                # Connection cũ đã bị server đóng (wait_timeout) hoặc quá hạn: tạo lại
+                self._close_quietly(pooled)
+                pooled = None
+                with self._cond:
+                    self._metrics['reconnects'] += 1
+            if pooled is None:
+                pooled = self._connect()
+        except Exception as e:
+            self._last_error = str(e)
+            with self._cond:
+                self._open -= 1
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+
+        elapsed = time.monotonic() - started
+        with self._cond:
+            self._metrics['checkouts'] += 1
+            self._metrics['checkout_seconds_total'] += elapsed
+            self._metrics['checkout_seconds_max'] = max(self._metrics['checkout_seconds_max'], elapsed)
+        observe_stages([('db_checkout', elapsed)])
+        return pooled
+
+    def release(self, pooled, discard=False):
+        if not discard:
+            try:
+                # Kết thúc transaction còn mở để lần mượn sau không đọc snapshot cũ
+                if pooled.connection.in_transaction:
+                    pooled.connection.rollback()
+            except Exception:
+                discard = True
+        if discard:
+            self._close_quietly(pooled)
+        else:
+            pooled.last_used = time.monotonic()
+        with self._cond:
+            self._in_use -= 1
+            if discard:
+                self._open -= 1
+                self._metrics['discarded'] += 1
+            else:
+                self._idle.append(pooled)
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        pooled = self.acquire()
+        discard = False
+        try:
+            yield pooled.connection
+        except STALE_CONNECTION_ERRORS:
+            discard = True
+            raise
+        finally:
+            self.release(pooled, discard=discard)
+
+    def pool_stats(self):
+        with self._cond:
+            stats = dict(self._metrics)
+            checkouts = stats['checkouts']
+            total = stats.pop('checkout_seconds_total')
+            stats.update({
+                'pool_size': self.pool_config['pool_size'],
+                'open': self._open,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'checkout_ms_avg': round(total / checkouts * 1000, 3) if checkouts else 0.0,
+                'checkout_ms_max': round(stats.pop('checkout_seconds_max') * 1000, 3),
+                'last_error': self._last_error,
+            })
+        return stats
+
+    def execute_query(self, query, params=None, fetch=True):
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor(dictionary=True)
+                try:
+                    with stage_timer('db_query'):
+                        cursor.execute(query, params)
+
+                        if fetch:
+                            result = cursor.fetchall()
+                        else:
+                            connection.commit()
+                            result = cursor.rowcount
+
+                    return result
+                finally:
+                    cursor.close()
+        except Exception as e:
+            logger.error(f"Query execution error: {e}")
+            return None
+
+    def execute_insert(self, query, params=None):
+        """Chạy một câu INSERT và commit; trả về lastrowid, None nếu lỗi"""
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    with stage_timer('db_query'):
+                        cursor.execute(query, params)
+                        connection.commit()
+                    return cursor.lastrowid
+                finally:
+                    cursor.close()
+        except Exception as e:
+            logger.error(f"Insert execution error: {e}")
+            return None
+
+    def execute_batch(self, query, params_seq, restamp=None):
+        """Như execute_many nhưng trả về (rowcount, lastrowid) của từng bộ tham số; None nếu lỗi (đã rollback).
+
+        Với ``restamp`` ((params, lastrowid) -> id học sinh), version của các dòng đã ghi được đóng
+        dấu lại ngay trước commit: transaction dài hơn CHANGE_FEED_SETTLE_MS không commit version
+        mà change feed đã cho camera đi qua.
+        """
+        params_seq = list(params_seq)
+        if not params_seq:
+            return []
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    results = []
+                    with stage_timer('db_batch'):
+                        for params in params_seq:
+                            cursor.execute(query, params)
+                            results.append((cursor.rowcount, cursor.lastrowid))
+                        ids = restamp_ids(params_seq, results, restamp) if restamp else []
+                        if ids:
+                            cursor.execute(restamp_version_query(len(ids)), ids)
+                        connection.commit()
+                    return results
+                except Exception:
+                    connection.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except Exception as e:
+            logger.error(f"Batch execution error ({len(params_seq)} rows): {e}")
+            return None
+
+    def execute_many(self, query, params_seq):
+        """Chạy một câu lệnh với nhiều bộ tham số trong MỘT transaction; trả về tổng rowcount, None nếu lỗi (đã rollback)"""
+        params_seq = list(params_seq)
+        if not params_seq:
+            return 0
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    with stage_timer('db_batch'):
+                        cursor.executemany(query, params_seq)
+                        connection.commit()
+                    return cursor.rowcount
+                except Exception:
+                    connection.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except Exception as e:
+            logger.error(f"Batch execution error ({len(params_seq)} rows): {e}")
+            return None
+
+    def execute_statements(self, statements):
+        """Chạy [(query, params_seq)] theo thứ tự trong MỘT transaction (vd. xóa rồi ghi lại);
+        trả về rowcount của từng câu lệnh, None nếu lỗi (đã rollback)"""
+        statements = [(query, list(params_seq)) for query, params_seq in statements]
+        try:
+            with self.connection() as connection:
+                cursor = connection.cursor()
+                try:
+                    rowcounts = []
+                    with stage_timer('db_batch'):
+                        for query, params_seq in statements:
+                            if params_seq:
+                                cursor.executemany(query, params_seq)
+                            rowcounts.append(cursor.rowcount if params_seq else 0)
+                        connection.commit()
+                    return rowcounts
+                except Exception:
+                    connection.rollback()
+                    raise
+                finally:
+                    cursor.close()
+        except Exception as e:
+            logger.error(f"Statements execution error ({len(statements)} statements): {e}")
+            return None
+
+    def iter_query(self, query, params=None, batch_size=500):
+        """Đọc kết quả theo từng lô từ cursor không buffer, giữ bộ nhớ ổn định với bảng lớn.
+
+        Connection được giữ cho đến khi generator chạy hết; nếu bị dừng giữa chừng
+        (vd. client ngắt kết nối) thì connection còn kết quả chưa đọc nên bị bỏ đi.
+        """
+        pooled = self.acquire()
+        completed = False
+        try:
+            cursor = pooled.connection.cursor(dictionary=True, buffered=False)
+            with stage_timer('db_query'):
+                cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield from rows
+            cursor.close()
+            completed = True
+        finally:
+            self.release(pooled, discard=not completed)
+
+db_manager = DatabaseManager()
@@ -0,0 +1,157 @@
+"""Cache embedding theo hash nội dung ảnh, tránh chạy lại inference khi ảnh được gửi lại.
+
+Kiosk và client retry thường gửi lại đúng các ảnh front/left/right đã gửi; khóa
+cache là hash BLAKE2b của bytes ảnh (sau khi giải base64) kèm gói model và cách
+chọn khuôn mặt, giá trị là embedding của khuôn mặt được chọn cùng det_score,
+bbox. Cache LRU có giới hạn số phần tử; nếu cấu hình đường dẫn thì các phần tử
+được ghi thêm vào SQLite để giữ lại qua các lần khởi động lại. Cache hit không
+ghi đĩa; thời điểm dùng gần nhất của các hit được ghi gộp ở lần lưu kế tiếp.
+
+    EMBEDDING_CACHE_SIZE   số embedding tối đa giữ trong cache (0 = tắt)
+    EMBEDDING_CACHE_PATH   file SQLite lưu cache (trống = chỉ giữ trong RAM)
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from vector_codec import decode_vector, encode_vector
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_CACHE_CONFIG = {
+    'max_entries': int(os.environ.get('EMBEDDING_CACHE_SIZE', 1024)),
+    'path': os.environ.get('EMBEDDING_CACHE_PATH', ''),
+}
+
+
+def image_key(data, select, model_name):
+    """Khóa cache: model + cách chọn khuôn mặt + hash nội dung ảnh"""
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    return f'{model_name}:{select}:{digest}'
+
+
+class EmbeddingCache:
+    def __init__(self, model_name, config=None):
+        self.config = config or EMBEDDING_CACHE_CONFIG
+        self.model_name = model_name
+        self.max_entries = self.config['max_entries']
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._db = None
+        self._touched = {}
+        self._stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'stores': 0}
+        if self.enabled and self.config['path']:
+            self._open_db(self.config['path'])
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0
+
+    def _open_db(self, path):
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=NORMAL')
+        self._db.execute('''
+            CREATE TABLE IF NOT EXISTS embedding_cache (
+                cache_key TEXT PRIMARY KEY,
+                vector BLOB NOT NULL,
+                meta TEXT NOT NULL,
+                last_used REAL NOT NULL
+            )
+        ''')
+        self._db.commit()
+        rows = self._db.execute(
+            'SELECT cache_key, vector, meta FROM embedding_cache ORDER BY last_used DESC LIMIT ?',
+            (self.max_entries,)
+        ).fetchall()
+        # Nạp từ cũ đến mới để phần tử dùng gần nhất nằm cuối OrderedDict
+        for cache_key, vector, meta in reversed(rows):
+            self._entries[cache_key] = self._from_row(vector, meta)
+        # Bỏ các dòng vượt giới hạn (vd. sau khi giảm EMBEDDING_CACHE_SIZE)
+        self._db.execute(
+            'DELETE FROM embedding_cache WHERE cache_key NOT IN '
+            '(SELECT cache_key FROM embedding_cache ORDER BY last_used DESC LIMIT ?)',
+            (self.max_entries,)
+        )
+        self._db.commit()
+        logger.info(f"💾 Đã nạp {len(self._entries)} embedding từ cache {path}")
+
+    @staticmethod
+    def _from_row(vector, meta):
+        face = json.loads(meta)
+        face['bbox'] = np.asarray(face['bbox'], dtype=np.float32)
+        face['embedding'] = decode_vector(vector)
+        return face
+
+    def get(self, data, select):
+        """Trả về bản sao dict embedding, det_score, bbox, image_shape, scale (và quality nếu có); None nếu chưa có"""
+        if not self.enabled:
+            return None
+        key = image_key(data, select, self.model_name)
+        with self._lock:
+            face = self._entries.get(key)
+            if face is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            if self._db is not None:
+                self._touched[key] = time.time()
+        return dict(face)
+
+    def put(self, data, select, face):
+        """Lưu kết quả của khuôn mặt đã chọn trong ảnh (dict từ face_pipeline)"""
+        if not self.enabled:
+            return
+        key = image_key(data, select, self.model_name)
+        entry = {
+            'embedding': np.asarray(face['embedding'], dtype=np.float32),
+            'det_score': float(face['det_score']),
+            'bbox': np.asarray(face['bbox'], dtype=np.float32),
+            'image_shape': list(face.get('image_shape', ())),
+            'scale': float(face.get('scale', 1.0)),
+        }
+        if 'quality' in face:
+            entry['quality'] = dict(face['quality'])
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self._stats['stores'] += 1
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+            self._stats['evictions'] += len(evicted)
+            if self._db is not None:
+                meta = {k: entry[k] for k in ('det_score', 'image_shape', 'scale')}
+                meta['bbox'] = entry['bbox'].tolist()
+                if 'quality' in entry:
+                    meta['quality'] = entry['quality']
+                self._db.executemany('UPDATE embedding_cache SET last_used = ? WHERE cache_key = ?',
+                                     [(used, k) for k, used in self._touched.items()])
+                self._touched.clear()
+                self._db.execute(
+                    'INSERT OR REPLACE INTO embedding_cache (cache_key, vector, meta, last_used) VALUES (?, ?, ?, ?)',
+                    (key, encode_vector(entry['embedding']), json.dumps(meta), time.time())
+                )
+                self._db.executemany('DELETE FROM embedding_cache WHERE cache_key = ?', [(k,) for k in evicted])
+                self._db.commit()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            entries = len(self._entries)
+        lookups = stats['hits'] + stats['misses']
+        stats.update({
+            'entries': entries,
+            'max_entries': self.max_entries,
+            'hit_rate': round(stats['hits'] / lookups, 4) if lookups else 0.0,
+            'persistent': self._db is not None,
+        })
+        return stats
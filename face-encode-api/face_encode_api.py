@@ -1,11 +1,17 @@
 import base64
-import cv2
+import os
+import sys
 import numpy as np
 from flask import Flask, request, jsonify
 import logging
-import insightface
-from insightface.app import FaceAnalysis
-from insightface.utils import face_align
+
+# Dùng chung pipeline encode với server.py ở thư mục gốc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from face_gallery import l2_normalize
+from face_models import FACE_MODEL_CONFIG, FaceModelManager
+from face_pipeline import MIN_DET_SCORE, align_face, decode_image, detect_faces, embed_aligned, select_face
+from face_quality import FACE_QUALITY_CONFIG, QUALITY_REASONS, measure_face, quality_reason, quality_thresholds
+from metrics import count_rejection, install_flask_metrics, registry, stage_timer
 
 # Cấu hình log
 logging.basicConfig(level=logging.INFO)
@@ -13,36 +19,47 @@ logger = logging.getLogger(__name__)
 
 # Khởi tạo Flask app
 app = Flask(__name__)
+install_flask_metrics(app)
 
 # Khởi tạo model InsightFace
-try:
-    face_app = FaceAnalysis(name='buffalo_l', providers=['CUDAExecutionProvider'])
-    face_app.prepare(ctx_id=0)
-    logger.info("✅ Đã khởi tạo InsightFace với GPU (CUDAExecutionProvider).")
-except Exception as e:
-    logger.warning(f"⚠️ Không dùng được GPU: {e}. Chuyển sang CPU.")
-    face_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-    face_app.prepare(ctx_id=0)
-    logger.info("✅ Đã khởi tạo InsightFace với CPU (CPUExecutionProvider).")
+# Model được nạp theo FACE_MODEL_CONFIG; với FACE_LAZY_LOAD=1 chỉ nạp ở request đầu tiên
+face_models = FaceModelManager(FACE_MODEL_CONFIG)
+if not FACE_MODEL_CONFIG['lazy']:
+    face_models.get()
+
+def collect_batcher_metrics():
+    batcher = face_models.stats().get('recognition_batcher')
+    if not batcher:
+        return []
+    return [
+        ('recognition_batcher_queue_depth', 'gauge', 'Số request chờ gom batch recognition', [({}, batcher['queue_depth'])]),
+        ('recognition_batcher_events_total', 'counter', 'Batch/khuôn mặt/request đã xử lý bởi batcher',
+         [({'event': event}, batcher[event]) for event in ('batches', 'faces', 'requests', 'rejected')]),
+    ]
+
+registry.register_collector(collect_batcher_metrics)
 
 def base64_to_image(base64_string):
-    """Chuyển base64 string thành ảnh OpenCV"""
+    """Chuyển base64 string thành ảnh OpenCV: trả về (ảnh, error_code, message)"""
     try:
         if ',' in base64_string:
             base64_string = base64_string.split(',')[1]
-        img_data = base64.b64decode(base64_string)
-        np_arr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        return img
+        with stage_timer('base64_decode'):
+            img_data = base64.b64decode(base64_string)
     except Exception as e:
         logger.error(f"❌ Lỗi giải mã base64: {e}")
-        return None
+        return None, 402, str(e)
+    img, _, rejection = decode_image(img_data)
+    if rejection is not None:
+        return None, rejection['error_code'], rejection['message']
+    return img, None, None
 
 @app.route('/api/face_vector_encode', methods=['POST'])
 def encode_face_from_images():
     """API nhận 3 ảnh base64 và trả về vector trung bình nếu hợp lệ"""
     try:
-        data = request.get_json()
+        with stage_timer('json_parse'):
+            data = request.get_json()
         if not data:
             logger.warning("📭 Không có dữ liệu gửi lên.")
             return jsonify({'success': False, 'message': 'Không có dữ liệu gửi lên', 'error_code': 400}), 400
@@ -53,33 +70,56 @@ def encode_face_from_images():
             data.get('image_right'),
         ]
 
+        face_app = face_models.get()
         directions = ['front', 'left', 'right']
-        vectors = []
+        crops, det_scores = [], []
         for idx, base64_str in enumerate(images_base64):
             direction = directions[idx]
             logger.info(f"📥 Xử lý ảnh hướng: {direction.upper()}")
 
             if not base64_str:
                 logger.warning(f"❌ Ảnh {direction} không hợp lệ (trống).")
+                count_rejection('face_vector_encode', 401, 'missing')
                 return jsonify({'success': False, 'message': f'Ảnh thứ {idx+1} không hợp lệ, vui lòng tải lại.', 'error_code': 401}), 400
 
-            img = base64_to_image(base64_str)
+            img, error_code, message = base64_to_image(base64_str)
+            if error_code is not None:
+                count_rejection('face_vector_encode', error_code, 'too_large' if error_code == 413 else 'unreadable')
+            if error_code == 413:
+                logger.warning(f"❌ Ảnh {direction} quá lớn: {message}")
+                return jsonify({'success': False, 'message': f'Ảnh thứ {idx+1} quá lớn, vui lòng giảm kích thước rồi tải lại.', 'error_code': 413}), 413
             if img is None:
-                logger.warning(f"❌ Không đọc được ảnh {direction}.")
+                logger.warning(f"❌ Không đọc được ảnh {direction}: {message}")
                 return jsonify({'success': False, 'message': f'Không đọc được ảnh thứ {idx+1}, vui lòng tải lại.', 'error_code': 402}), 400
 
             logger.info(f"📏 Kích thước ảnh {direction}: {img.shape}")
 
-            faces = face_app.get(img)
-            if not faces or faces[0].det_score < 0.7:
-                score = faces[0].det_score if faces else 0
+            # Chỉ chạy detector ở đây, recognition chạy một lần cho cả 3 ảnh bên dưới
+            face = select_face(*detect_faces(face_app, img), select='best')
+            if face is None or face['det_score'] < MIN_DET_SCORE:
+                score = face['det_score'] if face else 0
                 logger.warning(f"❌ Không phát hiện khuôn mặt rõ ở ảnh {direction} (score: {score:.3f})")
+                count_rejection('face_vector_encode', 403, 'no_face' if face is None else 'low_det_score')
                 return jsonify({'success': False, 'message': f'Không phát hiện khuôn mặt rõ ràng ở ảnh thứ {idx+1}, vui lòng tải lại.', 'error_code': 403}), 400
 
-            face = faces[0]
-
-            logger.info(f"✅ Ảnh {direction.upper()} hợp lệ, đang lấy embedding...")
-            vectors.append(face.embedding)
+            # Kiểm tra chất lượng trên landmark và ảnh đã căn chỉnh, trước khi tốn recognition
+            crop = align_face(face_app, img, face['kps'])
+            if FACE_QUALITY_CONFIG['enabled']:
+                with stage_timer('quality'):
+                    quality = measure_face(face, crop)
+                reason = quality_reason(quality, quality_thresholds(direction))
+                if reason is not None:
+                    logger.warning(f"❌ Khuôn mặt ở ảnh {direction} không đạt chất lượng ({QUALITY_REASONS[reason]}: {quality})")
+                    count_rejection('face_vector_encode', 403, reason)
+                    return jsonify({'success': False, 'message': f'Ảnh thứ {idx+1} không đạt chất lượng ({QUALITY_REASONS[reason]}), vui lòng chụp lại.',
+                                    'error_code': 403, 'reason': reason}), 400
+
+            logger.info(f"✅ Ảnh {direction.upper()} hợp lệ.")
+            crops.append(crop)
+            det_scores.append(round(face['det_score'], 4))
+
+        logger.info(f"🧠 Đang lấy embedding cho {len(crops)} khuôn mặt trong một batch...")
+        vectors = embed_aligned(face_app, crops)
 
         # Tính vector trung bình
         avg_vector = np.mean(vectors, axis=0)
@@ -87,7 +127,10 @@ def encode_face_from_images():
 
         return jsonify({
             'success': True,
-            'vector': avg_vector.tolist()
+            'vector': avg_vector.tolist(),
+            # Template theo hướng (đã chuẩn hóa L2) để gửi kèm vector_face khi update-vector/create
+            'templates': [{'direction': direction, 'vector': l2_normalize(vector).tolist(), 'det_score': score}
+                          for direction, vector, score in zip(directions, vectors, det_scores)]
         }), 200
 
     except Exception as e:
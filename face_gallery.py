@@ -0,0 +1,229 @@
+import logging
+import os
+import threading
+from collections import Counter
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Điểm cosine tối thiểu với gallery để coi là đã nhận ra học sinh (điểm danh, nhận diện batch)
+MATCH_THRESHOLD = float(os.environ.get('FACE_MATCH_THRESHOLD', 0.45))
+
+
+def l2_normalize(vectors):
+    """Chuẩn hóa L2 theo từng hàng (hoặc một vector đơn), trả về float32"""
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def block_starts(counts):
+    """Hàng bắt đầu của từng khối từ số hàng mỗi khối"""
+    starts = np.zeros(len(counts), dtype=np.int64)
+    np.cumsum(counts[:-1], out=starts[1:])
+    return starts
+
+
+# Giá trị mặc định của FaceGallery._replace: giữ nguyên vector_face đang có
+_KEEP = object()
+
+
+class FaceGallery:
+    """Ma trận embedding của toàn bộ học sinh, giữ trong RAM để so khớp 1:N.
+
+    Mỗi học sinh là một khối hàng liên tiếp của ``_matrix`` (float32, đã chuẩn hóa L2):
+    hàng đầu là vector_face, các hàng sau là template khuôn mặt (face_templates.py).
+    Điểm của học sinh là cosine lớn nhất trên các hàng của khối, tính cho cả batch truy
+    vấn bằng một phép nhân ma trận rồi ``np.maximum.reduceat`` theo ``_starts``.
+    ``loader`` là hàm trả về danh sách (id, full_name, vector) từ database,
+    ``template_loader`` (tùy chọn) trả về (student_id, vector); gallery được nạp lười
+    ở lần truy vấn đầu tiên và khi bị ``invalidate``.
+    """
+
+    def __init__(self, loader, template_loader=None):
+        self._loader = loader
+        self._template_loader = template_loader
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._ids = np.empty(0, dtype=np.int64)
+        self._names = []
+        self._matrix = np.empty((0, 0), dtype=np.float32)
+        self._starts = np.empty(0, dtype=np.int64)
+        self._dirty = True
+        self._generation = 0
+
+    def invalidate(self):
+        """Đánh dấu cần nạp lại toàn bộ ở lần truy vấn tiếp theo"""
+        with self._lock:
+            self._dirty = True
+            self._generation += 1
+
+    def _load_templates(self):
+        templates = {}
+        if self._template_loader is None:
+            return templates
+        rows = self._template_loader()
+        if rows is None:
+            # Gallery vẫn dùng được với vector_face (vd. chưa chạy migrations/004)
+            logger.warning("⚠️ Không nạp được template khuôn mặt, chỉ so khớp với vector_face.")
+            return templates
+        for student_id, vector in rows:
+            templates.setdefault(student_id, []).append(vector)
+        return templates
+
+    def reload(self):
+        with self._lock:
+            generation = self._generation
+        rows = self._loader()
+        if rows is None:
+            raise RuntimeError('Không nạp được danh sách vector từ database')
+        templates = self._load_templates()
+
+        # Bỏ các vector lệch số chiều (vd. dữ liệu test 128 chiều lẫn với 512 chiều)
+        dims = Counter(len(vector) for _, _, vector in rows if vector is not None)
+        dim = dims.most_common(1)[0][0] if dims else 0
+        valid = [(sid, name, vector) for sid, name, vector in rows
+                 if vector is not None and len(vector) == dim]
+        skipped = len(rows) - len(valid)
+        if skipped:
+            logger.warning(f"⚠️ Bỏ qua {skipped} vector không hợp lệ hoặc khác {dim} chiều khi nạp gallery.")
+
+        ids = np.fromiter((sid for sid, _, _ in valid), dtype=np.int64, count=len(valid))
+        names = [name for _, name, _ in valid]
+        blocks = [[vector] + [t for t in templates.get(sid, ()) if t is not None and len(t) == dim]
+                  for sid, _, vector in valid]
+        counts = np.fromiter((len(block) for block in blocks), dtype=np.int64, count=len(blocks))
+        matrix = np.empty((int(counts.sum()), dim), dtype=np.float32)
+        row = 0
+        for block in blocks:
+            for vector in block:
+                matrix[row] = vector
+                row += 1
+        matrix = l2_normalize(matrix) if len(valid) else matrix
+
+        with self._lock:
+            self._ids, self._names, self._matrix, self._starts = ids, names, matrix, block_starts(counts)
+            # Nếu có invalidate trong lúc đang nạp thì giữ cờ dirty để nạp lại
+            self._dirty = generation != self._generation
+        logger.info(f"✅ Đã nạp gallery: {len(valid)} học sinh, {len(matrix) - len(valid)} template, {dim} chiều.")
+
+    def _snapshot(self):
+        if self._dirty:
+            with self._reload_lock:
+                if self._dirty:
+                    self.reload()
+        with self._lock:
+            return self._ids, self._names, self._matrix, self._starts
+
+    def upsert(self, student_id, vector, full_name=None, templates=None):
+        """Cập nhật (hoặc thêm) một học sinh mà không nạp lại toàn bộ bảng.
+
+        ``templates`` là list vector thay cho toàn bộ template cũ, None để giữ nguyên.
+        """
+        self._replace(student_id, full_name, vector, templates)
+
+    def set_templates(self, student_id, templates):
+        """Thay toàn bộ template của một học sinh đã có trong gallery, giữ nguyên vector_face"""
+        self._replace(student_id, None, _KEEP, templates)
+
+    def _replace(self, student_id, full_name, vector, templates):
+        with self._lock:
+            if self._dirty:
+                return
+            if not len(self._ids):
+                self._dirty = True
+                return
+            ids, names, matrix, starts = self._ids, self._names, self._matrix, self._starts
+            dim = matrix.shape[1]
+            counts = np.diff(np.append(starts, len(matrix)))
+            found = np.flatnonzero(ids == student_id)
+            old_block = np.empty((0, dim), dtype=np.float32)
+            if found.size:
+                pos = int(found[0])
+                old_block = matrix[starts[pos]:starts[pos] + counts[pos]]
+                keep = np.ones(len(matrix), dtype=bool)
+                keep[starts[pos]:starts[pos] + counts[pos]] = False
+                full_name = names[pos] if full_name is None else full_name
+                # Bỏ khối cũ (trên bản sao để không làm hỏng snapshot đang được đọc), khối mới thêm vào cuối
+                ids, counts, matrix = np.delete(ids, pos), np.delete(counts, pos), matrix[keep]
+                names = names[:pos] + names[pos + 1:]
+            elif vector is _KEEP:
+                # Học sinh chưa có vector_face thì không tham gia so khớp
+                return
+
+            if vector is _KEEP:
+                head = old_block[:1]
+            elif vector is None or len(vector) != dim:
+                head = None
+            else:
+                head = l2_normalize(vector)[None, :]
+            if templates is None:
+                tail = old_block[1:]
+            else:
+                valid = [t for t in templates if t is not None and len(t) == dim]
+                tail = l2_normalize(np.stack(valid)) if valid else np.empty((0, dim), dtype=np.float32)
+
+            if head is not None:
+                if full_name is None:
+                    # Học sinh mới nhưng không biết tên: nạp lại ở lần truy vấn sau
+                    self._dirty = True
+                    return
+                ids = np.append(ids, np.int64(student_id))
+                names = names + [full_name]
+                counts = np.append(counts, 1 + len(tail))
+                matrix = np.vstack([matrix, head, tail])
+            elif not found.size:
+                return
+            self._ids, self._names, self._matrix, self._starts = ids, names, matrix, block_starts(counts)
+
+    def student_templates(self, student_id):
+        """Các hàng đã chuẩn hóa (vector_face và template) của một học sinh, rỗng nếu không có"""
+        ids, _, matrix, starts = self._snapshot()
+        found = np.flatnonzero(ids == student_id)
+        if not found.size:
+            return np.empty((0, matrix.shape[1] if matrix.ndim == 2 else 0), dtype=np.float32)
+        pos = int(found[0])
+        end = starts[pos + 1] if pos + 1 < len(starts) else len(matrix)
+        return matrix[starts[pos]:end]
+
+    def search(self, embedding, top_k=5):
+        """Trả về top_k học sinh giống nhất theo cosine similarity"""
+        return self.search_batch(np.asarray(embedding)[None, :], top_k=top_k)[0]
+
+    def search_batch(self, embeddings, top_k=1):
+        """top_k học sinh giống nhất cho từng vector của ``embeddings`` (Q, D).
+
+        Cả batch được so khớp bằng MỘT phép nhân ma trận (Q, D) x (D, số hàng);
+        trả về list Q phần tử, mỗi phần tử như kết quả của ``search``.
+        """
+        ids, names, matrix, starts = self._snapshot()
+        if not len(ids) or not len(embeddings):
+            return [[] for _ in range(len(embeddings))]
+        queries = l2_normalize(embeddings)
+        if queries.shape[-1] != matrix.shape[1]:
+            raise ValueError(f'Vector truy vấn có {queries.shape[-1]} chiều, gallery có {matrix.shape[1]} chiều')
+
+        scores = queries @ matrix.T
+        if len(matrix) != len(ids):
+            # (Q, số hàng) -> (Q, số học sinh): điểm cao nhất trên các hàng của từng học sinh
+            scores = np.maximum.reduceat(scores, starts, axis=1)
+        k = min(top_k, scores.shape[1])
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        top_scores = np.take_along_axis(scores, top, axis=1)
+        order = np.argsort(-top_scores, axis=1)
+        top = np.take_along_axis(top, order, axis=1)
+        return [
+            [{'id': int(ids[i]), 'full_name': names[i], 'score': float(row_scores[i])} for i in row]
+            for row, row_scores in zip(top, scores)
+        ]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'loaded': not self._dirty,
+                'size': int(len(self._ids)),
+                'templates': int(len(self._matrix) - len(self._ids)),
+                'dim': int(self._matrix.shape[1]) if self._matrix.ndim == 2 else 0,
+            }
@@ -0,0 +1,278 @@
+"""Nạp model InsightFace theo cấu hình, dùng chung cho server.py và face-encode-api.
+
+Chỉ các module cần cho encode (detection, recognition) được tạo session ONNX;
+các model còn lại trong gói (landmark, gender/age) bị bỏ qua ngay từ tên file nên
+không tốn thời gian khởi động lẫn RAM. Cấu hình qua biến môi trường:
+
+    FACE_MODEL_PACK        tên gói model (mặc định buffalo_l)
+    FACE_MODEL_ROOT        thư mục chứa model (mặc định ~/.insightface)
+    FACE_ALLOWED_MODULES   danh sách module, phân cách dấu phẩy
+    FACE_DET_SIZE          kích thước đầu vào detector, vd. 640 hoặc 640x480
+    FACE_PROVIDERS         danh sách execution provider theo thứ tự ưu tiên
+    FACE_INTRA_OP_THREADS  số thread trong một phép toán ONNX (0 = mặc định)
+    FACE_INTER_OP_THREADS  số thread giữa các phép toán ONNX (0 = mặc định)
+    FACE_EXECUTION_MODE    sequential (mặc định) hoặc parallel (dùng inter-op threads)
+    FACE_GRAPH_OPT_LEVEL   mức tối ưu graph ONNX: disable, basic, extended, all (mặc định)
+    FACE_CPU_MEM_ARENA     1: dùng memory arena của ONNX Runtime trên CPU (nhanh hơn,
+                           giữ lại RAM đỉnh); 0: cấp phát/giải phóng theo từng lần chạy
+    FACE_MODEL_PRECISION   fp32 (mặc định) hoặc int8: nạp model lượng tử hóa trong thư
+                           mục int8/ của gói model (tạo bằng quantize_models.py), chỉ
+                           chạy trên CPU; module chưa có bản int8 dùng lại bản fp32
+    FACE_LAZY_LOAD         1: chỉ nạp model ở request đầu tiên
+    FACE_WARMUP            1: chạy thử một lần inference ngay sau khi nạp
+    RECOGNITION_BATCH_SIZE số khuôn mặt tối đa mỗi batch recognition gom từ nhiều
+                           request (0 = tắt, mỗi request chạy batch riêng)
+    RECOGNITION_BATCH_WAIT_MS  thời gian tối đa chờ gom batch
+    RECOGNITION_BATCH_QUEUE    số request tối đa chờ gom batch
+"""
+import glob
+import logging
+import os
+import os.path as osp
+import resource
+import threading
+import time
+
+import numpy as np
+import onnxruntime
+from insightface.model_zoo.arcface_onnx import ArcFaceONNX
+from insightface.model_zoo.scrfd import SCRFD
+from insightface.utils import ensure_available
+
+from recognition_batcher import RecognitionBatcher
+
+logger = logging.getLogger(__name__)
+
+
+def _env_flag(name, default):
+    return os.environ.get(name, default).strip().lower() in ('1', 'true', 'yes', 'on')
+
+
+def _parse_det_size(value):
+    parts = value.lower().replace(',', 'x').split('x')
+    if len(parts) == 1:
+        return int(parts[0]), int(parts[0])
+    return int(parts[0]), int(parts[1])
+
+
+FACE_MODEL_CONFIG = {
+    'name': os.environ.get('FACE_MODEL_PACK', 'buffalo_l'),
+    'root': os.environ.get('FACE_MODEL_ROOT', '~/.insightface'),
+    'allowed_modules': [m.strip() for m in os.environ.get('FACE_ALLOWED_MODULES', 'detection,recognition').split(',') if m.strip()],
+    'det_size': _parse_det_size(os.environ.get('FACE_DET_SIZE', '640')),
+    'det_thresh': float(os.environ.get('FACE_DET_THRESH', 0.5)),
+    'providers': [p.strip() for p in os.environ.get('FACE_PROVIDERS', 'CUDAExecutionProvider,CPUExecutionProvider').split(',') if p.strip()],
+    'intra_op_threads': int(os.environ.get('FACE_INTRA_OP_THREADS', 0)),
+    'inter_op_threads': int(os.environ.get('FACE_INTER_OP_THREADS', 0)),
+    'execution_mode': os.environ.get('FACE_EXECUTION_MODE', 'sequential').strip().lower(),
+    'graph_optimization': os.environ.get('FACE_GRAPH_OPT_LEVEL', 'all').strip().lower(),
+    'cpu_mem_arena': _env_flag('FACE_CPU_MEM_ARENA', '1'),
+    'precision': os.environ.get('FACE_MODEL_PRECISION', 'fp32').strip().lower(),
+    'lazy': _env_flag('FACE_LAZY_LOAD', '0'),
+    'warmup': _env_flag('FACE_WARMUP', '1'),
+    'batch_size': int(os.environ.get('RECOGNITION_BATCH_SIZE', 0)),
+    'batch_wait_ms': float(os.environ.get('RECOGNITION_BATCH_WAIT_MS', 5)),
+    'batch_queue': int(os.environ.get('RECOGNITION_BATCH_QUEUE', 256)),
+}
+
+# Tên file model trong các gói chuẩn của InsightFace -> module, để bỏ qua mà không cần mở session
+KNOWN_MODEL_FILES = {
+    'det_10g': 'detection',
+    'det_2.5g': 'detection',
+    'det_500m': 'detection',
+    'scrfd_10g_bnkps': 'detection',
+    'w600k_r50': 'recognition',
+    'w600k_mbf': 'recognition',
+    'glintr100': 'recognition',
+    '1k3d68': 'landmark_3d_68',
+    '2d106det': 'landmark_2d_106',
+    'genderage': 'genderage',
+}
+
+# Thư mục con của gói model chứa bản lượng tử hóa, cùng tên file với bản fp32
+QUANTIZED_MODEL_DIRS = {'int8': 'int8'}
+
+GRAPH_OPTIMIZATION_LEVELS = {
+    'disable': onnxruntime.GraphOptimizationLevel.ORT_DISABLE_ALL,
+    'basic': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_BASIC,
+    'extended': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_EXTENDED,
+    'all': onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL,
+}
+
+EXECUTION_MODES = {
+    'sequential': onnxruntime.ExecutionMode.ORT_SEQUENTIAL,
+    'parallel': onnxruntime.ExecutionMode.ORT_PARALLEL,
+}
+
+
+def rss_mb():
+    """RAM thường trú hiện tại của tiến trình (MB)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        # Không có /proc (vd. macOS): dùng RAM đỉnh, đơn vị byte trên macOS
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024)
+
+
+def session_options(config):
+    options = onnxruntime.SessionOptions()
+    if config['intra_op_threads']:
+        options.intra_op_num_threads = config['intra_op_threads']
+    if config['inter_op_threads']:
+        options.inter_op_num_threads = config['inter_op_threads']
+    try:
+        options.execution_mode = EXECUTION_MODES[config['execution_mode']]
+        options.graph_optimization_level = GRAPH_OPTIMIZATION_LEVELS[config['graph_optimization']]
+    except KeyError as e:
+        raise ValueError(f'Giá trị cấu hình ONNX Runtime không hợp lệ: {e}') from None
+    options.enable_cpu_mem_arena = config['cpu_mem_arena']
+    return options
+
+
+def available_providers(requested, precision='fp32'):
+    available = set(onnxruntime.get_available_providers())
+    providers = [p for p in requested if p in available]
+    if precision != 'fp32' and providers != ['CPUExecutionProvider']:
+        # Toán tử ConvInteger/MatMulInteger của model lượng tử hóa động chỉ có kernel CPU
+        logger.info(f"Model {precision} chỉ chạy trên CPUExecutionProvider, bỏ qua {providers}")
+        providers = []
+    return providers or ['CPUExecutionProvider']
+
+
+def model_files(model_dir, precision='fp32'):
+    """[(file .onnx, độ chính xác)] của gói model, bản lượng tử hóa thay cho bản fp32 cùng tên nếu có"""
+    files = sorted(glob.glob(osp.join(model_dir, '*.onnx')))
+    if precision == 'fp32':
+        return [(onnx_file, 'fp32') for onnx_file in files]
+    if precision not in QUANTIZED_MODEL_DIRS:
+        raise ValueError(f'FACE_MODEL_PRECISION không hợp lệ: {precision} (fp32 hoặc int8)')
+    quantized_dir = osp.join(model_dir, QUANTIZED_MODEL_DIRS[precision])
+    selected = []
+    for onnx_file in files:
+        quantized = osp.join(quantized_dir, osp.basename(onnx_file))
+        selected.append((quantized, precision) if osp.exists(quantized) else (onnx_file, 'fp32'))
+    return selected
+
+
+class FaceModels:
+    """Bộ model đã nạp: có ``det_model`` và ``models[taskname]`` giống FaceAnalysis"""
+
+    def __init__(self, config):
+        self.config = config
+        self.models = {}
+        self.det_model = None
+        self.batcher = None
+        self.precision = config['precision']
+        self.providers = available_providers(config['providers'], self.precision)
+        self.model_dir = ensure_available('models', config['name'], root=config['root'])
+        # Độ chính xác thực tế của từng module (int8 hoặc fp32 nếu chưa lượng tử hóa)
+        self.module_precision = {}
+
+        options = session_options(config)
+        allowed = set(config['allowed_modules'])
+        for onnx_file, precision in model_files(self.model_dir, self.precision):
+            known = KNOWN_MODEL_FILES.get(osp.splitext(osp.basename(onnx_file))[0])
+            if known is not None and known not in allowed:
+                logger.debug(f"Bỏ qua model {onnx_file} ({known})")
+                continue
+            model = self._load_model(onnx_file, options)
+            if model is None or model.taskname not in allowed or model.taskname in self.models:
+                continue
+            self.models[model.taskname] = model
+            self.module_precision[model.taskname] = precision
+        fallback = sorted(m for m, p in self.module_precision.items() if p != self.precision)
+        if fallback:
+            logger.warning(f"⚠️ Chưa có bản {self.precision} cho {', '.join(fallback)} trong {self.model_dir}, "
+                           f"dùng fp32 (chạy quantize_models.py để tạo)")
+
+        if 'detection' not in self.models:
+            raise RuntimeError(f'Không tìm thấy model detection trong {self.model_dir}')
+        self.det_model = self.models['detection']
+        for taskname, model in self.models.items():
+            if taskname == 'detection':
+                model.prepare(0, input_size=config['det_size'], det_thresh=config['det_thresh'])
+            else:
+                model.prepare(0)
+        if config['batch_size'] > 0 and 'recognition' in self.models:
+            self.batcher = RecognitionBatcher(self.models['recognition'], max_batch=config['batch_size'],
+                                              max_wait_ms=config['batch_wait_ms'], max_queue=config['batch_queue'])
+
+    def embed(self, crops):
+        """Chạy recognition cho các ảnh đã căn chỉnh, qua batcher nếu được bật"""
+        if self.batcher is not None:
+            return self.batcher.embed(crops)
+        return self.models['recognition'].get_feat(crops)
+
+    def _load_model(self, onnx_file, options):
+        """Tạo session ONNX với session options tùy chỉnh rồi nhận diện loại model như model_zoo"""
+        session = onnxruntime.InferenceSession(onnx_file, sess_options=options, providers=self.providers)
+        inputs = session.get_inputs()
+        input_shape = inputs[0].shape
+        if len(session.get_outputs()) >= 5:
+            return SCRFD(model_file=onnx_file, session=session)
+        if (len(inputs) == 1 and input_shape[2] == input_shape[3]
+                and isinstance(input_shape[2], int) and input_shape[2] >= 112 and input_shape[2] % 16 == 0):
+            return ArcFaceONNX(model_file=onnx_file, session=session)
+        logger.debug(f"Model {onnx_file} không dùng trong pipeline encode, bỏ qua.")
+        return None
+
+    def warmup(self):
+        """Chạy thử detector và recognition trên ảnh rỗng để khởi tạo bộ nhớ/kernel trước request đầu"""
+        width, height = self.config['det_size']
+        self.det_model.detect(np.zeros((height, width, 3), dtype=np.uint8), max_num=0, metric='default')
+        if 'recognition' in self.models:
+            size = self.models['recognition'].input_size
+            self.models['recognition'].get_feat([np.zeros((size[1], size[0], 3), dtype=np.uint8)])
+
+
+class FaceModelManager:
+    """Giữ một bộ model cho mỗi tiến trình, nạp ngay hoặc lười tùy cấu hình"""
+
+    def __init__(self, config=None):
+        self.config = config or FACE_MODEL_CONFIG
+        self._lock = threading.Lock()
+        self._models = None
+        self._stats = {'loaded': False}
+
+    def get(self):
+        if self._models is None:
+            with self._lock:
+                if self._models is None:
+                    self._models = self._load()
+        return self._models
+
+    def _load(self):
+        rss_before = rss_mb()
+        started = time.perf_counter()
+        models = FaceModels(self.config)
+        load_seconds = time.perf_counter() - started
+
+        warmup_seconds = None
+        if self.config['warmup']:
+            started = time.perf_counter()
+            models.warmup()
+            warmup_seconds = time.perf_counter() - started
+
+        self._stats = {
+            'loaded': True,
+            'model_pack': self.config['name'],
+            'modules': sorted(models.models),
+            'det_size': list(self.config['det_size']),
+            'providers': models.providers,
+            'precision': models.module_precision,
+            'graph_optimization': self.config['graph_optimization'],
+            'cpu_mem_arena': self.config['cpu_mem_arena'],
+            'load_seconds': round(load_seconds, 3),
+            'warmup_seconds': round(warmup_seconds, 3) if warmup_seconds is not None else None,
+            'rss_mb_before': round(rss_before, 1),
+            'rss_mb_after': round(rss_mb(), 1),
+        }
+        logger.info(f"✅ Đã khởi tạo InsightFace ({self.config['name']}, {', '.join(models.providers)}): {self._stats}")
+        return models
+
+    def stats(self):
+        stats = dict(self._stats)
+        if self._models is not None and self._models.batcher is not None:
+            stats['recognition_batcher'] = self._models.batcher.stats()
+        return stats
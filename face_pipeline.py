@@ -0,0 +1,245 @@
+"""Pipeline encode khuôn mặt dùng chung cho server.py và face-encode-api.
+
+Thay vì gọi ``face_app.get`` cho từng ảnh (chạy detector và mọi model
+landmark/gender-age/recognition trên từng khuôn mặt), pipeline tách làm 3 bước:
+
+1. detect trên từng ảnh và chọn một khuôn mặt (lớn nhất hoặc điểm cao nhất)
+2. căn chỉnh khuôn mặt bằng ``face_align.norm_crop`` theo 5 điểm landmark
+3. đẩy tất cả ảnh đã căn chỉnh qua model recognition trong MỘT batch
+
+Ảnh dạng bytes được kiểm tra header và giải mã thu nhỏ qua image_preprocess
+trước bước 1; bbox/kps trả về luôn theo tọa độ ảnh gốc. Khi encode ảnh để lưu
+vector, khuôn mặt còn qua bước kiểm tra chất lượng (face_quality) giữa bước 2 và 3.
+"""
+import numpy as np
+from insightface.utils import face_align
+
+from face_quality import FACE_QUALITY_CONFIG, measure_face, quality_reason, quality_thresholds
+from image_preprocess import ImageRejected, load_image
+from metrics import stage_timer
+
+# Ngưỡng det_score tối thiểu để khuôn mặt được dùng lấy embedding
+MIN_DET_SCORE = 0.7
+
+
+def decode_image(data):
+    """Bytes ảnh (JPEG/PNG...) -> (ảnh BGR, scale, rejection).
+
+    rejection là None hoặc dict error_code (402 hỏng/không phải ảnh, 413 quá lớn), reason, message.
+    """
+    try:
+        with stage_timer('image_decode'):
+            img, scale = load_image(data)
+    except ImageRejected as e:
+        return None, 1.0, {'error_code': e.error_code, 'reason': e.reason, 'message': str(e)}
+    return img, scale, None
+
+
+def rescale_face(face, scale):
+    """Đưa bbox/kps từ ảnh đã thu nhỏ về tọa độ ảnh gốc"""
+    if scale != 1.0:
+        face['bbox'] = face['bbox'] * scale
+        face['kps'] = face['kps'] * scale
+    return face
+
+
+def bbox_area(bbox):
+    return (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+
+
+def box_iou(boxes_a, boxes_b):
+    """Ma trận IoU (len(a), len(b)) giữa hai tập bbox [x1, y1, x2, y2]"""
+    a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    x1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    y1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    x2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    y2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-6), 0.0)
+
+
+def detect_faces(face_app, img):
+    """Chỉ chạy detector: trả về (bboxes (N, 5) gồm det_score ở cột cuối, kpss (N, 5, 2))"""
+    with stage_timer('detect'):
+        return face_app.det_model.detect(img, max_num=0, metric='default')
+
+
+def select_face(bboxes, kpss, select='largest'):
+    """Chọn một khuôn mặt: 'largest' theo diện tích bbox, 'best' theo det_score"""
+    if bboxes is None or bboxes.shape[0] == 0 or kpss is None:
+        return None
+    if select == 'best':
+        idx = int(np.argmax(bboxes[:, 4]))
+    else:
+        idx = int(np.argmax([bbox_area(b) for b in bboxes]))
+    return {
+        'bbox': bboxes[idx, 0:4],
+        'det_score': float(bboxes[idx, 4]),
+        'kps': kpss[idx],
+    }
+
+
+def align_face(face_app, img, kps):
+    """Cắt và căn chỉnh khuôn mặt về kích thước đầu vào của model recognition"""
+    rec_model = face_app.models['recognition']
+    with stage_timer('align'):
+        return face_align.norm_crop(img, landmark=kps, image_size=rec_model.input_size[0])
+
+
+def embed_aligned(face_app, crops):
+    """Chạy model recognition một lần cho cả batch ảnh đã căn chỉnh (có thể gộp với request khác), trả về (N, D)"""
+    if not crops:
+        return np.empty((0, 0), dtype=np.float32)
+    with stage_timer('recognition'):
+        return face_app.embed(crops)
+
+
+def encode_images(face_app, images, select='largest', min_det_score=MIN_DET_SCORE, quality=None, quality_direction=None):
+    """Encode nhiều ảnh (direction, img) với một lần chạy recognition.
+
+    Với ``quality`` bật (mặc định theo FACE_QUALITY_ENABLED), khuôn mặt được đánh giá
+    chất lượng theo ngưỡng của hướng chụp trước khi đưa vào batch recognition. Hướng chụp
+    là chính ``direction`` của ảnh, hoặc ``quality_direction(direction)`` nếu direction là
+    khóa khác (vd. (student_id, hướng) của bulk_enroll).
+
+    Trả về (accepted, rejected):
+    - accepted: list dict direction, bbox, det_score, quality, embedding theo thứ tự đầu vào
+    - rejected: list dict direction, error_code, reason cho ảnh bị loại
+      (402: không đọc được ảnh, 403: không có khuôn mặt, det_score thấp hoặc không đạt
+      chất lượng, khi đó reason theo face_quality.QUALITY_REASONS kèm quality)
+    """
+    if quality is None:
+        quality = FACE_QUALITY_CONFIG['enabled']
+    accepted, rejected, crops = [], [], []
+    for direction, img in images:
+        if img is None:
+            rejected.append({'direction': direction, 'error_code': 402, 'reason': 'unreadable'})
+            continue
+        bboxes, kpss = detect_faces(face_app, img)
+        face = select_face(bboxes, kpss, select=select)
+        if face is None:
+            rejected.append({'direction': direction, 'error_code': 403, 'reason': 'no_face'})
+            continue
+        if face['det_score'] < min_det_score:
+            rejected.append({'direction': direction, 'error_code': 403, 'reason': 'low_det_score',
+                             'det_score': face['det_score']})
+            continue
+        crop = align_face(face_app, img, face['kps'])
+        if quality:
+            thresholds = quality_thresholds(quality_direction(direction) if quality_direction else direction)
+            with stage_timer('quality'):
+                face['quality'] = measure_face(face, crop)
+            reason = quality_reason(face['quality'], thresholds)
+            if reason is not None:
+                rejected.append({'direction': direction, 'error_code': 403, 'reason': reason,
+                                 'det_score': face['det_score'], 'quality': face['quality']})
+                continue
+        crops.append(crop)
+        face['direction'] = direction
+        accepted.append(face)
+
+    embeddings = embed_aligned(face_app, crops)
+    for face, embedding in zip(accepted, embeddings):
+        face['embedding'] = embedding
+    return accepted, rejected
+
+
+# Các hàm dưới nhận bytes ảnh thay vì ảnh đã giải mã để chạy được trong worker của
+# inference_pool: chỉ bytes nén được gửi qua tiến trình, việc giải mã làm ở worker.
+
+def encode_image_bytes(face_app, images, select='largest', min_det_score=MIN_DET_SCORE, quality_direction=None):
+    """Như encode_images nhưng nhận [(direction, bytes ảnh)]; ảnh quá lớn bị loại với mã 413"""
+    decoded, rejected, shapes = [], [], {}
+    for direction, data in images:
+        img, scale, rejection = decode_image(data)
+        if rejection is not None:
+            rejected.append(dict(rejection, direction=direction))
+            continue
+        decoded.append((direction, img))
+        shapes[direction] = (img.shape, scale)
+    accepted, detect_rejected = encode_images(face_app, decoded, select=select, min_det_score=min_det_score,
+                                              quality_direction=quality_direction)
+    for face in accepted:
+        face['image_shape'], face['scale'] = shapes[face['direction']]
+        rescale_face(face, face['scale'])
+    return accepted, rejected + detect_rejected
+
+
+def embed_largest_face(face_app, data):
+    """Embedding của khuôn mặt lớn nhất trong một ảnh: trả về (face, error_code)"""
+    img, scale, rejection = decode_image(data)
+    if rejection is not None:
+        return None, rejection['error_code']
+    face = select_face(*detect_faces(face_app, img), select='largest')
+    if face is None:
+        return None, 403
+    face['embedding'] = embed_aligned(face_app, [align_face(face_app, img, face['kps'])])[0]
+    return rescale_face(face, scale), None
+
+
+def encode_frames_bytes(face_app, frames, min_det_score=MIN_DET_SCORE, max_faces=0):
+    """Mọi khuôn mặt trong nhiều khung hình (bytes ảnh) với một lần chạy recognition cho cả batch.
+
+    Trả về list theo thứ tự đầu vào, mỗi khung hình là dict:
+    - faces: list dict bbox, kps, det_score, embedding (tọa độ ảnh gốc), lớn trước nhỏ sau;
+      tối đa ``max_faces`` mặt lớn nhất (0 = không giới hạn)
+    - image_shape, scale, skipped (số mặt bị bỏ vì det_score thấp hoặc vượt max_faces)
+    - hoặc error_code, reason, message nếu ảnh bị loại (402/413)
+    """
+    results, crops, faces = [], [], []
+    for data in frames:
+        img, scale, rejection = decode_image(data)
+        if rejection is not None:
+            results.append(rejection)
+            continue
+        bboxes, kpss = detect_faces(face_app, img)
+        frame = {'image_shape': img.shape, 'scale': scale, 'faces': [], 'skipped': 0}
+        results.append(frame)
+        if bboxes is None or bboxes.shape[0] == 0 or kpss is None:
+            continue
+        order = np.argsort([-bbox_area(b) for b in bboxes])
+        for idx in order:
+            if bboxes[idx, 4] < min_det_score or (max_faces and len(frame['faces']) >= max_faces):
+                frame['skipped'] += 1
+                continue
+            face = {'bbox': bboxes[idx, 0:4], 'det_score': float(bboxes[idx, 4]), 'kps': kpss[idx]}
+            crops.append(align_face(face_app, img, face['kps']))
+            frame['faces'].append(rescale_face(face, scale))
+            faces.append(face)
+
+    embeddings = embed_aligned(face_app, crops)
+    for face, embedding in zip(faces, embeddings):
+        face['embedding'] = embedding
+    return results
+
+
+def track_frame_bytes(face_app, data, known_boxes, iou_threshold, min_det_score=MIN_DET_SCORE):
+    """Detect mọi khuôn mặt của một khung hình, chỉ lấy embedding cho mặt chưa được theo dõi.
+
+    Mặt có IoU >= ``iou_threshold`` với một bbox trong ``known_boxes`` (track đã nhận diện,
+    tọa độ ảnh gốc) không chạy recognition. Trả về dict faces (bbox, det_score, embedding
+    hoặc None), image_shape, scale; hoặc dict error_code, reason, message nếu ảnh bị loại.
+    """
+    img, scale, rejection = decode_image(data)
+    if rejection is not None:
+        return rejection
+    bboxes, kpss = detect_faces(face_app, img)
+    faces, crops, pending = [], [], []
+    if bboxes is not None and bboxes.shape[0] and kpss is not None:
+        keep = bboxes[:, 4] >= min_det_score
+        bboxes, kpss = bboxes[keep], kpss[keep]
+        overlap = box_iou(bboxes[:, 0:4] * scale, known_boxes).max(axis=1) if len(known_boxes) else np.zeros(len(bboxes))
+        for bbox, kps, iou in zip(bboxes, kpss, overlap):
+            face = rescale_face({'bbox': bbox[0:4], 'det_score': float(bbox[4]), 'kps': kps, 'embedding': None}, scale)
+            if iou < iou_threshold:
+                crops.append(align_face(face_app, img, kps))
+                pending.append(face)
+            faces.append(face)
+
+    for face, embedding in zip(pending, embed_aligned(face_app, crops)):
+        face['embedding'] = embedding
+    return {'faces': faces, 'image_shape': img.shape, 'scale': scale}
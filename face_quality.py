@@ -0,0 +1,138 @@
+"""Đánh giá chất lượng khuôn mặt trước khi chạy recognition.
+
+Chỉ dùng kết quả của detector (bbox, 5 điểm landmark) và ảnh đã căn chỉnh (112x112),
+nên rẻ hơn nhiều so với model recognition: ảnh mờ, tối, mặt quá nhỏ hoặc nghiêng quá
+nhiều bị loại trước khi tốn compute và không bị lấy trung bình vào vector lưu trữ.
+
+Các chỉ số:
+    size        cạnh ngắn của bbox (pixel, trên ảnh đã giải mã)
+    yaw/pitch/roll  góc xấp xỉ (độ) từ 5 điểm landmark, 0 = mặt thẳng như mẫu căn chỉnh ArcFace
+    brightness  độ sáng trung bình (0-255) của ảnh đã căn chỉnh
+    blur        phương sai Laplacian của ảnh đã căn chỉnh, càng nhỏ càng mờ
+
+Ngưỡng theo hướng chụp (front/left/right, hướng khác dùng mặc định), cấu hình qua
+biến môi trường FACE_QUALITY_<KEY> cho mọi hướng hoặc FACE_QUALITY_<HƯỚNG>_<KEY> cho
+một hướng, vd. FACE_QUALITY_MIN_BLUR=60, FACE_QUALITY_LEFT_MAX_YAW=70:
+
+    MIN_SIZE, MIN_BLUR, MIN_BRIGHTNESS, MAX_BRIGHTNESS, MAX_YAW, MAX_PITCH, MAX_ROLL
+    FACE_QUALITY_ENABLED   0: tắt bước kiểm tra chất lượng
+"""
+import math
+import os
+
+import cv2
+import numpy as np
+from insightface.utils import face_align
+
+QUALITY_KEYS = ('min_size', 'min_blur', 'min_brightness', 'max_brightness', 'max_yaw', 'max_pitch', 'max_roll')
+
+DEFAULT_THRESHOLDS = {
+    'min_size': 64,
+    'min_blur': 40,
+    'min_brightness': 40,
+    'max_brightness': 220,
+    'max_yaw': 30,
+    'max_pitch': 30,
+    'max_roll': 30,
+}
+
+# Ảnh trái/phải được chụp nghiêng có chủ đích nên cho phép yaw lớn hơn ảnh chính diện
+DIRECTION_THRESHOLDS = {
+    'front': dict(DEFAULT_THRESHOLDS, max_yaw=25),
+    'left': dict(DEFAULT_THRESHOLDS, max_yaw=65),
+    'right': dict(DEFAULT_THRESHOLDS, max_yaw=65),
+}
+
+# Lý do bị loại -> mô tả trong log/message
+QUALITY_REASONS = {
+    'too_small': 'khuôn mặt quá nhỏ',
+    'bad_pose': 'khuôn mặt nghiêng quá nhiều',
+    'too_dark': 'ảnh quá tối',
+    'too_bright': 'ảnh quá sáng',
+    'blurry': 'ảnh bị mờ',
+}
+
+
+def _load_thresholds(direction, defaults):
+    thresholds = dict(defaults)
+    for key in QUALITY_KEYS:
+        for name in (f'FACE_QUALITY_{key.upper()}', f'FACE_QUALITY_{direction.upper()}_{key.upper()}' if direction else None):
+            if name and name in os.environ:
+                thresholds[key] = float(os.environ[name])
+    return thresholds
+
+
+FACE_QUALITY_CONFIG = {
+    'enabled': os.environ.get('FACE_QUALITY_ENABLED', '1').strip().lower() in ('1', 'true', 'yes', 'on'),
+    'default': _load_thresholds(None, DEFAULT_THRESHOLDS),
+    'directions': {direction: _load_thresholds(direction, defaults) for direction, defaults in DIRECTION_THRESHOLDS.items()},
+}
+
+# Vị trí dọc của mũi giữa đường mắt và đường miệng trên mẫu căn chỉnh ArcFace (mặt thẳng)
+_EYE_Y = face_align.arcface_dst[0:2, 1].mean()
+_MOUTH_Y = face_align.arcface_dst[3:5, 1].mean()
+_NOSE_RATIO = (face_align.arcface_dst[2, 1] - _EYE_Y) / (_MOUTH_Y - _EYE_Y)
+
+
+def quality_thresholds(direction, config=FACE_QUALITY_CONFIG):
+    return config['directions'].get(direction, config['default'])
+
+
+def face_pose(kps):
+    """(yaw, pitch, roll) xấp xỉ theo độ từ 5 điểm: mắt trái, mắt phải, mũi, mép trái, mép phải.
+
+    roll là góc của đường nối hai mắt; sau khi xoay bỏ roll, yaw theo độ lệch ngang của mũi so
+    với giữa hai mắt (trên nửa khoảng cách hai mắt), pitch theo vị trí dọc của mũi giữa mắt và miệng.
+    """
+    points = np.asarray(kps, dtype=np.float64).reshape(5, 2)
+    dx, dy = points[1] - points[0]
+    roll = math.atan2(dy, dx)
+    cos, sin = math.cos(-roll), math.sin(-roll)
+    points = points @ np.array([[cos, sin], [-sin, cos]])
+    left_eye, right_eye, nose = points[0], points[1], points[2]
+    eye_center = (left_eye + right_eye) / 2
+    mouth_y = points[3:5, 1].mean()
+    half_eye = max((right_eye[0] - left_eye[0]) / 2, 1e-6)
+    yaw = math.atan((nose[0] - eye_center[0]) / half_eye)
+    nose_ratio = (nose[1] - eye_center[1]) / max(mouth_y - eye_center[1], 1e-6)
+    pitch = math.atan((nose_ratio - _NOSE_RATIO) / _NOSE_RATIO)
+    return math.degrees(yaw), math.degrees(pitch), math.degrees(roll)
+
+
+def measure_face(face, crop):
+    """Các chỉ số chất lượng của một khuôn mặt (bbox, kps) và ảnh đã căn chỉnh của nó"""
+    x1, y1, x2, y2 = face['bbox'][:4]
+    yaw, pitch, roll = face_pose(face['kps'])
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return {
+        'size': round(float(min(x2 - x1, y2 - y1)), 1),
+        'yaw': round(yaw, 1),
+        'pitch': round(pitch, 1),
+        'roll': round(roll, 1),
+        'brightness': round(float(gray.mean()), 1),
+        'blur': round(float(cv2.Laplacian(gray, cv2.CV_64F).var()), 1),
+    }
+
+
+def quality_reason(quality, thresholds):
+    """Lý do bị loại đầu tiên (xem QUALITY_REASONS), None nếu đạt mọi ngưỡng"""
+    if quality['size'] < thresholds['min_size']:
+        return 'too_small'
+    if (abs(quality['yaw']) > thresholds['max_yaw'] or abs(quality['pitch']) > thresholds['max_pitch']
+            or abs(quality['roll']) > thresholds['max_roll']):
+        return 'bad_pose'
+    if quality['brightness'] < thresholds['min_brightness']:
+        return 'too_dark'
+    if quality['brightness'] > thresholds['max_brightness']:
+        return 'too_bright'
+    if quality['blur'] < thresholds['min_blur']:
+        return 'blurry'
+    return None
+
+
+def passes_quality(face, direction, config=FACE_QUALITY_CONFIG):
+    """Kiểm tra lại khuôn mặt lấy từ cache theo ngưỡng hiện tại; mặt được cache khi chưa có
+    chỉ số chất lượng (vd. từ /api/face/identify) không được dùng lại cho encode"""
+    if not config['enabled']:
+        return True
+    return 'quality' in face and quality_reason(face['quality'], quality_thresholds(direction, config)) is None
@@ -0,0 +1,127 @@
+"""Nhiều template khuôn mặt cho mỗi học sinh (bảng student_face_templates, migrations/004).
+
+vector_face vẫn là vector trung bình dùng cho client và đồng bộ; gallery so khớp
+thêm với từng template đã chuẩn hóa L2 của học sinh và lấy điểm cao nhất, nên ảnh
+nghiêng trái/phải khớp với template cùng hướng thay vì với vector trung bình.
+
+Mỗi học sinh có:
+- tối đa một template cho mỗi hướng enroll (front/left/right), ghi lại toàn bộ mỗi
+  lần vector_face được cập nhật và không bao giờ bị loại
+- tối đa ``max_captures`` template "capture" từ các lần nhận diện chắc chắn ở luồng
+  điểm danh; vượt quá thì bỏ capture cũ nhất, nên template bám theo ngoại hình hiện tại
+
+Cấu hình qua biến môi trường:
+    FACE_TEMPLATES_ENABLED              0: chỉ dùng vector_face như trước
+    FACE_TEMPLATE_MAX_CAPTURES          số capture tối đa mỗi học sinh (0 = không capture)
+    FACE_TEMPLATE_CAPTURE_MIN_SCORE     điểm khớp gallery tối thiểu để lưu capture
+    FACE_TEMPLATE_CAPTURE_MAX_SIMILARITY  bỏ capture giống template sẵn có hơn mức này (không thêm thông tin)
+    FACE_TEMPLATE_CAPTURE_INTERVAL      số giây tối thiểu giữa hai capture của cùng học sinh
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+from database import VECTOR_STORAGE_DTYPE
+from face_gallery import l2_normalize
+from vector_codec import encode_vector
+
+TEMPLATE_DIRECTIONS = ('front', 'left', 'right')
+CAPTURE_SOURCE = 'capture'
+
+FACE_TEMPLATE_CONFIG = {
+    'enabled': os.environ.get('FACE_TEMPLATES_ENABLED', '1').strip().lower() in ('1', 'true', 'yes', 'on'),
+    'max_captures': int(os.environ.get('FACE_TEMPLATE_MAX_CAPTURES', 5)),
+    'capture_min_score': float(os.environ.get('FACE_TEMPLATE_CAPTURE_MIN_SCORE', 0.6)),
+    'capture_max_similarity': float(os.environ.get('FACE_TEMPLATE_CAPTURE_MAX_SIMILARITY', 0.9)),
+    'capture_interval': float(os.environ.get('FACE_TEMPLATE_CAPTURE_INTERVAL', 3600)),
+}
+
+SELECT_TEMPLATES_QUERY = "SELECT student_id, vector FROM student_face_templates ORDER BY student_id, id"
+SELECT_STUDENT_TEMPLATES_QUERY = "SELECT vector FROM student_face_templates WHERE student_id = %s ORDER BY id"
+DELETE_STUDENT_TEMPLATES_QUERY = "DELETE FROM student_face_templates WHERE student_id = %s"
+INSERT_TEMPLATE_QUERY = ("INSERT INTO student_face_templates (student_id, source, vector, score, created_at) "
+                         "VALUES (%s, %s, %s, %s, %s)")
+# Giữ lại max_captures capture mới nhất (MySQL không cho LIMIT trực tiếp trong IN nên bọc bảng dẫn xuất)
+EVICT_CAPTURES_QUERY = f"""
+    DELETE FROM student_face_templates
+    WHERE student_id = %s AND source = '{CAPTURE_SOURCE}' AND id NOT IN (
+        SELECT id FROM (
+            SELECT id FROM student_face_templates
+            WHERE student_id = %s AND source = '{CAPTURE_SOURCE}'
+            ORDER BY id DESC LIMIT %s
+        ) AS keep_ids
+    )
+"""
+
+
+def template_rows(student_id, templates):
+    """Tham số INSERT_TEMPLATE_QUERY cho [(source, vector, score)], vector được chuẩn hóa L2 trước khi lưu"""
+    created_at = datetime.now()
+    return [(student_id, source, encode_vector(l2_normalize(vector), dtype=VECTOR_STORAGE_DTYPE), score, created_at)
+            for source, vector, score in templates]
+
+
+def enroll_statements(students):
+    """[(query, params_seq)] ghi lại toàn bộ template của các học sinh vừa đổi vector_face.
+
+    ``students`` là [(student_id, [(direction, vector, score)])]; danh sách template rỗng chỉ
+    xóa template cũ (vd. client cũ chỉ gửi vector_face), capture cũ cũng bị xóa vì có thể
+    thuộc ảnh enroll sai.
+    """
+    statements = [(DELETE_STUDENT_TEMPLATES_QUERY, [(student_id,) for student_id, _ in students])]
+    rows = [row for student_id, templates in students for row in template_rows(student_id, templates)]
+    if rows:
+        statements.append((INSERT_TEMPLATE_QUERY, rows))
+    return statements
+
+
+def capture_statements(student_id, vector, score, config=FACE_TEMPLATE_CONFIG):
+    """[(query, params_seq)] thêm một capture rồi loại các capture cũ vượt ``max_captures``"""
+    return [
+        (INSERT_TEMPLATE_QUERY, template_rows(student_id, [(CAPTURE_SOURCE, vector, score)])),
+        (EVICT_CAPTURES_QUERY, [(student_id, student_id, config['max_captures'])]),
+    ]
+
+
+class TemplateCaptures:
+    """Chọn các lần nhận diện đáng lưu thành template: điểm khớp cao, không quá giống template
+    sẵn có và cách lần capture trước của học sinh ít nhất ``capture_interval`` giây"""
+
+    def __init__(self, gallery, config=None):
+        self.config = config or FACE_TEMPLATE_CONFIG
+        self._gallery = gallery
+        self._last_capture = {}
+        self._lock = threading.Lock()
+        self._stats = {'candidates': 0, 'selected': 0, 'low_score': 0, 'redundant': 0, 'rate_limited': 0}
+
+    def select(self, captures):
+        """[(student_id, embedding, score)] -> các capture cần lưu"""
+        if not self.config['enabled'] or self.config['max_captures'] <= 0:
+            return []
+        selected = []
+        now = time.monotonic()
+        for student_id, embedding, score in captures:
+            with self._lock:
+                self._stats['candidates'] += 1
+                if score < self.config['capture_min_score']:
+                    self._stats['low_score'] += 1
+                    continue
+                last = self._last_capture.get(student_id)
+                if last is not None and now - last < self.config['capture_interval']:
+                    self._stats['rate_limited'] += 1
+                    continue
+            existing = self._gallery.student_templates(student_id)
+            if len(existing) and float((existing @ l2_normalize(embedding)).max()) > self.config['capture_max_similarity']:
+                with self._lock:
+                    self._stats['redundant'] += 1
+                continue
+            with self._lock:
+                self._last_capture[student_id] = now
+                self._stats['selected'] += 1
+            selected.append((student_id, embedding, score))
+        return selected
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
@@ -0,0 +1,119 @@
+"""Kiểm tra và giải mã ảnh tải lên trước khi detect.
+
+Kích thước ảnh được đọc từ header (JPEG SOF, PNG IHDR, BMP) mà không giải mã,
+nên ảnh quá lớn hoặc không phải ảnh bị loại trước khi tốn CPU/RAM giải mã toàn
+bộ. Ảnh JPEG lớn được giải mã thu nhỏ ngay trong bước IDCT bằng
+``cv2.IMREAD_REDUCED_COLOR_2/4/8``: detector chỉ cần khoảng 640px, ảnh 12MP từ
+điện thoại giải mã ở 1/4 kích thước nhanh hơn nhiều và tốn ít bộ nhớ hơn 16 lần.
+
+    IMAGE_MAX_BYTES     dung lượng tối đa một ảnh (byte)
+    IMAGE_MAX_PIXELS    số điểm ảnh tối đa theo header
+    IMAGE_TARGET_SIDE   cạnh dài tối thiểu cần giữ lại sau khi thu nhỏ
+"""
+import os
+import struct
+
+import cv2
+import numpy as np
+
+IMAGE_MAX_BYTES = int(os.environ.get('IMAGE_MAX_BYTES', 20 * 1024 * 1024))
+IMAGE_MAX_PIXELS = int(os.environ.get('IMAGE_MAX_PIXELS', 50_000_000))
+IMAGE_TARGET_SIDE = int(os.environ.get('IMAGE_TARGET_SIDE', 1280))
+
+REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+# Marker SOF của JPEG (trừ DHT 0xC4, JPG 0xC8, DAC 0xCC) chứa kích thước ảnh
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class ImageRejected(Exception):
+    """Ảnh bị loại trước khi detect; error_code theo quy ước của API (402, 413)"""
+
+    def __init__(self, error_code, reason, message):
+        super().__init__(message)
+        self.error_code = error_code
+        self.reason = reason
+
+
+def _jpeg_size(data):
+    pos = 2
+    length = len(data)
+    while pos + 4 <= length:
+        if data[pos] != 0xFF:
+            return None
+        marker = data[pos + 1]
+        if marker == 0xFF:
+            # Byte đệm giữa các marker
+            pos += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:
+            pos += 2
+            continue
+        if marker in (0xD9, 0xDA):
+            # Hết ảnh hoặc bắt đầu dữ liệu nén mà chưa gặp SOF
+            return None
+        segment_length = struct.unpack('>H', data[pos + 2:pos + 4])[0]
+        if marker in _JPEG_SOF_MARKERS:
+            if pos + 9 > length:
+                return None
+            height, width = struct.unpack('>HH', data[pos + 5:pos + 9])
+            return width, height
+        pos += 2 + segment_length
+    return None
+
+
+def read_image_header(data):
+    """Trả về (format, width, height) từ header, None nếu không nhận ra định dạng"""
+    if data[:3] == b'\xff\xd8\xff':
+        size = _jpeg_size(data)
+        return ('jpeg',) + size if size else None
+    if data[:8] == b'\x89PNG\r\n\x1a\n' and data[12:16] == b'IHDR' and len(data) >= 24:
+        width, height = struct.unpack('>II', data[16:24])
+        return 'png', width, height
+    if data[:2] == b'BM' and len(data) >= 26:
+        width, height = struct.unpack('<ii', data[18:26])
+        return 'bmp', abs(width), abs(height)
+    return None
+
+
+def reduction_factor(width, height, target_side=IMAGE_TARGET_SIDE):
+    """Hệ số thu nhỏ lớn nhất (8, 4, 2) mà cạnh dài vẫn không nhỏ hơn target_side"""
+    longest = max(width, height)
+    for factor, _ in REDUCED_FLAGS:
+        if longest // factor >= target_side:
+            return factor
+    return 1
+
+
+def load_image(data, max_bytes=IMAGE_MAX_BYTES, max_pixels=IMAGE_MAX_PIXELS, target_side=IMAGE_TARGET_SIDE):
+    """Kiểm tra header rồi giải mã ảnh; trả về (ảnh BGR, scale) với scale = kích thước gốc / kích thước đã giải mã.
+
+    Báo ImageRejected nếu ảnh rỗng, không phải ảnh, quá lớn hoặc hỏng.
+    """
+    if not data:
+        raise ImageRejected(402, 'unreadable', 'Ảnh rỗng')
+    if len(data) > max_bytes:
+        raise ImageRejected(413, 'too_many_bytes', f'Ảnh {len(data)} byte vượt giới hạn {max_bytes} byte')
+
+    header = read_image_header(data)
+    if header is None:
+        raise ImageRejected(402, 'unsupported_format', 'Không nhận ra định dạng ảnh (chỉ hỗ trợ JPEG, PNG, BMP)')
+    fmt, width, height = header
+    if width <= 0 or height <= 0:
+        raise ImageRejected(402, 'unreadable', f'Kích thước ảnh không hợp lệ: {width}x{height}')
+    if width * height > max_pixels:
+        raise ImageRejected(413, 'too_many_pixels', f'Ảnh {width}x{height} vượt giới hạn {max_pixels} điểm ảnh')
+
+    flag, factor = cv2.IMREAD_COLOR, 1
+    if fmt == 'jpeg':
+        factor = reduction_factor(width, height, target_side)
+        flag = dict(REDUCED_FLAGS).get(factor, cv2.IMREAD_COLOR)
+
+    img = cv2.imdecode(np.frombuffer(data, np.uint8), flag)
+    if img is None:
+        raise ImageRejected(402, 'corrupt', 'Không giải mã được ảnh (dữ liệu hỏng)')
+    return img, float(factor)
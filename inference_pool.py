@@ -0,0 +1,210 @@
+"""Pool tiến trình chạy inference, tách khỏi các thread phục vụ HTTP.
+
+Mỗi worker là một tiến trình riêng giữ một bộ model (FaceModels), được ghim vào
+một nhóm core CPU cố định. Số việc đang chờ + đang chạy bị giới hạn bởi
+``max_queue``; khi đầy, ``run`` báo QueueFull ngay để API trả 503 thay vì để
+request treo đến timeout. Với ``workers = 0`` inference chạy ngay trong thread
+của request (chế độ cũ) nhưng vẫn áp dụng giới hạn hàng đợi.
+
+Cấu hình qua biến môi trường:
+
+    INFERENCE_WORKERS           số tiến trình worker (0 = chạy trong tiến trình web)
+    INFERENCE_MAX_QUEUE         số việc tối đa đang chờ + đang chạy
+    INFERENCE_CORES_PER_WORKER  số core ghim cho mỗi worker (0 = chia đều số core)
+    INFERENCE_TIMEOUT           thời gian tối đa (giây) chờ kết quả một việc (quá thì API trả 504)
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeout
+
+from face_models import FACE_MODEL_CONFIG, FaceModelManager
+from metrics import capture_stages, observe_stages, stage_timer
+
+logger = logging.getLogger(__name__)
+
+INFERENCE_POOL_CONFIG = {
+    'workers': int(os.environ.get('INFERENCE_WORKERS', 0)),
+    'max_queue': int(os.environ.get('INFERENCE_MAX_QUEUE', 32)),
+    'cores_per_worker': int(os.environ.get('INFERENCE_CORES_PER_WORKER', 0)),
+    'timeout': float(os.environ.get('INFERENCE_TIMEOUT', 30)),
+}
+
+
+class QueueFull(Exception):
+    pass
+
+
+# Bộ model của tiến trình worker hiện tại (chỉ có giá trị bên trong worker)
+_worker_models = None
+
+
+def _available_cores():
+    if hasattr(os, 'sched_getaffinity'):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _init_worker(counter, workers, cores_per_worker, model_config):
+    """Khởi tạo worker: ghim core theo thứ tự worker rồi nạp model"""
+    global _worker_models
+    with counter.get_lock():
+        index = counter.value
+        counter.value += 1
+
+    cores = _available_cores()
+    per_worker = cores_per_worker or max(1, len(cores) // workers)
+    assigned = [cores[(index * per_worker + i) % len(cores)] for i in range(per_worker)]
+    if hasattr(os, 'sched_setaffinity'):
+        os.sched_setaffinity(0, assigned)
+
+    # Worker chạy tuần tự từng việc nên không có gì để gom batch giữa các request
+    config = dict(model_config, lazy=False, batch_size=0)
+    if not config['intra_op_threads']:
+        # Mặc định ONNX Runtime tạo thread bằng tổng số core máy, vượt quá số core được ghim
+        config['intra_op_threads'] = len(assigned)
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"🧵 Worker inference #{index} (pid {os.getpid()}) ghim core {assigned}")
+    _worker_models = FaceModelManager(config)
+    _worker_models.get()
+
+
+def _call_in_worker(fn, args):
+    """Chạy fn trong worker, trả kèm thời gian các bước để tiến trình web ghi vào /metrics"""
+    with capture_stages() as timings:
+        result = fn(_worker_models.get(), *args)
+    return result, timings
+
+
+def _ping():
+    return os.getpid()
+
+
+class InferencePool:
+    def __init__(self, model_manager, config=None, model_config=None):
+        self.config = config or INFERENCE_POOL_CONFIG
+        self._model_manager = model_manager
+        self._slots = threading.BoundedSemaphore(self.config['max_queue'])
+        self._lock = threading.Lock()
+        self._stats = {'in_flight': 0, 'completed': 0, 'rejected': 0, 'timeouts': 0, 'errors': 0}
+        self._executor = None
+        if self.config['workers'] > 0:
+            # spawn: worker không kế thừa trạng thái của tiến trình web (Flask, connection DB...)
+            context = multiprocessing.get_context('spawn')
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.config['workers'],
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(context.Value('i', 0), self.config['workers'],
+                          self.config['cores_per_worker'], model_config or FACE_MODEL_CONFIG),
+            )
+
+    def start(self):
+        """Khởi động sẵn mọi worker (nạp model) thay vì đợi request đầu tiên"""
+        if self._executor is None:
+            self._model_manager.get()
+            return
+        futures = [self._executor.submit(_ping) for _ in range(self.config['workers'])]
+        for future in futures:
+            future.result()
+
+    def _take_slot(self):
+        if not self._slots.acquire(blocking=False):
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise QueueFull(f"Hàng đợi inference đã đầy ({self.config['max_queue']} việc)")
+        with self._lock:
+            self._stats['in_flight'] += 1
+
+    def _finish(self, key):
+        with self._lock:
+            self._stats[key] += 1
+
+    def _release_slot(self):
+        with self._lock:
+            self._stats['in_flight'] -= 1
+        self._slots.release()
+
+    def _submit(self, fn, args):
+        """Gửi việc cho worker; slot chỉ được trả khi việc thật sự kết thúc. future.cancel() không
+        dừng được việc đang chạy trong worker, nên trả slot ngay khi timeout sẽ làm hàng đợi của
+        executor vượt max_queue."""
+        try:
+            future = self._executor.submit(_call_in_worker, fn, args)
+        except Exception:
+            self._release_slot()
+            raise
+        future.add_done_callback(lambda _: self._release_slot())
+        return future
+
+    def run(self, fn, *args):
+        """Chạy ``fn(face_app, *args)`` trên worker; fn phải là hàm cấp module (pickle được)"""
+        self._take_slot()
+        try:
+            with stage_timer('inference_total'):
+                if self._executor is None:
+                    try:
+                        result = fn(self._model_manager.get(), *args)
+                    finally:
+                        self._release_slot()
+                else:
+                    future = self._submit(fn, args)
+                    try:
+                        result, timings = future.result(timeout=self.config['timeout'])
+                    except FutureTimeout:
+                        future.cancel()
+                        self._finish('timeouts')
+                        raise
+                    observe_stages(timings)
+            self._finish('completed')
+            return result
+        except FutureTimeout:
+            # Đã tính vào timeouts
+            raise
+        except Exception:
+            self._finish('errors')
+            raise
+
+    async def run_async(self, fn, *args):
+        """Như ``run`` nhưng cho event loop: chờ kết quả của worker mà không giữ thread nào.
+
+        Với ``workers = 0`` inference vẫn phải chạy trong tiến trình web nên được đẩy
+        sang executor mặc định của loop.
+        """
+        if self._executor is None:
+            return await asyncio.get_running_loop().run_in_executor(None, self.run, fn, *args)
+        self._take_slot()
+        try:
+            with stage_timer('inference_total'):
+                future = self._submit(fn, args)
+                try:
+                    result, timings = await asyncio.wait_for(asyncio.wrap_future(future), self.config['timeout'])
+                except asyncio.TimeoutError:
+                    future.cancel()
+                    self._finish('timeouts')
+                    raise FutureTimeout() from None
+                observe_stages(timings)
+            self._finish('completed')
+            return result
+        except FutureTimeout:
+            # Đã tính vào timeouts
+            raise
+        except Exception:
+            self._finish('errors')
+            raise
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+        stats.update({
+            'workers': self.config['workers'],
+            'max_queue': self.config['max_queue'],
+        })
+        return stats
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,217 @@
+"""Metrics dạng Prometheus (text exposition format 0.0.4), không cần thư viện ngoài.
+
+- ``registry``: counter/histogram dùng chung trong tiến trình, xuất ở ``/metrics``
+- ``stage_timer(stage)``: đo thời gian một bước của pipeline (giải mã ảnh, detect,
+  recognition, truy vấn MySQL...) vào histogram ``face_stage_duration_seconds``
+- ``install_flask_metrics(app)``: histogram theo endpoint và route ``/metrics``
+
+Các bước chạy trong worker của inference_pool được ghi vào bộ đệm bằng
+``capture_stages`` rồi gửi về tiến trình web cùng kết quả (``observe_stages``),
+nên một ``/metrics`` thấy được toàn bộ thời gian dù inference chạy ở tiến trình khác.
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return repr(value)
+    return str(value)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, _format_labels(self.labels, key), value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(str(labels[name]) for name in self.labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[0][i] += 1
+                    break
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {key: ([*series[0]], series[1], series[2]) for key, series in self._values.items()}
+        for key, (counts, total, count) in sorted(values.items()):
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield self.name + '_bucket', _format_labels(self.labels, key, [('le', _format_value(float(bound)))]), cumulative
+            yield self.name + '_sum', _format_labels(self.labels, key), total
+            yield self.name + '_count', _format_labels(self.labels, key), count
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, documentation, labels=()):
+        return self._register(Counter(name, documentation, labels))
+
+    def histogram(self, name, documentation, labels=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labels, buckets))
+
+    def register_collector(self, collector):
+        """collector() trả về list (name, type, documentation, [(labels dict, value)]) đọc tại thời điểm scrape"""
+        with self._lock:
+            self._collectors.append(collector)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            metrics = list(self._metrics.values())
+            collectors = list(self._collectors)
+        for metric in metrics:
+            lines.append(f'# HELP {metric.name} {metric.documentation}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for name, labels, value in metric.samples():
+                lines.append(f'{name}{labels} {_format_value(value)}')
+        for collector in collectors:
+            for name, metric_type, documentation, samples in collector():
+                lines.append(f'# HELP {name} {documentation}')
+                lines.append(f'# TYPE {name} {metric_type}')
+                for labels, value in samples:
+                    if value is None:
+                        continue
+                    label_text = _format_labels(list(labels), list(labels.values()))
+                    lines.append(f'{name}{label_text} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+STAGE_SECONDS = registry.histogram(
+    'face_stage_duration_seconds', 'Thời gian từng bước xử lý (giải mã, detect, recognition, database...)', ('stage',))
+HTTP_REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'Thời gian xử lý request theo endpoint', ('endpoint', 'method', 'status'))
+IMAGES_REJECTED = registry.counter(
+    'face_images_rejected_total', 'Số ảnh/request bị từ chối theo error_code', ('endpoint', 'error_code', 'reason'))
+
+_capture = threading.local()
+
+
+@contextmanager
+def capture_stages():
+    """Gom các stage_timer trong thread hiện tại vào list thay vì ghi histogram (dùng trong worker)"""
+    previous = getattr(_capture, 'timings', None)
+    timings = _capture.timings = []
+    try:
+        yield timings
+    finally:
+        _capture.timings = previous
+
+
+def observe_stages(timings):
+    """Ghi các (stage, giây) nhận từ worker vào histogram của tiến trình hiện tại"""
+    for stage, seconds in timings:
+        STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+@contextmanager
+def stage_timer(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        timings = getattr(_capture, 'timings', None)
+        if timings is not None:
+            timings.append((stage, elapsed))
+        else:
+            STAGE_SECONDS.observe(elapsed, stage=stage)
+
+
+def count_rejection(endpoint, error_code, reason=''):
+    IMAGES_REJECTED.inc(endpoint=endpoint, error_code=error_code, reason=reason)
+
+
+def install_flask_metrics(app):
+    """Đo thời gian mọi request theo endpoint và thêm route GET /metrics"""
+    from flask import Response, g, request
+
+    @app.before_request
+    def _start_timer():
+        g._metrics_started = time.perf_counter()
+
+    @app.after_request
+    def _observe_request(response):
+        started = g.pop('_metrics_started', None)
+        if started is not None and request.endpoint != 'metrics':
+            HTTP_REQUEST_SECONDS.observe(time.perf_counter() - started, endpoint=request.endpoint or 'unknown',
+                                         method=request.method, status=response.status_code)
+        return response
+
+    @app.route('/metrics', methods=['GET'], endpoint='metrics')
+    def _metrics():
+        return Response(registry.render(), content_type=CONTENT_TYPE)
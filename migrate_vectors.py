@@ -0,0 +1,113 @@
+"""Chuyển toàn bộ vector_face từ định dạng base64(JSON) cũ sang định dạng nhị phân (vector_codec)
+và điền các cột metadata (vector_dim, vector_dtype, vector_norm, vector_checksum) còn thiếu.
+
+Cách dùng:
+    python migrate_vectors.py --alter-column        # đổi cột sang MEDIUMBLOB rồi ghi lại dữ liệu
+    python migrate_vectors.py --dtype float16       # lưu float16 thay vì float32
+    python migrate_vectors.py --dry-run             # chỉ đếm, không ghi
+    python migrate_vectors.py --no-metadata         # chưa chạy migrations/002_vector_metadata.sql
+"""
+import argparse
+import logging
+import time
+
+from database import db_manager
+from vector_codec import VectorCodecError, decode_vector, encode_vector, is_binary_vector, vector_metadata
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+def alter_column(connection):
+    """Dữ liệu base64 cũ là ASCII nên giữ nguyên khi đổi kiểu cột TEXT -> MEDIUMBLOB"""
+    cursor = connection.cursor()
+    try:
+        cursor.execute("ALTER TABLE students MODIFY vector_face MEDIUMBLOB NULL")
+        connection.commit()
+        logger.info("✅ Đã đổi cột students.vector_face sang MEDIUMBLOB.")
+    finally:
+        cursor.close()
+
+
+def migrate(connection, dtype='float32', batch_size=500, dry_run=False, metadata=True):
+    stats = {'scanned': 0, 'converted': 0, 'already_binary': 0, 'metadata_filled': 0, 'failed': 0}
+    last_id = 0
+    cursor = connection.cursor()
+    checksum_column = 'vector_checksum' if metadata else 'NULL'
+    try:
+        while True:
+            cursor.execute(
+                f"SELECT id, vector_face, {checksum_column} FROM students "
+                "WHERE id > %s AND vector_face IS NOT NULL ORDER BY id LIMIT %s",
+                (last_id, batch_size)
+            )
+            rows = cursor.fetchall()
+            if not rows:
+                break
+            last_id = rows[-1][0]
+
+            updates = []
+            for student_id, raw, checksum in rows:
+                stats['scanned'] += 1
+                if isinstance(raw, str):
+                    raw = raw.encode()
+                if is_binary_vector(raw):
+                    stats['already_binary'] += 1
+                    if not metadata or checksum is not None:
+                        continue
+                    encoded = bytes(raw)
+                else:
+                    try:
+                        encoded = encode_vector(decode_vector(raw), dtype=dtype)
+                    except VectorCodecError as e:
+                        logger.warning(f"⚠️ Bỏ qua học sinh {student_id}: {e}")
+                        stats['failed'] += 1
+                        continue
+                    stats['converted'] += 1
+                if metadata:
+                    stats['metadata_filled'] += 1
+                    updates.append((encoded,) + vector_metadata(encoded) + (student_id,))
+                else:
+                    updates.append((encoded, student_id))
+
+            if updates and not dry_run:
+                if metadata:
+                    cursor.executemany(
+                        "UPDATE students SET vector_face = %s, vector_dim = %s, vector_dtype = %s, "
+                        "vector_norm = %s, vector_checksum = %s WHERE id = %s", updates)
+                else:
+                    cursor.executemany("UPDATE students SET vector_face = %s WHERE id = %s", updates)
+                connection.commit()
+            logger.info(f"📦 Đã xử lý đến id={last_id}: {stats}")
+    finally:
+        cursor.close()
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Chuyển vector_face sang định dạng nhị phân')
+    parser.add_argument('--dtype', choices=['float32', 'float16'], default='float32')
+    parser.add_argument('--batch-size', type=int, default=500)
+    parser.add_argument('--alter-column', action='store_true',
+                        help='Đổi kiểu cột vector_face sang MEDIUMBLOB trước khi chuyển')
+    parser.add_argument('--dry-run', action='store_true')
+    parser.add_argument('--no-metadata', action='store_true',
+                        help='Không điền các cột metadata vector (khi chưa chạy migration 002)')
+    args = parser.parse_args()
+
+    connection = db_manager.get_connection()
+    if not connection:
+        raise SystemExit("❌ Không kết nối được database.")
+    try:
+        if args.alter_column and not args.dry_run:
+            alter_column(connection)
+        started = time.perf_counter()
+        stats = migrate(connection, dtype=args.dtype, batch_size=args.batch_size, dry_run=args.dry_run,
+                        metadata=not args.no_metadata)
+        logger.info(f"✅ Hoàn tất sau {time.perf_counter() - started:.1f}s: {stats}")
+    finally:
+        connection.close()
+
+
+if __name__ == '__main__':
+    main()
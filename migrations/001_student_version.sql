@@ -0,0 +1,26 @@
+-- Cột version cho change feed /api/student/changes (đơn vị: micro giây epoch).
+-- Chạy: mysql tranmanh_cameraai < migrations/001_student_version.sql
+
+ALTER TABLE students
+    ADD COLUMN version BIGINT UNSIGNED NOT NULL DEFAULT 0,
+    ADD INDEX idx_students_version (version, id);
+
+UPDATE students SET version = CAST(UNIX_TIMESTAMP(NOW(6)) * 1000000 AS UNSIGNED) WHERE version = 0;
+
+-- Sửa trực tiếp trong database (trang quản trị) cũng phải tăng version
+CREATE TRIGGER trg_students_before_update BEFORE UPDATE ON students FOR EACH ROW
+    SET NEW.version = IF(NEW.version = OLD.version,
+                         CAST(UNIX_TIMESTAMP(NOW(6)) * 1000000 AS UNSIGNED),
+                         NEW.version);
+
+-- Học sinh bị xóa được ghi lại để camera xóa theo khi đồng bộ
+CREATE TABLE IF NOT EXISTS student_deletions (
+    student_id INT NOT NULL PRIMARY KEY,
+    version BIGINT UNSIGNED NOT NULL,
+    INDEX idx_student_deletions_version (version)
+);
+
+CREATE TRIGGER trg_students_after_delete AFTER DELETE ON students FOR EACH ROW
+    INSERT INTO student_deletions (student_id, version)
+    VALUES (OLD.id, CAST(UNIX_TIMESTAMP(NOW(6)) * 1000000 AS UNSIGNED))
+    ON DUPLICATE KEY UPDATE version = VALUES(version);
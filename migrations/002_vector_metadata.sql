@@ -0,0 +1,21 @@
+-- Metadata của vector_face để các API đọc không phải tải/giải mã vector.
+-- Chạy: mysql tranmanh_cameraai < migrations/002_vector_metadata.sql
+-- Sau đó điền metadata cho dữ liệu cũ: python migrate_vectors.py
+
+ALTER TABLE students
+    ADD COLUMN vector_dim SMALLINT UNSIGNED NULL,
+    ADD COLUMN vector_dtype VARCHAR(8) NULL,
+    ADD COLUMN vector_norm FLOAT NULL,
+    -- CRC32 của vector_face (giống hàm CRC32() của MySQL)
+    ADD COLUMN vector_checksum INT UNSIGNED NULL;
+
+-- vector_face bị sửa trực tiếp trong database mà không kèm metadata mới: xóa metadata cũ
+-- để API không trả thông tin sai; migrate_vectors.py sẽ điền lại
+CREATE TRIGGER trg_students_vector_metadata BEFORE UPDATE ON students FOR EACH ROW
+    FOLLOWS trg_students_before_update
+    SET NEW.vector_checksum = IF(NOT (NEW.vector_face <=> OLD.vector_face)
+                                 AND NEW.vector_checksum <=> OLD.vector_checksum,
+                                 NULL, NEW.vector_checksum),
+        NEW.vector_dim = IF(NEW.vector_checksum IS NULL, NULL, NEW.vector_dim),
+        NEW.vector_dtype = IF(NEW.vector_checksum IS NULL, NULL, NEW.vector_dtype),
+        NEW.vector_norm = IF(NEW.vector_checksum IS NULL, NULL, NEW.vector_norm);
@@ -0,0 +1,14 @@
+-- Sự kiện điểm danh sinh từ luồng camera (/api/attendance/stream), đã khử trùng lặp theo camera.
+-- Chạy: mysql tranmanh_cameraai < migrations/003_attendance_events.sql
+
+CREATE TABLE IF NOT EXISTS attendance_events (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    camera_id VARCHAR(64) NOT NULL,
+    student_id INT NOT NULL,
+    score FLOAT NOT NULL,
+    seen_at DATETIME(3) NOT NULL,
+    -- Track trong trạng thái của camera trên server (chỉ để tra cứu/gỡ lỗi)
+    track_id INT UNSIGNED NULL,
+    INDEX idx_attendance_student_seen (student_id, seen_at),
+    INDEX idx_attendance_camera_seen (camera_id, seen_at)
+);
@@ -0,0 +1,16 @@
+-- Nhiều template khuôn mặt đã chuẩn hóa L2 cho mỗi học sinh (xem face_templates.py).
+-- students.vector_face vẫn là vector trung bình; gallery lấy điểm cao nhất trên các template.
+-- Chạy: mysql tranmanh_cameraai < migrations/004_face_templates.sql
+
+CREATE TABLE IF NOT EXISTS student_face_templates (
+    id BIGINT UNSIGNED NOT NULL AUTO_INCREMENT PRIMARY KEY,
+    student_id INT NOT NULL,
+    -- front/left/right (ảnh enroll) hoặc capture (nhận diện chắc chắn từ luồng điểm danh)
+    source VARCHAR(16) NOT NULL,
+    -- Cùng định dạng nhị phân với vector_face (vector_codec)
+    vector BLOB NOT NULL,
+    -- det_score của ảnh enroll hoặc điểm khớp gallery của capture
+    score FLOAT NULL,
+    created_at DATETIME(3) NOT NULL,
+    INDEX idx_face_templates_student_source (student_id, source, id)
+);
@@ -0,0 +1,157 @@
+import logging
+import re
+import threading
+import time
+import unicodedata
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+_SPACES = re.compile(r'\s+')
+
+
+def fold_name(text):
+    """Chuẩn hóa tên để so khớp không dấu: 'Nguyễn Văn Đức' -> 'nguyen van duc'"""
+    if not text:
+        return ''
+    text = text.lower().replace('đ', 'd')
+    text = ''.join(c for c in unicodedata.normalize('NFD', text) if not unicodedata.combining(c))
+    return _SPACES.sub(' ', text).strip()
+
+
+def trigrams(folded):
+    """Tập trigram của chuỗi đã chuẩn hóa (không thêm ký tự đệm, nên khớp được chuỗi con)"""
+    return {folded[i:i + 3] for i in range(len(folded) - 2)}
+
+
+class NameIndex:
+    """Chỉ mục trigram của full_name, giữ trong RAM để tìm theo chuỗi con không dấu.
+
+    Mỗi trigram của tên đã bỏ dấu trỏ tới tập id học sinh chứa nó; một truy vấn
+    lấy giao các tập của trigram trong truy vấn rồi kiểm tra lại bằng so khớp
+    chuỗi con, nên không phải quét bảng students. ``loader`` trả về các cặp
+    (id, full_name); chỉ mục được nạp lười và nạp lại nền sau ``max_age`` giây
+    để bắt các thay đổi sửa trực tiếp trong database.
+    """
+
+    def __init__(self, loader, max_age=300):
+        self._loader = loader
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()
+        self._names = {}
+        self._postings = defaultdict(set)
+        self._loaded_at = None
+        self._dirty = True
+        self._generation = 0
+        self._refreshing = False
+
+    def invalidate(self):
+        with self._lock:
+            self._dirty = True
+            self._generation += 1
+
+    def reload(self):
+        with self._lock:
+            generation = self._generation
+        rows = self._loader()
+        if rows is None:
+            raise RuntimeError('Không nạp được danh sách tên học sinh từ database')
+
+        names, postings = {}, defaultdict(set)
+        for student_id, full_name in rows:
+            folded = fold_name(full_name)
+            names[student_id] = folded
+            for gram in trigrams(folded):
+                postings[gram].add(student_id)
+
+        with self._lock:
+            self._names, self._postings = names, postings
+            self._loaded_at = time.monotonic()
+            self._dirty = generation != self._generation
+        logger.info(f"✅ Đã nạp chỉ mục tên: {len(names)} học sinh, {len(postings)} trigram.")
+
+    def _refresh_in_background(self):
+        try:
+            with self._reload_lock:
+                self.reload()
+        except Exception as e:
+            logger.error(f"Lỗi nạp lại chỉ mục tên: {e}")
+        finally:
+            self._refreshing = False
+
+    def _ensure_loaded(self):
+        if self._dirty or self._loaded_at is None:
+            with self._reload_lock:
+                if self._dirty or self._loaded_at is None:
+                    self.reload()
+        elif self.max_age and time.monotonic() - self._loaded_at > self.max_age and not self._refreshing:
+            # Chỉ mục cũ vẫn trả lời trong lúc nạp lại ở thread nền
+            self._refreshing = True
+            threading.Thread(target=self._refresh_in_background, name='name-index-refresh', daemon=True).start()
+
+    def upsert(self, student_id, full_name):
+        """Thêm/sửa tên một học sinh mà không nạp lại toàn bộ"""
+        folded = fold_name(full_name)
+        with self._lock:
+            if self._dirty:
+                return
+            old = self._names.get(student_id)
+            if old is not None:
+                for gram in trigrams(old):
+                    self._postings[gram].discard(student_id)
+            self._names[student_id] = folded
+            for gram in trigrams(folded):
+                self._postings[gram].add(student_id)
+
+    def remove(self, student_id):
+        with self._lock:
+            old = self._names.pop(student_id, None)
+            if old is not None:
+                for gram in trigrams(old):
+                    self._postings[gram].discard(student_id)
+
+    def search(self, query):
+        """Trả về danh sách id có tên chứa ``query`` (không phân biệt dấu, hoa thường), xếp hạng:
+        trùng toàn bộ tên, rồi khớp đầu một từ, rồi chuỗi con; cùng hạng thì theo id
+        """
+        folded = fold_name(query)
+        if not folded:
+            return []
+        self._ensure_loaded()
+        grams = trigrams(folded)
+        ranked = []
+        # Giữ lock khi tra cứu vì upsert sửa trực tiếp các tập posting
+        with self._lock:
+            names = self._names
+            if grams:
+                sets = sorted((self._postings.get(gram, set()) for gram in grams), key=len)
+                candidates = sets[0].intersection(*sets[1:])
+            else:
+                # Truy vấn 1-2 ký tự không có trigram: quét tên trong RAM
+                candidates = names.keys()
+
+            for student_id in candidates:
+                name = names.get(student_id)
+                if name is None:
+                    continue
+                pos = name.find(folded)
+                if pos < 0:
+                    continue
+                if name == folded:
+                    rank = 0
+                elif pos == 0 or name[pos - 1] == ' ':
+                    rank = 1
+                else:
+                    rank = 2
+                ranked.append((rank, student_id))
+        ranked.sort()
+        return [student_id for _, student_id in ranked]
+
+    def stats(self):
+        with self._lock:
+            return {
+                'students': len(self._names),
+                'trigrams': len(self._postings),
+                'age_seconds': round(time.monotonic() - self._loaded_at, 1) if self._loaded_at else None,
+            }
@@ -0,0 +1,89 @@
+"""Tạo bản INT8 (lượng tử hóa động) của model detection/recognition cho FACE_MODEL_PRECISION=int8.
+
+Trọng số Conv/MatMul/Gemm được lượng tử hóa sẵn, activation lượng tử hóa lúc chạy
+nên không cần tập ảnh hiệu chỉnh. Model được ghi vào thư mục int8/ của gói model
+(vd. ~/.insightface/models/buffalo_l/int8/w600k_r50.onnx), cùng tên với bản fp32.
+
+Cách dùng:
+    python quantize_models.py                        # gói FACE_MODEL_PACK, detection + recognition
+    python quantize_models.py --modules recognition  # chỉ lượng tử hóa model recognition
+    python quantize_models.py --per-tensor           # một scale cho cả tensor (nhỏ hơn, kém chính xác hơn)
+    python quantize_models.py --force                # ghi đè bản int8 đã có
+
+Sau khi tạo, so sánh với bản fp32 bằng test/quantization_check.py trước khi bật.
+"""
+import argparse
+import logging
+import os
+import os.path as osp
+import tempfile
+import time
+
+from insightface.utils import ensure_available
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from onnxruntime.quantization.shape_inference import quant_pre_process
+
+from face_models import FACE_MODEL_CONFIG, KNOWN_MODEL_FILES, QUANTIZED_MODEL_DIRS, model_files
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+WEIGHT_TYPES = {'qint8': QuantType.QInt8, 'quint8': QuantType.QUInt8}
+
+
+def quantize_model(source, target, per_channel=True, weight_type='qint8', preprocess=True):
+    """Lượng tử hóa một file .onnx; bước tiền xử lý (gộp BatchNorm, suy shape) giúp
+    giảm sai số nhưng bị bỏ qua nếu model không hỗ trợ"""
+    with tempfile.TemporaryDirectory() as tmp:
+        model_input = source
+        if preprocess:
+            prepared = osp.join(tmp, 'prepared.onnx')
+            try:
+                # Model CNN có shape cố định theo kênh, không cần suy shape symbolic (cần sympy)
+                quant_pre_process(source, prepared, skip_symbolic_shape=True)
+                model_input = prepared
+            except Exception as e:
+                logger.warning(f"⚠️ Bỏ qua bước tiền xử lý của {osp.basename(source)}: {e}")
+        quantize_dynamic(model_input, target, per_channel=per_channel, weight_type=WEIGHT_TYPES[weight_type],
+                         op_types_to_quantize=['Conv', 'MatMul', 'Gemm'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Lượng tử hóa INT8 các model của gói InsightFace')
+    parser.add_argument('--pack', default=FACE_MODEL_CONFIG['name'], help='tên gói model (mặc định FACE_MODEL_PACK)')
+    parser.add_argument('--root', default=FACE_MODEL_CONFIG['root'], help='thư mục chứa model (mặc định FACE_MODEL_ROOT)')
+    parser.add_argument('--modules', default='detection,recognition', help='module cần lượng tử hóa, phân cách dấu phẩy')
+    parser.add_argument('--weight-type', choices=sorted(WEIGHT_TYPES), default='qint8')
+    parser.add_argument('--per-tensor', action='store_true', help='một scale cho cả tensor thay vì theo từng kênh')
+    parser.add_argument('--no-preprocess', action='store_true', help='không chạy bước tiền xử lý trước khi lượng tử hóa')
+    parser.add_argument('--force', action='store_true', help='ghi đè bản int8 đã có')
+    args = parser.parse_args()
+
+    modules = {m.strip() for m in args.modules.split(',') if m.strip()}
+    model_dir = ensure_available('models', args.pack, root=args.root)
+    target_dir = osp.join(model_dir, QUANTIZED_MODEL_DIRS['int8'])
+    os.makedirs(target_dir, exist_ok=True)
+
+    done = 0
+    for source, _ in model_files(model_dir):
+        name = osp.basename(source)
+        module = KNOWN_MODEL_FILES.get(osp.splitext(name)[0])
+        if module not in modules:
+            logger.info(f"Bỏ qua {name} ({module or 'không rõ module'})")
+            continue
+        target = osp.join(target_dir, name)
+        if osp.exists(target) and not args.force:
+            logger.info(f"Đã có {target}, bỏ qua (dùng --force để ghi đè)")
+            continue
+        started = time.perf_counter()
+        quantize_model(source, target, per_channel=not args.per_tensor, weight_type=args.weight_type,
+                       preprocess=not args.no_preprocess)
+        done += 1
+        logger.info(f"✅ {name} ({module}): {osp.getsize(source) / 2**20:.1f} MB -> "
+                    f"{osp.getsize(target) / 2**20:.1f} MB trong {time.perf_counter() - started:.1f}s")
+
+    logger.info(f"Đã lượng tử hóa {done} model vào {target_dir}. Bật bằng FACE_MODEL_PRECISION=int8.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,137 @@
+"""Gom ảnh khuôn mặt đã căn chỉnh từ nhiều request đồng thời thành một batch recognition.
+
+Một thread nền lấy việc đầu tiên trong hàng đợi, chờ thêm tối đa ``max_wait_ms``
+hoặc đến khi đủ ``max_batch`` khuôn mặt, chạy model recognition một lần rồi trả
+embedding về đúng request. Độ trễ thêm vào mỗi request không vượt quá
+``max_wait_ms`` cộng thời gian chạy một batch.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Ngưỡng trên của các bucket histogram kích thước batch
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64)
+
+
+class BatcherQueueFull(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ('crops', 'future', 'enqueued_at')
+
+    def __init__(self, crops):
+        self.crops = crops
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class RecognitionBatcher:
+    def __init__(self, rec_model, max_batch=32, max_wait_ms=5, max_queue=256):
+        self.rec_model = rec_model
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._pending = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'batches': 0,
+            'faces': 0,
+            'requests': 0,
+            'rejected': 0,
+            'max_batch_seen': 0,
+            'wait_seconds_total': 0.0,
+            'wait_seconds_max': 0.0,
+            'batch_size_buckets': {**{str(b): 0 for b in BATCH_SIZE_BUCKETS}, '+Inf': 0},
+        }
+        self._thread = threading.Thread(target=self._loop, name='recognition-batcher', daemon=True)
+        self._thread.start()
+
+    def embed(self, crops):
+        """Trả về embedding (N, D) cho các ảnh đã căn chỉnh, chạy chung batch với request khác"""
+        if not crops:
+            return np.empty((0, 0), dtype=np.float32)
+        job = _Job(list(crops))
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                self._stats['rejected'] += 1
+            raise BatcherQueueFull(f'Hàng đợi recognition đã đầy ({self._queue.maxsize} việc)')
+        return job.future.result()
+
+    def _collect(self):
+        """Lấy một nhóm việc: việc đầu tiên chờ vô hạn, các việc sau chờ đến hạn max_wait"""
+        first = self._pending or self._queue.get()
+        self._pending = None
+        jobs, faces = [first], len(first.crops)
+        deadline = first.enqueued_at + self.max_wait
+        while faces < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                job = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if faces + len(job.crops) > self.max_batch:
+                # Không cắt nhỏ việc của một request; để dành cho batch sau
+                self._pending = job
+                break
+            jobs.append(job)
+            faces += len(job.crops)
+        return jobs, faces
+
+    def _loop(self):
+        while True:
+            jobs, faces = self._collect()
+            started = time.monotonic()
+            crops = [crop for job in jobs for crop in job.crops]
+            try:
+                embeddings = self.rec_model.get_feat(crops)
+            except Exception as e:
+                logger.exception(f"🔥 Lỗi chạy batch recognition ({faces} khuôn mặt): {e}")
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+
+            offset = 0
+            for job in jobs:
+                job.future.set_result(embeddings[offset:offset + len(job.crops)])
+                offset += len(job.crops)
+
+            with self._lock:
+                stats = self._stats
+                stats['batches'] += 1
+                stats['faces'] += faces
+                stats['requests'] += len(jobs)
+                stats['max_batch_seen'] = max(stats['max_batch_seen'], faces)
+                for job in jobs:
+                    waited = started - job.enqueued_at
+                    stats['wait_seconds_total'] += waited
+                    stats['wait_seconds_max'] = max(stats['wait_seconds_max'], waited)
+                for bucket in BATCH_SIZE_BUCKETS:
+                    if faces <= bucket:
+                        stats['batch_size_buckets'][str(bucket)] += 1
+                        break
+                else:
+                    stats['batch_size_buckets']['+Inf'] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats['batch_size_buckets'] = dict(stats['batch_size_buckets'])
+        total_wait = stats.pop('wait_seconds_total')
+        stats.update({
+            'queue_depth': self._queue.qsize() + (self._pending is not None),
+            'avg_batch_size': round(stats['faces'] / stats['batches'], 2) if stats['batches'] else 0.0,
+            'wait_ms_avg': round(total_wait / stats['requests'] * 1000, 3) if stats['requests'] else 0.0,
+            'wait_ms_max': round(stats.pop('wait_seconds_max') * 1000, 3),
+            'max_batch': self.max_batch,
+            'max_wait_ms': self.max_wait * 1000,
+        })
+        return stats
@@ -6,7 +6,11 @@ import sqlite3
 from datetime import datetime
 import os
 
+from local_index import build_index_from_sqlite, update_index
+
 SERVER_URL = "https://python.topcam.ai.vn/api/student/list"
+CHANGES_URL = "https://python.topcam.ai.vn/api/student/changes"
+CHANGES_PAGE_SIZE = 1000
 DB_FILE = "../students_local.db"
 
 
@@ -29,6 +33,21 @@ def initialize_database():
                   )
                   """)
 
+        # Lưu mốc version đã đồng bộ để lần sau chỉ lấy phần thay đổi
+        c.execute("""
+                  CREATE TABLE IF NOT EXISTS sync_state (
+                      key TEXT PRIMARY KEY,
+                      value TEXT
+                  )
+                  """)
+
+        # Học sinh đã đổi trong SQLite nhưng chưa được ghi vào chỉ mục embedding cục bộ
+        c.execute("""
+                  CREATE TABLE IF NOT EXISTS index_pending (
+                      id INTEGER PRIMARY KEY
+                  )
+                  """)
+
         conn.commit()
         conn.close()
         # print(f"Cơ sở dữ liệu '{DB_FILE}' đã sẵn sàng.")
@@ -69,6 +88,125 @@ def save_to_sqlite(students):
         print(f"Lỗi khi lưu vào SQLite: {e}")
 
 
+def get_sync_state(conn):
+    """Đọc mốc đồng bộ (since, after_id) đã lưu, mặc định (0, 0) nghĩa là chưa đồng bộ lần nào."""
+    state = dict(conn.execute("SELECT key, value FROM sync_state").fetchall())
+    return int(state.get("since", 0)), int(state.get("after_id", 0))
+
+
+def apply_changes(conn, upserts, deleted, next_since, next_after_id, full_resync=False):
+    """Áp dụng một trang thay đổi và lưu mốc đồng bộ trong cùng một transaction.
+
+    Các id thay đổi (hoặc cờ dựng lại toàn bộ khi full_resync) được ghi vào index_pending/sync_state
+    trong cùng transaction, nên nếu đồng bộ dừng giữa chừng thì lần chạy sau vẫn cập nhật chỉ mục.
+    """
+    c = conn.cursor()
+    if full_resync:
+        c.execute("DELETE FROM students")
+        c.execute("INSERT OR REPLACE INTO sync_state (key, value) VALUES ('index_rebuild', '1')")
+    c.executemany(
+        "INSERT OR REPLACE INTO students (id, full_name, vector_face) VALUES (?, ?, ?)",
+        [(s["id"], s["full_name"], json.dumps(s.get("vector_face")))
+         for s in upserts if s.get("id") and s.get("full_name")]
+    )
+    c.executemany("DELETE FROM students WHERE id = ?", [(sid,) for sid in deleted])
+    c.executemany(
+        "INSERT OR IGNORE INTO index_pending (id) VALUES (?)",
+        [(s["id"],) for s in upserts if s.get("id")] + [(sid,) for sid in deleted]
+    )
+    c.executemany(
+        "INSERT OR REPLACE INTO sync_state (key, value) VALUES (?, ?)",
+        [("since", str(next_since)), ("after_id", str(next_after_id))]
+    )
+    conn.commit()
+
+
+def flush_index(conn):
+    """Ghi các thay đổi còn chờ (index_pending, cờ index_rebuild) vào chỉ mục rồi mới xóa dấu chờ."""
+    state = dict(conn.execute("SELECT key, value FROM sync_state").fetchall())
+    pending = [row[0] for row in conn.execute("SELECT id FROM index_pending").fetchall()]
+    if state.get("index_rebuild") == "1":
+        build_index_from_sqlite(DB_FILE)
+    elif pending:
+        # Id không còn trong bảng students (đã bị xóa) được update_index bỏ khỏi chỉ mục
+        update_index(DB_FILE, pending, [])
+    else:
+        return
+    conn.execute("DELETE FROM index_pending")
+    conn.execute("DELETE FROM sync_state WHERE key = 'index_rebuild'")
+    conn.commit()
+
+
+def sync_changes():
+    """Đồng bộ tăng dần qua /api/student/changes: chỉ tải và ghi các học sinh đã thay đổi.
+
+    Trả về False nếu server chưa hỗ trợ change feed để quay về đồng bộ toàn bộ.
+    """
+    conn = sqlite3.connect(DB_FILE)
+    try:
+        since, after_id = get_sync_state(conn)
+        full_resync = since == 0
+        changed_ids, deleted_ids = [], []
+        completed = False
+        while True:
+            response = requests.get(CHANGES_URL, params={
+                "since": since,
+                "after_id": after_id,
+                "limit": CHANGES_PAGE_SIZE,
+                "fields": "id,full_name,vector_face",
+            }, timeout=15)
+            if response.status_code == 404:
+                print("Server chưa hỗ trợ /api/student/changes, chuyển sang đồng bộ toàn bộ.")
+                return False
+            response.raise_for_status()
+
+            data = response.json()
+            if not data.get("success"):
+                print(f"API trả về không thành công: {data.get('message', 'Không có thông báo lỗi')}")
+                # Các trang đã áp dụng vẫn được ghi vào chỉ mục; lần sau tiếp tục từ mốc đã lưu
+                break
+
+            upserts = data.get("upserts", [])
+            deleted = data.get("deleted", [])
+            since, after_id = data["next_since"], data["next_after_id"]
+            apply_changes(conn, upserts, deleted, since, after_id, full_resync=full_resync)
+            full_resync = False
+            changed_ids += [s["id"] for s in upserts if s.get("id")]
+            deleted_ids += deleted
+
+            if not data.get("has_more"):
+                completed = True
+                break
+
+        if completed:
+            print(f"Đồng bộ xong: {len(changed_ids)} học sinh cập nhật, {len(deleted_ids)} học sinh bị xóa (version {since}).")
+        # Gồm cả thay đổi của lần chạy trước bị dừng giữa chừng (lỗi mạng, crash)
+        flush_index(conn)
+        return True
+    finally:
+        conn.close()
+
+
+def sync_students():
+    """Ưu tiên đồng bộ tăng dần, quay về tải toàn bộ danh sách nếu server cũ."""
+    try:
+        if sync_changes():
+            return
+    except requests.exceptions.Timeout:
+        print("Lỗi: Hết thời gian chờ khi kết nối đến server.")
+        return
+    except requests.exceptions.RequestException as e:
+        print(f"Lỗi mạng hoặc kết nối khi đồng bộ thay đổi: {e}")
+        return
+    except (json.JSONDecodeError, KeyError):
+        print("Lỗi: Không thể phân tích dữ liệu change feed từ server.")
+        return
+    except sqlite3.Error as e:
+        print(f"Lỗi khi lưu vào SQLite: {e}")
+        return
+    fetch_students()
+
+
 def fetch_students():
     """Lấy danh sách học sinh từ server và lưu vào DB nếu trong khung giờ cho phép."""
     now = datetime.now()
@@ -104,8 +242,9 @@ def fetch_students():
             print("Không nhận được dữ liệu học sinh hợp lệ từ server.")
             return
 
-        # Gọi hàm lưu trữ
+        # Gọi hàm lưu trữ và dựng lại chỉ mục embedding cục bộ
         save_to_sqlite(filtered_students)
+        build_index_from_sqlite(DB_FILE)
 
     except requests.exceptions.Timeout:
         print("Lỗi: Hết thời gian chờ khi kết nối đến server.")
@@ -120,5 +259,5 @@ def fetch_students():
 if __name__ == "__main__":
     # Bước 1: Khởi tạo và đảm bảo database đã sẵn sàng.
     if initialize_database():
-        # Bước 2: Nếu database sẵn sàng, tiến hành lấy dữ liệu.
-        fetch_students()
+        # Bước 2: Nếu database sẵn sàng, tiến hành đồng bộ dữ liệu.
+        sync_students()
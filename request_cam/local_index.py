@@ -0,0 +1,239 @@
+"""Chỉ mục embedding cục bộ cho camera, dựng từ students_local.db.
+
+Chỉ mục nằm trong thư mục INDEX_DIR, mỗi lần ghi tạo một thế hệ mới:
+
+    students_index/
+        CURRENT              tên thế hệ đang dùng, được thay thế nguyên tử
+        gen-<n>/
+            embeddings.npy   ma trận float32 (N, D) đã chuẩn hóa L2, mmap được
+            ids.npy          id học sinh tương ứng từng hàng (int64)
+            ivf_centroids.npy, ivf_offsets.npy   (tùy chọn) chỉ mục IVF
+            meta.json
+
+Khi có IVF, các hàng được sắp theo cụm nên mỗi cụm là một đoạn liên tiếp trong
+embeddings.npy. Tiến trình nhận diện đang mmap thế hệ cũ vẫn đọc được bình thường
+trong lúc thế hệ mới được ghi.
+"""
+import json
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+
+INDEX_DIR = "../students_index"
+# Dưới ngưỡng này tìm kiếm vét cạn đủ nhanh, không cần IVF
+IVF_MIN_ROWS = 20000
+# Tỉ lệ hàng thay đổi kể từ lần huấn luyện cụm gần nhất trước khi huấn luyện lại
+IVF_RETRAIN_RATIO = 0.2
+KMEANS_ITERATIONS = 10
+KEEP_GENERATIONS = 2
+
+
+def _normalize(matrix):
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (matrix / norms).astype(np.float32, copy=False)
+
+
+def train_kmeans(matrix, nlist, iterations=KMEANS_ITERATIONS, seed=0):
+    """K-means cầu (cosine) đơn giản bằng numpy, trả về tâm cụm đã chuẩn hóa"""
+    rng = np.random.default_rng(seed)
+    sample = matrix
+    if len(matrix) > nlist * 256:
+        sample = matrix[rng.choice(len(matrix), nlist * 256, replace=False)]
+    centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        empty = np.bincount(assign, minlength=nlist) == 0
+        # Cụm rỗng: lấy ngẫu nhiên một điểm làm tâm mới
+        sums[empty] = sample[rng.choice(len(sample), int(empty.sum()))]
+        centroids = _normalize(sums)
+    return centroids
+
+
+def _read_current(index_dir):
+    try:
+        with open(os.path.join(index_dir, "CURRENT"), encoding="utf-8") as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def load_arrays(index_dir=INDEX_DIR, mmap=True):
+    """Đọc thế hệ hiện tại: (ids, embeddings, centroids, offsets, meta) hoặc None nếu chưa có"""
+    generation = _read_current(index_dir)
+    if not generation:
+        return None
+    path = os.path.join(index_dir, generation)
+    mode = "r" if mmap else None
+    ids = np.load(os.path.join(path, "ids.npy"), mmap_mode=mode)
+    embeddings = np.load(os.path.join(path, "embeddings.npy"), mmap_mode=mode)
+    with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+        meta = json.load(f)
+    centroids = offsets = None
+    if meta.get("ivf"):
+        centroids = np.load(os.path.join(path, "ivf_centroids.npy"))
+        offsets = np.load(os.path.join(path, "ivf_offsets.npy"))
+    return ids, embeddings, centroids, offsets, meta
+
+
+def write_index(ids, embeddings, index_dir=INDEX_DIR, centroids=None, changed_since_train=0):
+    """Ghi một thế hệ chỉ mục mới rồi chuyển CURRENT sang nó"""
+    os.makedirs(index_dir, exist_ok=True)
+    ids = np.asarray(ids, dtype=np.int64)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    dim = embeddings.shape[1] if embeddings.ndim == 2 else 0
+
+    offsets = None
+    if len(ids) >= IVF_MIN_ROWS:
+        nlist = int(4 * np.sqrt(len(ids)))
+        if (centroids is None or centroids.shape[1] != dim
+                or changed_since_train > IVF_RETRAIN_RATIO * len(ids)):
+            print(f"Huấn luyện lại IVF với {nlist} cụm cho {len(ids)} học sinh...")
+            centroids = train_kmeans(embeddings, nlist)
+            changed_since_train = 0
+        assign = np.argmax(embeddings @ centroids.T, axis=1)
+        order = np.argsort(assign, kind="stable")
+        ids, embeddings = ids[order], embeddings[order]
+        offsets = np.concatenate([[0], np.cumsum(np.bincount(assign, minlength=len(centroids)))])
+    else:
+        centroids = None
+
+    current = _read_current(index_dir)
+    number = int(current.split("-")[1]) + 1 if current else 1
+    generation = f"gen-{number:06d}"
+    path = os.path.join(index_dir, generation)
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, "ids.npy"), ids)
+    np.save(os.path.join(path, "embeddings.npy"), embeddings)
+    meta = {"count": int(len(ids)), "dim": int(dim), "ivf": offsets is not None,
+            "changed_since_train": int(changed_since_train)}
+    if offsets is not None:
+        np.save(os.path.join(path, "ivf_centroids.npy"), centroids)
+        np.save(os.path.join(path, "ivf_offsets.npy"), offsets)
+    with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(meta, f)
+
+    tmp = os.path.join(index_dir, "CURRENT.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(generation)
+    os.replace(tmp, os.path.join(index_dir, "CURRENT"))
+
+    # Dọn các thế hệ cũ; tiến trình đang mmap file cũ vẫn đọc được cho đến khi đóng
+    generations = sorted(d for d in os.listdir(index_dir) if d.startswith("gen-"))
+    for old in generations[:-KEEP_GENERATIONS]:
+        shutil.rmtree(os.path.join(index_dir, old), ignore_errors=True)
+    return meta
+
+
+def _parse_rows(rows):
+    """(id, vector_face JSON) -> (ids, vectors), bỏ các vector rỗng hoặc lệch số chiều"""
+    parsed = []
+    for student_id, vector_json in rows:
+        vector = json.loads(vector_json) if vector_json else None
+        if vector:
+            parsed.append((student_id, vector))
+    if not parsed:
+        return np.empty(0, dtype=np.int64), np.empty((0, 0), dtype=np.float32)
+    dims = [len(v) for _, v in parsed]
+    dim = max(set(dims), key=dims.count)
+    parsed = [(sid, v) for sid, v in parsed if len(v) == dim]
+    ids = np.array([sid for sid, _ in parsed], dtype=np.int64)
+    vectors = _normalize(np.array([v for _, v in parsed], dtype=np.float32))
+    return ids, vectors
+
+
+def build_index_from_sqlite(db_file, index_dir=INDEX_DIR):
+    """Dựng lại toàn bộ chỉ mục từ bảng students trong SQLite"""
+    conn = sqlite3.connect(db_file)
+    try:
+        rows = conn.execute("SELECT id, vector_face FROM students").fetchall()
+    finally:
+        conn.close()
+    ids, vectors = _parse_rows(rows)
+    meta = write_index(ids, vectors, index_dir)
+    print(f"Đã dựng chỉ mục cục bộ: {meta['count']} học sinh, {meta['dim']} chiều, IVF={meta['ivf']}.")
+    return meta
+
+
+def update_index(db_file, changed_ids, deleted_ids, index_dir=INDEX_DIR):
+    """Cập nhật chỉ mục chỉ với các học sinh vừa thay đổi, không đọc lại toàn bộ SQLite"""
+    current = load_arrays(index_dir, mmap=False)
+    if current is None:
+        return build_index_from_sqlite(db_file, index_dir)
+    ids, embeddings, centroids, _, meta = current
+
+    changed_ids = list(set(changed_ids))
+    rows = []
+    if changed_ids:
+        conn = sqlite3.connect(db_file)
+        try:
+            for i in range(0, len(changed_ids), 500):
+                chunk = changed_ids[i:i + 500]
+                rows += conn.execute(
+                    f"SELECT id, vector_face FROM students WHERE id IN ({','.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+        finally:
+            conn.close()
+    new_ids, new_vectors = _parse_rows(rows)
+    if len(new_ids) and len(ids) and new_vectors.shape[1] != embeddings.shape[1]:
+        # Đổi model (số chiều khác): dựng lại toàn bộ
+        return build_index_from_sqlite(db_file, index_dir)
+
+    # Bỏ các hàng bị xóa hoặc sắp được thay bằng vector mới (kể cả học sinh không còn vector)
+    remove = np.isin(ids, np.array(list(set(deleted_ids) | set(changed_ids)), dtype=np.int64))
+    ids = np.concatenate([ids[~remove], new_ids])
+    if len(new_ids):
+        embeddings = np.vstack([embeddings[~remove], new_vectors]) if len(embeddings) else new_vectors
+    else:
+        embeddings = embeddings[~remove]
+
+    changed = meta.get("changed_since_train", 0) + int(remove.sum()) + len(new_ids)
+    meta = write_index(ids, embeddings, index_dir, centroids=centroids, changed_since_train=changed)
+    print(f"Đã cập nhật chỉ mục cục bộ: {len(new_ids)} thay đổi, {int(remove.sum())} hàng bị thay/xóa, tổng {meta['count']}.")
+    return meta
+
+
+class LocalFaceIndex:
+    """Đọc chỉ mục bằng mmap để tiến trình nhận diện tìm láng giềng gần nhất"""
+
+    def __init__(self, index_dir=INDEX_DIR):
+        self.index_dir = index_dir
+        self.generation = None
+        self.reload()
+
+    def reload(self):
+        """Mở thế hệ mới nếu CURRENT đã đổi; trả về True nếu có nạp lại"""
+        generation = _read_current(self.index_dir)
+        if generation == self.generation:
+            return False
+        loaded = load_arrays(self.index_dir)
+        if loaded is None:
+            raise FileNotFoundError(f"Chưa có chỉ mục trong {self.index_dir}")
+        self.ids, self.embeddings, self.centroids, self.offsets, self.meta = loaded
+        self.generation = generation
+        return True
+
+    def search(self, query, top_k=5, nprobe=8):
+        """Trả về [(student_id, score)] theo cosine similarity giảm dần"""
+        query = np.asarray(query, dtype=np.float32).ravel()
+        query = query / (np.linalg.norm(query) or 1.0)
+        if self.centroids is not None:
+            lists = np.argsort(-(self.centroids @ query))[:nprobe]
+            rows = np.concatenate([np.arange(self.offsets[c], self.offsets[c + 1]) for c in lists])
+            candidates = self.embeddings[rows]
+        else:
+            rows = None
+            candidates = self.embeddings
+        if not len(candidates):
+            return []
+        scores = candidates @ query
+        k = min(top_k, len(scores))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        positions = rows[top] if rows is not None else top
+        return [(int(self.ids[p]), float(scores[t])) for p, t in zip(positions, top)]
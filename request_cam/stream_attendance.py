@@ -0,0 +1,74 @@
+import json
+import sys
+import time
+
+import cv2
+import requests
+
+# Luồng điểm danh chỉ được phục vụ bởi async_server.py (không qua serve.py/waitress)
+STREAM_URL = "https://python.topcam.ai.vn/api/attendance/stream"
+CAMERA_ID = "cam-01"
+CAMERA_SOURCE = 0          # chỉ số webcam hoặc URL RTSP
+FPS = 5                    # số khung hình gửi mỗi giây
+SEGMENT_SECONDS = 30       # mỗi request gửi một đoạn luồng, track được server giữ giữa các đoạn
+JPEG_QUALITY = 80
+BOUNDARY = "frame"
+
+
+def mjpeg_segment(capture):
+    """Đọc camera và sinh các part MJPEG (multipart/x-mixed-replace) trong SEGMENT_SECONDS giây"""
+    deadline = time.time() + SEGMENT_SECONDS
+    while time.time() < deadline:
+        started = time.time()
+        ok, frame = capture.read()
+        if not ok:
+            print("Không đọc được khung hình từ camera")
+            return
+        ok, jpeg = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, JPEG_QUALITY])
+        if ok:
+            data = jpeg.tobytes()
+            yield (f"--{BOUNDARY}\r\nContent-Type: image/jpeg\r\nContent-Length: {len(data)}\r\n"
+                   f"X-Timestamp: {started:.3f}\r\n\r\n").encode() + data + b"\r\n"
+        time.sleep(max(0.0, 1.0 / FPS - (time.time() - started)))
+
+
+def stream_segment(capture):
+    """Gửi một đoạn luồng (chunked HTTP) và in các sự kiện điểm danh server trả về"""
+    response = requests.post(
+        STREAM_URL,
+        params={"camera_id": CAMERA_ID},
+        data=mjpeg_segment(capture),
+        headers={"Content-Type": f"multipart/x-mixed-replace; boundary={BOUNDARY}"},
+        stream=True,
+        timeout=(10, SEGMENT_SECONDS + 60),
+    )
+    if response.status_code != 200:
+        print(f"Lỗi {response.status_code}: {response.text}")
+        return False
+    for line in response.iter_lines():
+        if not line:
+            continue
+        event = json.loads(line)
+        if event["type"] == "attendance":
+            print(f"✅ {event['seen_at']} - {event['full_name']} (ID {event['student_id']}, score {event['score']:.3f})")
+        elif event["type"] == "summary":
+            print(f"📊 {event['frames']} khung hình, bỏ {event['dropped']}, {event['events']} lượt điểm danh")
+        else:
+            print(f"❌ {event['message']}")
+    return True
+
+
+if __name__ == "__main__":
+    capture = cv2.VideoCapture(sys.argv[1] if len(sys.argv) > 1 else CAMERA_SOURCE)
+    try:
+        while capture.isOpened():
+            try:
+                if not stream_segment(capture):
+                    time.sleep(5)
+            except requests.RequestException as e:
+                print(f"Lỗi kết nối: {e}")
+                time.sleep(5)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        capture.release()
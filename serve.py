@@ -0,0 +1,52 @@
+"""Chạy server.py ở chế độ production.
+
+Inference chạy trong pool tiến trình (INFERENCE_WORKERS), còn HTTP do WSGI server
+nhiều thread phục vụ. Số thread = INFERENCE_MAX_QUEUE + SERVE_DB_THREADS: tối đa
+INFERENCE_MAX_QUEUE thread có thể đang chờ kết quả inference (request thứ
+INFERENCE_MAX_QUEUE + 1 nhận 503 ngay), nên luôn còn SERVE_DB_THREADS thread rảnh
+cho các API database và không bao giờ phải xếp hàng sau encode khuôn mặt.
+
+    INFERENCE_WORKERS=4 INFERENCE_MAX_QUEUE=16 python serve.py
+
+Khi có rất nhiều camera gọi đồng thời, dùng chế độ asyncio (async_server.py):
+cùng API nhưng không cần một thread cho mỗi connection. Luồng điểm danh của camera
+(/api/attendance/stream, /api/attendance/ws) chỉ có ở async_server.py: waitress đọc hết
+body trước khi gọi app và mỗi luồng sẽ giữ một thread suốt thời gian kết nối.
+"""
+import logging
+import os
+
+# Ở chế độ production mặc định dùng pool 2 worker nếu không cấu hình
+os.environ.setdefault('INFERENCE_WORKERS', '2')
+
+from inference_pool import INFERENCE_POOL_CONFIG
+from server import DB_CONFIG, app, inference_pool
+
+logger = logging.getLogger(__name__)
+
+SERVE_HOST = os.environ.get('SERVE_HOST', '0.0.0.0')
+SERVE_PORT = int(os.environ.get('SERVE_PORT', 5002))
+SERVE_DB_THREADS = int(os.environ.get('SERVE_DB_THREADS', 8))
+
+
+def main():
+    threads = INFERENCE_POOL_CONFIG['max_queue'] + SERVE_DB_THREADS
+    logger.info(f"🚀 Khởi động {INFERENCE_POOL_CONFIG['workers']} worker inference...")
+    inference_pool.start()
+    logger.info(f"Database Host: {DB_CONFIG['host']}:{DB_CONFIG['port']}")
+    logger.info(f"🚀 Server chạy tại http://{SERVE_HOST}:{SERVE_PORT} với {threads} thread")
+    try:
+        try:
+            from waitress import serve
+        except ImportError:
+            logger.warning("⚠️ Chưa cài waitress, dùng server đa luồng của werkzeug.")
+            from werkzeug.serving import run_simple
+            run_simple(SERVE_HOST, SERVE_PORT, app, threaded=True)
+        else:
+            serve(app, host=SERVE_HOST, port=SERVE_PORT, threads=threads)
+    finally:
+        inference_pool.shutdown()
+
+
+if __name__ == '__main__':
+    main()
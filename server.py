@@ -1,531 +1,1249 @@
-import mysql.connector
-from flask import Flask, request, jsonify
-import json
-import base64
-import numpy as np
-from datetime import datetime
-import logging
-import cv2
-import insightface
-from insightface.app import FaceAnalysis
-from insightface.utils import face_align
-# Cấu hình logging
-logging.basicConfig(level=logging.INFO)
-logger = logging.getLogger(__name__)
-
-app = Flask(__name__)
-app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # 64 MB
-# Cấu hình database - CẬP NHẬT
-DB_CONFIG = {
-    'host': '172.16.33.4',
-    'port': 3306,
-    'user': 'tranmanh_cameraai',
-    'password': 'nWoNuPubC',
-    'database': 'tranmanh_cameraai',
-    'charset': 'utf8mb4'
-}
-
-class DatabaseManager:
-    def __init__(self):
-        self.config = DB_CONFIG
-    
-    def get_connection(self):
-        try:
-            connection = mysql.connector.connect(**self.config)
-            logger.info("Database connection successful")
-            return connection
-        except Exception as e:
-            logger.error(f"Database connection error: {e}")
-            return None
-    
-    def execute_query(self, query, params=None, fetch=True):
-        connection = self.get_connection()
-        if not connection:
-            return None
-        
-        try:
-            cursor = connection.cursor(dictionary=True)
-            cursor.execute(query, params)
-            
-            if fetch:
-                result = cursor.fetchall()
-            else:
-                connection.commit()
-                result = cursor.rowcount
-            
-            return result
-        except Exception as e:
-            logger.error(f"Query execution error: {e}")
-            return None
-        finally:
-            cursor.close()
-            connection.close()
-
-db_manager = DatabaseManager()
-
-def encode_vector_to_string(vector):
-    """Chuyển đổi vector numpy thành string để lưu vào database"""
-    if vector is None:
-        return None
-    if isinstance(vector, np.ndarray):
-        # Chuyển numpy array thành list rồi encode base64
-        vector_list = vector.tolist()
-        vector_json = json.dumps(vector_list)
-        return base64.b64encode(vector_json.encode()).decode()
-    return vector
-
-def decode_string_to_vector(vector_string):
-    """Chuyển đổi string từ database thành vector numpy"""
-    if not vector_string:
-        return None
-    try:
-        # Decode base64 rồi chuyển thành numpy array
-        vector_json = base64.b64decode(vector_string.encode()).decode()
-        vector_list = json.loads(vector_json)
-        return np.array(vector_list)
-    except Exception as e:
-        logger.error(f"Error decoding vector: {e}")
-        return None
-
-@app.route('/api/health', methods=['GET'])
-def health_check():
-    """Kiểm tra trạng thái API"""
-    # Test database connection
-    connection = db_manager.get_connection()
-    db_status = "connected" if connection else "disconnected"
-    if connection:
-        connection.close()
-    
-    return jsonify({
-        'success': True,
-        'message': 'API đang hoạt động',
-        'database_status': db_status,
-        'database_host': DB_CONFIG['host'],
-        'database_port': DB_CONFIG['port'],
-        'timestamp': datetime.now().isoformat()
-    })
-
-@app.route('/api/student/search', methods=['GET'])
-def search_student():
-    """Tìm kiếm học sinh theo tên hoặc ID"""
-    try:
-        name = request.args.get('name', '')
-        student_id = request.args.get('id', '')
-        
-        if not name and not student_id:
-            return jsonify({
-                'success': False,
-                'message': 'Cần cung cấp tên hoặc ID để tìm kiếm'
-            }), 400
-        
-        # Xây dựng query
-        if student_id:
-            query = "SELECT * FROM students WHERE id = %s"
-            params = (student_id,)
-        else:
-            query = "SELECT * FROM students WHERE full_name LIKE %s"
-            params = (f'%{name}%',)
-        
-        results = db_manager.execute_query(query, params)
-        
-        if results is None:
-            return jsonify({
-                'success': False,
-                'message': 'Lỗi truy vấn database'
-            }), 500
-        
-        # Chuyển đổi vector_face thành dạng có thể đọc được
-        for student in results:
-            if student['vector_face']:
-                vector = decode_string_to_vector(student['vector_face'])
-                if vector is not None:
-                    student['vector_face_info'] = {
-                        'has_vector': True,
-                        'vector_size': len(vector),
-                        'vector_shape': vector.shape if hasattr(vector, 'shape') else None
-                    }
-                else:
-                    student['vector_face_info'] = {'has_vector': False}
-            else:
-                student['vector_face_info'] = {'has_vector': False}
-        
-        return jsonify({
-            'success': True,
-            'data': results,
-            'count': len(results)
-        })
-        
-    except Exception as e:
-        logger.error(f"Search error: {e}")
-        return jsonify({
-            'success': False,
-            'message': f'Lỗi server: {str(e)}'
-        }), 500
-
-@app.route('/api/student/update-vector', methods=['POST'])
-def update_student_vector():
-    """Cập nhật vector encode cho học sinh"""
-    try:
-        data = request.get_json()
-        
-        if not data:
-            return jsonify({
-                'success': False,
-                'message': 'Không có dữ liệu được gửi'
-            }), 400
-        
-        student_id = data.get('id')
-        vector_data = data.get('vector_face')
-        
-        if not student_id:
-            return jsonify({
-                'success': False,
-                'message': 'ID học sinh là bắt buộc'
-            }), 400
-        
-        # Kiểm tra học sinh có tồn tại không
-        check_query = "SELECT id FROM students WHERE id = %s"
-        existing = db_manager.execute_query(check_query, (student_id,))
-        
-        if not existing:
-            return jsonify({
-                'success': False,
-                'message': 'Không tìm thấy học sinh'
-            }), 404
-        
-        # Xử lý vector data
-        if vector_data:
-            # Nếu vector_data là list, chuyển thành numpy array
-            if isinstance(vector_data, list):
-                vector_array = np.array(vector_data)
-                encoded_vector = encode_vector_to_string(vector_array)
-            else:
-                encoded_vector = vector_data
-        else:
-            encoded_vector = None
-        
-        # Cập nhật vector
-        update_query = "UPDATE students SET vector_face = %s WHERE id = %s"
-        result = db_manager.execute_query(update_query, (encoded_vector, student_id), fetch=False)
-        
-        if result is None:
-            return jsonify({
-                'success': False,
-                'message': 'Lỗi cập nhật database'
-            }), 500
-        
-        return jsonify({
-            'success': True,
-            'message': 'Cập nhật vector thành công',
-            'updated_rows': result
-        })
-        
-    except Exception as e:
-        logger.error(f"Update vector error: {e}")
-        return jsonify({
-            'success': False,
-            'message': f'Lỗi server: {str(e)}'
-        }), 500
-
-@app.route('/api/student/create', methods=['POST'])
-def create_student():
-    """Tạo học sinh mới"""
-    try:
-        data = request.get_json()
-        
-        if not data or not data.get('full_name'):
-            return jsonify({
-                'success': False,
-                'message': 'Tên học sinh là bắt buộc'
-            }), 400
-        
-        # Chuẩn bị dữ liệu
-        full_name = data.get('full_name')
-        code_student = data.get('code_student')
-        phone = data.get('phone')
-        address = data.get('address')
-        email = data.get('email')
-        vector_face = data.get('vector_face')
-        
-        # Xử lý vector
-        if vector_face:
-            if isinstance(vector_face, list):
-                vector_array = np.array(vector_face)
-                encoded_vector = encode_vector_to_string(vector_array)
-            else:
-                encoded_vector = vector_face
-        else:
-            encoded_vector = None
-        
-        # Tạo học sinh mới
-        insert_query = """
-            INSERT INTO students (full_name, code_student, phone, address, email, 
-                                vector_face, status, created_at)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """
-        
-        current_time = int(datetime.now().timestamp())
-        params = (full_name, code_student, phone, address, email, 
-                 encoded_vector, 'active', current_time)
-        
-        result = db_manager.execute_query(insert_query, params, fetch=False)
-        
-        if result is None:
-            return jsonify({
-                'success': False,
-                'message': 'Lỗi tạo học sinh'
-            }), 500
-        
-        return jsonify({
-            'success': True,
-            'message': 'Tạo học sinh thành công'
-        })
-        
-    except Exception as e:
-        logger.error(f"Create student error: {e}")
-        return jsonify({
-            'success': False,
-            'message': f'Lỗi server: {str(e)}'
-        }), 500
-
-@app.route('/api/student/get-vector/<int:student_id>', methods=['GET'])
-def get_student_vector(student_id):
-    """Lấy vector encode của học sinh"""
-    try:
-        query = "SELECT id, full_name, vector_face FROM students WHERE id = %s"
-        result = db_manager.execute_query(query, (student_id,))
-        
-        if not result:
-            return jsonify({
-                'success': False,
-                'message': 'Không tìm thấy học sinh'
-            }), 404
-        
-        student = result[0]
-        
-        # Chuyển đổi vector thành dạng có thể sử dụng
-        if student['vector_face']:
-            vector = decode_string_to_vector(student['vector_face'])
-            if vector is not None:
-                student['vector_face'] = vector.tolist()
-            else:
-                student['vector_face'] = None
-        
-        return jsonify({
-            'success': True,
-            'data': student
-        })
-        
-    except Exception as e:
-        logger.error(f"Get vector error: {e}")
-        return jsonify({
-            'success': False,
-            'message': f'Lỗi server: {str(e)}'
-        }), 500
-
-@app.route('/api/student/list', methods=['GET'])
-def list_students():
-    """Lấy toàn bộ thông tin tất cả học sinh"""
-    try:
-        query = "SELECT * FROM students"
-        results = db_manager.execute_query(query)
-        
-        if results is None:
-            return jsonify({
-                'success': False,
-                'message': 'Lỗi truy vấn database'
-            }), 500
-        
-        # Chuyển vector_face về dạng list nếu có
-        for student in results:
-            if student['vector_face']:
-                vector = decode_string_to_vector(student['vector_face'])
-                student['vector_face'] = vector.tolist() if vector is not None else None
-        
-        return jsonify({
-            'success': True,
-            'data': results,
-            'count': len(results)
-        })
-        
-    except Exception as e:
-        logger.error(f"List students error: {e}")
-        return jsonify({
-            'success': False,
-            'message': f'Lỗi server: {str(e)}'
-        }), 500
-
-try:
-    face_app = FaceAnalysis(name='buffalo_l', providers=['CUDAExecutionProvider'])
-    face_app.prepare(ctx_id=0)
-    logger.info("✅ Đã khởi tạo InsightFace với GPU (CUDAExecutionProvider).")
-except Exception as e:
-    logger.warning(f"⚠️ Không dùng được GPU: {e}. Chuyển sang CPU.")
-    face_app = FaceAnalysis(name='buffalo_l', providers=['CPUExecutionProvider'])
-    face_app.prepare(ctx_id=0)
-    logger.info("✅ Đã khởi tạo InsightFace với CPU (CPUExecutionProvider).")
-
-def base64_to_image(base64_string):
-    """Chuyển base64 string thành ảnh OpenCV"""
-    try:
-        if ',' in base64_string:
-            base64_string = base64_string.split(',')[1]
-        img_data = base64.b64decode(base64_string)
-        np_arr = np.frombuffer(img_data, np.uint8)
-        img = cv2.imdecode(np_arr, cv2.IMREAD_COLOR)
-        return img
-    except Exception as e:
-        logger.error(f"❌ Lỗi giải mã base64: {e}")
-        return None
-
-@app.route('/api/face_vector_encode', methods=['GET'])
-def encode_face_from_images_get():
-    logger.warning("❌ [GET] /api/face_vector_encode được truy cập bằng GET thay vì POST.")
-    return jsonify({
-        'success': False,
-        'message': 'Vui lòng sử dụng phương thức POST với dữ liệu JSON để truy cập API này.',
-        'error_code': 405
-    }), 405
-
-# @app.route('/api/face_vector_encode', methods=['POST'])
-# def encode_face_from_images():
-#     """API nhận 3 ảnh base64 và trả về vector trung bình nếu hợp lệ"""
-#     try:
-#         data = request.get_json()
-#         if not data:
-#             logger.warning("📭 Không có dữ liệu gửi lên (body rỗng hoặc sai định dạng).")
-#             return jsonify({'success': False, 'message': 'Không có dữ liệu gửi lên', 'error_code': 400}), 400
-
-
-#         image_front = data.get('image_front')
-#         image_left = data.get('image_left')
-#         image_right = data.get('image_right')
-
-#         # Nếu thiếu bất kỳ ảnh nào, chỉ xử lý mặt trước
-#         if not (image_front and image_left and image_right):
-#             logger.warning("⚠️ Không đủ 3 ảnh, chỉ xử lý ảnh mặt trước.")
-#             if not image_front:
-#                 logger.warning("❌ Không có ảnh mặt trước.")
-#                 return jsonify({'success': False, 'message': 'Thiếu ảnh mặt trước (image_front)', 'error_code': 411}), 400
-#             img = base64_to_image(image_front)
-#             if img is None:
-#                 logger.warning("❌ Không đọc được ảnh mặt trước (base64 lỗi hoặc không phải ảnh).")
-#                 return jsonify({'success': False, 'message': 'Không đọc được ảnh mặt trước, vui lòng tải lại.', 'error_code': 412}), 400
-#             logger.info(f"📏 Kích thước ảnh mặt trước: {img.shape}")
-#             faces = face_app.get(img)
-#             if not faces:
-#                 logger.warning("❌ Không phát hiện khuôn mặt ở ảnh mặt trước.")
-#                 return jsonify({'success': False, 'message': 'Không phát hiện khuôn mặt ở ảnh mặt trước, vui lòng tải lại.', 'error_code': 413}), 400
-
-#             # Chọn khuôn mặt lớn nhất (diện tích bbox lớn nhất)
-#             largest_face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
-#             if largest_face.det_score < 0.7:
-#                 logger.warning(f"❌ Khuôn mặt lớn nhất ở ảnh mặt trước không đủ rõ (score: {largest_face.det_score:.3f})")
-#                 return jsonify({'success': False, 'message': 'Khuôn mặt lớn nhất ở ảnh mặt trước không đủ rõ, vui lòng tải lại.', 'error_code': 413}), 400
-
-#             logger.info("✅ Ảnh mặt trước hợp lệ, đang lấy embedding khuôn mặt lớn nhất...")
-#             avg_vector = largest_face.embedding
-#             logger.info("✅ Đã lấy xong embedding từ ảnh mặt trước.")
-#             return jsonify({
-#                 'success': True,
-#                 'vector': avg_vector.tolist(),
-#                 'fallback': True
-#             }), 200
-
-#         # Nếu đủ 3 ảnh, xử lý như cũ
-#         vectors = []
-#         for idx, base64_str in enumerate([image_front, image_left, image_right]):
-#             direction = ['front', 'left', 'right'][idx]
-#             logger.info(f"📥 Xử lý ảnh hướng: {direction.upper()}")
-#             img = base64_to_image(base64_str)
-#             if img is None:
-#                 logger.warning(f"❌ Không đọc được ảnh {direction} (base64 lỗi hoặc không phải ảnh).")
-#                 return jsonify({'success': False, 'message': f'Không đọc được ảnh thứ {idx+1} ({direction}), vui lòng tải lại.', 'error_code': 402}), 400
-#             logger.info(f"📏 Kích thước ảnh {direction}: {img.shape}")
-#             faces = face_app.get(img)
-#             if not faces:
-#                 logger.warning(f"❌ Không phát hiện khuôn mặt ở ảnh {direction}.")
-#                 return jsonify({'success': False, 'message': f'Không phát hiện khuôn mặt ở ảnh {direction}, vui lòng tải lại.', 'error_code': 403}), 400
-
-#             # Chọn khuôn mặt lớn nhất (diện tích bbox lớn nhất)
-#             largest_face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
-#             if largest_face.det_score < 0.7:
-#                 logger.warning(f"❌ Khuôn mặt lớn nhất ở ảnh {direction} không đủ rõ (score: {largest_face.det_score:.3f})")
-#                 return jsonify({'success': False, 'message': f'Khuôn mặt lớn nhất ở ảnh {direction} không đủ rõ, vui lòng tải lại.', 'error_code': 403}), 400
-
-#             logger.info(f"✅ Ảnh {direction.upper()} hợp lệ, đang lấy embedding khuôn mặt lớn nhất...")
-#             vectors.append(largest_face.embedding)
-#         avg_vector = np.mean(vectors, axis=0)
-#         logger.info("✅ Đã tính xong vector trung bình.")
-#         return jsonify({
-#             'success': True,
-#             'vector': avg_vector.tolist(),
-#             'fallback': False
-#         }), 200
-
-#     except Exception as e:
-#         logger.exception(f"🔥 Lỗi encode face: {e}")
-#         return jsonify({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}), 500
-
-@app.route('/api/face_vector_encode', methods=['POST'])
-def encode_face_from_images():
-    """API nhận 1-3 ảnh base64 và trả về vector trung bình các mặt hợp lệ"""
-    try:
-        data = request.get_json()
-        if not data:
-            logger.warning("📭 Không có dữ liệu gửi lên (body rỗng hoặc sai định dạng).")
-            return jsonify({'success': False, 'message': 'Không có dữ liệu gửi lên', 'error_code': 400}), 400
-
-        images = [
-            ('front', data.get('image_front')),
-            ('left', data.get('image_left')),
-            ('right', data.get('image_right'))
-        ]
-
-        vectors = []
-        used_directions = []
-        for direction, base64_str in images:
-            if not base64_str:
-                logger.warning(f"⚠️ Thiếu ảnh {direction}, bỏ qua.")
-                continue
-            img = base64_to_image(base64_str)
-            if img is None:
-                logger.warning(f"❌ Không đọc được ảnh {direction} (base64 lỗi hoặc không phải ảnh), bỏ qua.")
-                continue
-            logger.info(f"📏 Kích thước ảnh {direction}: {img.shape}")
-            faces = face_app.get(img)
-            if not faces:
-                logger.warning(f"❌ Không phát hiện khuôn mặt ở ảnh {direction}, bỏ qua.")
-                continue
-            largest_face = max(faces, key=lambda f: (f.bbox[2] - f.bbox[0]) * (f.bbox[3] - f.bbox[1]))
-            if largest_face.det_score < 0.7:
-                logger.warning(f"❌ Khuôn mặt lớn nhất ở ảnh {direction} không đủ rõ (score: {largest_face.det_score:.3f}), bỏ qua.")
-                continue
-            logger.info(f"✅ Ảnh {direction.upper()} hợp lệ, đang lấy embedding khuôn mặt lớn nhất...")
-            vectors.append(largest_face.embedding)
-            used_directions.append(direction)
-
-        if not vectors:
-            return jsonify({'success': False, 'message': 'Không có ảnh hợp lệ nào để lấy embedding.', 'error_code': 420}), 400
-
-        avg_vector = np.mean(vectors, axis=0)
-        logger.info(f"✅ Đã tính xong vector trung bình từ {len(vectors)} ảnh hợp lệ: {used_directions}")
-
-        return jsonify({
-            'success': True,
-            'vector': avg_vector.tolist(),
-            'num_images_used': len(vectors),
-            'used_directions': used_directions,
-            'fallback': len(vectors) < 3
-        }), 200
-
-    except Exception as e:
-        logger.exception(f"🔥 Lỗi encode face: {e}")
-        return jsonify({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}), 500
-
-if __name__ == '__main__':
-    print("Starting Face Recognition API Server...")
-    print(f"Database Host: {DB_CONFIG['host']}:{DB_CONFIG['port']}")
-    print(f"Database: {DB_CONFIG['database']}")
-    print("Server running at: http://localhost:5002")
-    app.run(debug=True, host='0.0.0.0', port=5002)
+from flask import Flask, Response, request, jsonify, stream_with_context
+from flask import json as flask_json
+import os
+import base64
+import numpy as np
+from datetime import datetime
+import logging
+import shutil
+import tempfile
+from bulk_enroll import BULK_ENROLL_CONFIG, ImageSource, bulk_enroll
+from embedding_cache import EmbeddingCache
+from face_gallery import MATCH_THRESHOLD, FaceGallery, l2_normalize
+from face_templates import FACE_TEMPLATE_CONFIG, SELECT_TEMPLATES_QUERY, TEMPLATE_DIRECTIONS, enroll_statements
+from name_index import NameIndex
+from metrics import count_rejection, install_flask_metrics, registry, stage_timer
+from face_models import FACE_MODEL_CONFIG, FaceModelManager
+from face_quality import QUALITY_REASONS, passes_quality
+from face_pipeline import MIN_DET_SCORE, embed_largest_face, encode_frames_bytes, encode_image_bytes
+from image_preprocess import IMAGE_TARGET_SIDE
+from inference_pool import INFERENCE_POOL_CONFIG, FutureTimeout, InferencePool, QueueFull
+from recognition_batcher import BatcherQueueFull
+from database import (DB_CONFIG, STUDENT_VERSION_SQL, UPDATE_VECTOR_QUERY, VECTOR_STORAGE_DTYPE, db_manager,
+                      vector_write_params)
+from vector_codec import (VectorCodecError, encode_vector, decode_vector, is_binary_vector,
+                          vector_to_text, text_to_vector)
+# Cấu hình logging
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+app = Flask(__name__)
+app.config['MAX_CONTENT_LENGTH'] = 64 * 1024 * 1024  # 64 MB
+install_flask_metrics(app)
+
+def encode_vector_to_string(vector):
+    """Chuyển đổi vector numpy thành dữ liệu nhị phân (vector_codec) để lưu vào database"""
+    if vector is None:
+        return None
+    if isinstance(vector, np.ndarray):
+        return encode_vector(vector, dtype=VECTOR_STORAGE_DTYPE)
+    return vector
+
+def decode_string_to_vector(vector_string):
+    """Chuyển đổi dữ liệu từ database (nhị phân hoặc base64/JSON cũ) thành vector numpy"""
+    if not vector_string:
+        return None
+    try:
+        return decode_vector(vector_string)
+    except Exception as e:
+        logger.error(f"Error decoding vector: {e}")
+        return None
+
+def parse_vector_input(vector_data):
+    """Chuẩn hóa vector_face do client gửi lên (list số thực hoặc chuỗi base64) thành bytes để lưu"""
+    if not vector_data:
+        return None
+    if isinstance(vector_data, list):
+        return encode_vector_to_string(np.array(vector_data, dtype=np.float32))
+    return encode_vector_to_string(text_to_vector(vector_data))
+
+def parse_templates_input(value):
+    """Template theo hướng gửi kèm vector_face (trường ``templates`` trong response của
+    /api/face_vector_encode): [{"direction", "vector", "det_score"}] -> [(direction, vector, det_score)].
+    Báo VectorCodecError nếu sai định dạng."""
+    if not value:
+        return []
+    if not isinstance(value, list) or len(value) > len(TEMPLATE_DIRECTIONS):
+        raise VectorCodecError(f'phải là danh sách tối đa {len(TEMPLATE_DIRECTIONS)} phần tử')
+    templates = []
+    for item in value:
+        direction = item.get('direction') if isinstance(item, dict) else None
+        if direction not in TEMPLATE_DIRECTIONS or direction in [d for d, _, _ in templates]:
+            raise VectorCodecError(f'direction không hợp lệ hoặc bị trùng: {direction}')
+        vector = decode_string_to_vector(parse_vector_input(item.get('vector')))
+        if vector is None:
+            raise VectorCodecError(f'thiếu vector của hướng {direction}')
+        score = item.get('det_score')
+        templates.append((direction, vector, float(score) if isinstance(score, (int, float)) else None))
+    return templates
+
+def format_vector_output(vector_bytes, vector_format):
+    """Định dạng vector_face trong response: 'list' (mặc định) hoặc 'binary' (base64 của định dạng nhị phân)"""
+    if not vector_bytes:
+        return None
+    if vector_format == 'binary':
+        vector = decode_string_to_vector(vector_bytes)
+        if vector is None:
+            return None
+        if not is_binary_vector(vector_bytes):
+            vector_bytes = encode_vector_to_string(vector)
+        return vector_to_text(vector_bytes)
+    vector = decode_string_to_vector(vector_bytes)
+    return vector.tolist() if vector is not None else None
+
+# Change feed: version là micro giây epoch, chỉ trả các thay đổi cũ hơn CHANGE_FEED_SETTLE_US
+# để transaction đang ghi dở (version nhỏ hơn nhưng commit sau) không bị client bỏ sót
+CHANGE_FEED_SETTLE_US = int(os.environ.get('CHANGE_FEED_SETTLE_MS', 2000)) * 1000
+# Mốc trên cũng tính theo đồng hồ database như version, không phụ thuộc đồng hồ của máy chạy API
+CHANGE_FEED_UPPER_QUERY = f"SELECT {STUDENT_VERSION_SQL} - %s AS upper"
+
+def load_gallery_rows():
+    """Nạp (id, full_name, vector) của các học sinh đã có vector_face cho gallery"""
+    query = "SELECT id, full_name, vector_face FROM students WHERE vector_face IS NOT NULL"
+    results = db_manager.execute_query(query)
+    if results is None:
+        return None
+    return [(row['id'], row['full_name'], decode_string_to_vector(row['vector_face']))
+            for row in results]
+
+def load_gallery_templates():
+    """Nạp (student_id, vector) của bảng student_face_templates cho gallery (xem face_templates.py)"""
+    results = db_manager.execute_query(SELECT_TEMPLATES_QUERY)
+    if results is None:
+        return None
+    return [(row['student_id'], decode_string_to_vector(row['vector'])) for row in results]
+
+face_gallery = FaceGallery(load_gallery_rows, load_gallery_templates if FACE_TEMPLATE_CONFIG['enabled'] else None)
+
+def load_name_rows():
+    """Nạp (id, full_name) của toàn bộ học sinh cho chỉ mục tên"""
+    try:
+        return [(row['id'], row['full_name']) for row in db_manager.iter_query("SELECT id, full_name FROM students")]
+    except Exception as e:
+        logger.error(f"Lỗi nạp danh sách tên học sinh: {e}")
+        return None
+
+# Chỉ mục tên cho /api/student/search, nạp lại nền sau NAME_INDEX_MAX_AGE giây
+name_index = NameIndex(load_name_rows, max_age=int(os.environ.get('NAME_INDEX_MAX_AGE', 300)))
+
+@app.route('/api/health', methods=['GET'])
+def health_check():
+    """Kiểm tra trạng thái API"""
+    # Trạng thái database lấy từ pool; chỉ mượn thử connection khi pool chưa có connection nào
+    pool = db_manager.pool_stats()
+    if pool['open'] == 0:
+        try:
+            with db_manager.connection():
+                pass
+        except Exception as e:
+            logger.error(f"Database connection error: {e}")
+        pool = db_manager.pool_stats()
+    return jsonify(health_response(pool))
+
+def health_response(pool):
+    """Payload của /api/health từ thống kê pool database (đồng bộ hoặc async)"""
+    db_status = "connected" if pool['open'] > 0 and not pool['last_error'] else "disconnected"
+    
+    return {
+        'success': True,
+        'message': 'API đang hoạt động',
+        'database_status': db_status,
+        'database_pool': pool,
+        'face_model': face_models.stats(),
+        'inference_pool': inference_pool.stats(),
+        'embedding_cache': embedding_cache.stats(),
+        'name_index': name_index.stats(),
+        'database_host': DB_CONFIG['host'],
+        'database_port': DB_CONFIG['port'],
+        'timestamp': datetime.now().isoformat()
+    }
+
+# Cột trả về khi tìm kiếm; thông tin vector lấy từ các cột metadata, không đọc vector_face
+SEARCH_COLUMNS = "id, full_name, code_student, phone, address, email, status, created_at"
+SEARCH_VECTOR_INFO = "vector_face IS NOT NULL AS has_vector, vector_dim, vector_dtype, vector_norm, vector_checksum"
+SEARCH_DEFAULT_LIMIT = 50
+SEARCH_MAX_LIMIT = 500
+
+def vector_face_info(student):
+    """Gom has_vector và các cột metadata vector thành vector_face_info (không giải mã vector)"""
+    info = {'has_vector': bool(student.pop('has_vector', 0))}
+    dim = student.pop('vector_dim', None)
+    for column in ('vector_dtype', 'vector_norm', 'vector_checksum'):
+        value = student.pop(column, None)
+        if value is not None:
+            info[column] = value
+    if dim is not None:
+        info['vector_size'] = dim
+        info['vector_shape'] = [dim]
+    return info
+
+def search_query(args):
+    """Dựng truy vấn cho /api/student/search, trả về (query, params, page_ids, limit, offset, total).
+
+    Tìm theo tên qua chỉ mục trigram trong RAM, database chỉ đọc đúng trang kết quả theo
+    khóa chính; page_ids là None khi tìm theo id, query là None khi trang kết quả rỗng.
+    Báo ValueError nếu limit/offset sai.
+    """
+    name = args.get('name', '')
+    student_id = args.get('id', '')
+    limit = max(1, min(int(args.get('limit', SEARCH_DEFAULT_LIMIT)), SEARCH_MAX_LIMIT))
+    offset = max(0, int(args.get('offset', 0)))
+    include_vector = args.get('include_vector', '0').lower() in ('1', 'true', 'yes')
+    columns = f"{SEARCH_COLUMNS}, {SEARCH_VECTOR_INFO}" + (", vector_face" if include_vector else "")
+
+    if student_id:
+        return f"SELECT {columns} FROM students WHERE id = %s", (student_id,), None, limit, offset, None
+    with stage_timer('name_search'):
+        ids = name_index.search(name)
+    page_ids = ids[offset:offset + limit]
+    if not page_ids:
+        return None, None, page_ids, limit, offset, len(ids)
+    query = f"SELECT {columns} FROM students WHERE id IN ({', '.join(['%s'] * len(page_ids))})"
+    return query, tuple(page_ids), page_ids, limit, offset, len(ids)
+
+def search_response(results, page_ids, limit, offset, total):
+    """Sắp xếp kết quả theo thứ tự của chỉ mục và dựng payload của /api/student/search"""
+    if page_ids is not None:
+        # Giữ thứ tự xếp hạng của chỉ mục
+        order = {sid: i for i, sid in enumerate(page_ids)}
+        results.sort(key=lambda student: order.get(student['id'], len(order)))
+    else:
+        total = len(results)
+
+    for student in results:
+        student['vector_face_info'] = vector_face_info(student)
+        # Dữ liệu nhị phân không đưa thẳng vào JSON được
+        if isinstance(student.get('vector_face'), (bytes, bytearray)):
+            student['vector_face'] = vector_to_text(student['vector_face'])
+
+    response = {
+        'success': True,
+        'data': results,
+        'count': len(results),
+        'total': total,
+        'offset': offset,
+        'limit': limit
+    }
+    if page_ids is not None and offset + limit < total:
+        response['next_offset'] = offset + limit
+    return response
+
+@app.route('/api/student/search', methods=['GET'])
+def search_student():
+    """Tìm kiếm học sinh theo tên (không phân biệt dấu, có phân trang) hoặc ID"""
+    try:
+        if not request.args.get('name') and not request.args.get('id'):
+            return jsonify({
+                'success': False,
+                'message': 'Cần cung cấp tên hoặc ID để tìm kiếm'
+            }), 400
+        
+        try:
+            query, params, page_ids, limit, offset, total = search_query(request.args)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': f'Tham số không hợp lệ: {e}'
+            }), 400
+        
+        results = db_manager.execute_query(query, params) if query else []
+        
+        if results is None:
+            return jsonify({
+                'success': False,
+                'message': 'Lỗi truy vấn database'
+            }), 500
+        
+        return jsonify(search_response(results, page_ids, limit, offset, total))
+        
+    except Exception as e:
+        logger.error(f"Search error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi server: {str(e)}'
+        }), 500
+
+# Version luôn đổi ở mỗi lần ghi nên rowcount của UPDATE_VECTOR_QUERY là 1 khi học sinh
+# tồn tại, 0 khi không tồn tại (không cần cờ CLIENT_FOUND_ROWS); không phải SELECT kiểm tra trước
+INSERT_STUDENT_QUERY = f"""
+    INSERT INTO students (full_name, code_student, phone, address, email,
+                        vector_face, vector_dim, vector_dtype, vector_norm, vector_checksum,
+                        status, created_at, version)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, {STUDENT_VERSION_SQL})
+"""
+# Số dòng tối đa trong một request ghi hàng loạt
+BATCH_WRITE_MAX = int(os.environ.get('BATCH_WRITE_MAX', 1000))
+
+def store_enroll_templates(students):
+    """Ghi lại template của các học sinh vừa đổi vector_face: [(student_id, [(direction, vector, score)])].
+    False nếu tính năng tắt hoặc lỗi ghi (khi đó gallery được nạp lại từ database)"""
+    if not FACE_TEMPLATE_CONFIG['enabled'] or not students:
+        return False
+    if db_manager.execute_statements(enroll_statements(students)) is None:
+        logger.error(f"❌ Không ghi được template khuôn mặt của {len(students)} học sinh")
+        face_gallery.invalidate()
+        return False
+    return True
+
+@app.route('/api/student/update-vector', methods=['POST'])
+def update_student_vector():
+    """Cập nhật vector encode cho học sinh"""
+    try:
+        data = request.get_json()
+        
+        if not data:
+            return jsonify({
+                'success': False,
+                'message': 'Không có dữ liệu được gửi'
+            }), 400
+        
+        student_id = data.get('id')
+        vector_data = data.get('vector_face')
+        
+        if not student_id:
+            return jsonify({
+                'success': False,
+                'message': 'ID học sinh là bắt buộc'
+            }), 400
+        
+        # Xử lý vector data: list số thực hoặc chuỗi base64 đều được lưu dạng nhị phân
+        try:
+            encoded_vector = parse_vector_input(vector_data)
+        except VectorCodecError as e:
+            return jsonify({
+                'success': False,
+                'message': f'vector_face không hợp lệ: {e}'
+            }), 400
+        try:
+            templates = parse_templates_input(data.get('templates')) if encoded_vector else []
+        except VectorCodecError as e:
+            return jsonify({
+                'success': False,
+                'message': f'templates không hợp lệ: {e}'
+            }), 400
+        
+        # Cập nhật vector bằng một câu lệnh; rowcount = 0 nghĩa là không có học sinh này
+        result = db_manager.execute_query(UPDATE_VECTOR_QUERY, vector_write_params(encoded_vector) + (student_id,), fetch=False)
+        
+        if result is None:
+            return jsonify({
+                'success': False,
+                'message': 'Lỗi cập nhật database'
+            }), 500
+        
+        if result == 0:
+            return jsonify({
+                'success': False,
+                'message': 'Không tìm thấy học sinh'
+            }), 404
+        
+        # vector_face mới thay toàn bộ template cũ (cả capture) bằng template theo hướng của lần encode này
+        stored = store_enroll_templates([(int(student_id), templates)])
+        face_gallery.upsert(int(student_id), decode_string_to_vector(encoded_vector),
+                            templates=[vector for _, vector, _ in templates] if stored else None)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Cập nhật vector thành công',
+            'updated_rows': result
+        })
+        
+    except Exception as e:
+        logger.error(f"Update vector error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi server: {str(e)}'
+        }), 500
+
+def validate_batch_items(data):
+    """Lấy danh sách items của request ghi hàng loạt; trả về (items, thông báo lỗi)"""
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, 'items phải là danh sách không rỗng'
+    if len(items) > BATCH_WRITE_MAX:
+        return None, f'Tối đa {BATCH_WRITE_MAX} dòng mỗi request'
+    return items, None
+
+def read_batch_items(data):
+    """Như validate_batch_items nhưng trả lỗi dạng response Flask"""
+    items, message = validate_batch_items(data)
+    if message:
+        return None, (jsonify({'success': False, 'message': message}), 400)
+    return items, None
+
+def prepare_vector_updates(items):
+    """Kết quả từng dòng (dòng lỗi đã có success = False) và tham số UPDATE_VECTOR_QUERY cho dòng hợp lệ"""
+    results, params = [], []
+    for index, item in enumerate(items):
+        student_id = item.get('id') if isinstance(item, dict) else None
+        if not student_id:
+            results.append({'index': index, 'id': student_id, 'success': False, 'message': 'ID học sinh là bắt buộc'})
+            continue
+        try:
+            encoded_vector = parse_vector_input(item.get('vector_face'))
+        except VectorCodecError as e:
+            results.append({'index': index, 'id': student_id, 'success': False, 'message': f'vector_face không hợp lệ: {e}'})
+            continue
+        results.append({'index': index, 'id': student_id})
+        params.append(vector_write_params(encoded_vector) + (student_id,))
+    return results, params
+
+def updated_student_id(params, _):
+    """Id học sinh của một dòng UPDATE_VECTOR_QUERY (``restamp`` của execute_batch)"""
+    return params[-1]
+
+def apply_vector_updates(results, written):
+    """Ghép (rowcount, lastrowid) của execute_batch vào kết quả các dòng đã ghi"""
+    pending = [result for result in results if 'success' not in result]
+    for result, (rowcount, _) in zip(pending, written):
+        result['success'] = rowcount > 0
+        if rowcount == 0:
+            result['message'] = 'Không tìm thấy học sinh'
+
+@app.route('/api/student/update-vector/batch', methods=['POST'])
+def update_student_vectors_batch():
+    """Cập nhật vector cho nhiều học sinh trong một transaction: {"items": [{"id", "vector_face"}, ...]}"""
+    try:
+        items, error = read_batch_items(request.get_json(silent=True))
+        if error:
+            return error
+
+        results, params = prepare_vector_updates(items)
+        written = db_manager.execute_batch(UPDATE_VECTOR_QUERY, params, restamp=updated_student_id)
+        if written is None:
+            return jsonify({
+                'success': False,
+                'message': 'Lỗi cập nhật database'
+            }), 500
+
+        apply_vector_updates(results, written)
+        updated = sum(1 for result in results if result['success'])
+        if updated:
+            # Template cũ không còn khớp vector_face mới; nạp lại gallery một lần thay vì sao chép ma trận cho từng dòng
+            store_enroll_templates([(int(result['id']), []) for result in results if result['success']])
+            face_gallery.invalidate()
+        return jsonify({
+            'success': True,
+            'message': f'Đã cập nhật {updated}/{len(items)} học sinh',
+            'updated_rows': updated,
+            'results': results
+        })
+
+    except Exception as e:
+        logger.error(f"Batch update vector error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi server: {str(e)}'
+        }), 500
+
+def student_insert_params(data):
+    """Tham số INSERT_STUDENT_QUERY từ dữ liệu request; báo VectorCodecError nếu vector_face sai"""
+    encoded_vector = parse_vector_input(data.get('vector_face'))
+    current_time = int(datetime.now().timestamp())
+    return ((data.get('full_name'), data.get('code_student'), data.get('phone'), data.get('address'), data.get('email'))
+            + vector_write_params(encoded_vector) + ('active', current_time))
+
+def inserted_student_id(_, lastrowid):
+    """Id học sinh vừa tạo bởi INSERT_STUDENT_QUERY (``restamp`` của execute_batch)"""
+    return lastrowid
+
+@app.route('/api/student/create', methods=['POST'])
+def create_student():
+    """Tạo học sinh mới, trả về id vừa tạo"""
+    try:
+        data = request.get_json()
+        
+        if not data or not data.get('full_name'):
+            return jsonify({
+                'success': False,
+                'message': 'Tên học sinh là bắt buộc'
+            }), 400
+        
+        # Chuẩn bị dữ liệu, vector được lưu dạng nhị phân
+        try:
+            params = student_insert_params(data)
+        except VectorCodecError as e:
+            return jsonify({
+                'success': False,
+                'message': f'vector_face không hợp lệ: {e}'
+            }), 400
+        try:
+            templates = parse_templates_input(data.get('templates')) if params[5] else []
+        except VectorCodecError as e:
+            return jsonify({
+                'success': False,
+                'message': f'templates không hợp lệ: {e}'
+            }), 400
+        
+        # Tạo học sinh mới
+        student_id = db_manager.execute_insert(INSERT_STUDENT_QUERY, params)
+        
+        if student_id is None:
+            return jsonify({
+                'success': False,
+                'message': 'Lỗi tạo học sinh'
+            }), 500
+        
+        name_index.upsert(student_id, params[0])
+        encoded_vector = params[5]
+        if encoded_vector:
+            stored = bool(templates) and store_enroll_templates([(student_id, templates)])
+            face_gallery.upsert(student_id, decode_string_to_vector(encoded_vector), full_name=params[0],
+                                templates=[vector for _, vector, _ in templates] if stored else None)
+        
+        return jsonify({
+            'success': True,
+            'message': 'Tạo học sinh thành công',
+            'data': {'id': student_id}
+        })
+        
+    except Exception as e:
+        logger.error(f"Create student error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi server: {str(e)}'
+        }), 500
+
+def prepare_student_inserts(items):
+    """Tham số INSERT_STUDENT_QUERY cho từng dòng; trả về (params, thông báo lỗi của dòng sai đầu tiên)"""
+    params = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('full_name'):
+            return None, f'Dòng {index}: tên học sinh là bắt buộc'
+        try:
+            params.append(student_insert_params(item))
+        except VectorCodecError as e:
+            return None, f'Dòng {index}: vector_face không hợp lệ: {e}'
+    return params, None
+
+@app.route('/api/student/create/batch', methods=['POST'])
+def create_students_batch():
+    """Tạo nhiều học sinh trong một transaction: {"items": [{"full_name", ...}, ...]}, trả về id theo thứ tự"""
+    try:
+        items, error = read_batch_items(request.get_json(silent=True))
+        if error:
+            return error
+
+        params, message = prepare_student_inserts(items)
+        if message:
+            return jsonify({
+                'success': False,
+                'message': message
+            }), 400
+
+        # Tất cả hoặc không: lỗi ở một dòng sẽ rollback cả batch
+        written = db_manager.execute_batch(INSERT_STUDENT_QUERY, params, restamp=inserted_student_id)
+        if written is None:
+            return jsonify({
+                'success': False,
+                'message': 'Lỗi tạo học sinh'
+            }), 500
+
+        ids = [lastrowid for _, lastrowid in written]
+        for student_id, row in zip(ids, params):
+            name_index.upsert(student_id, row[0])
+        if any(row[5] for row in params):
+            face_gallery.invalidate()
+
+        return jsonify({
+            'success': True,
+            'message': f'Đã tạo {len(ids)} học sinh',
+            'data': {'ids': ids}
+        })
+
+    except Exception as e:
+        logger.error(f"Batch create student error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi server: {str(e)}'
+        }), 500
+
+@app.route('/api/student/get-vector/<int:student_id>', methods=['GET'])
+def get_student_vector(student_id):
+    """Lấy vector encode của học sinh"""
+    try:
+        query = "SELECT id, full_name, vector_face FROM students WHERE id = %s"
+        result = db_manager.execute_query(query, (student_id,))
+        
+        if not result:
+            return jsonify({
+                'success': False,
+                'message': 'Không tìm thấy học sinh'
+            }), 404
+        
+        student = result[0]
+        
+        # Chuyển đổi vector thành dạng có thể sử dụng
+        vector_format = request.args.get('vector_format', 'list')
+        student['vector_face'] = format_vector_output(student['vector_face'], vector_format)
+        
+        return jsonify({
+            'success': True,
+            'data': student
+        })
+        
+    except Exception as e:
+        logger.error(f"Get vector error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi server: {str(e)}'
+        }), 500
+
+# Các cột được phép chọn qua tham số fields của /api/student/list
+STUDENT_COLUMNS = ('id', 'full_name', 'code_student', 'phone', 'address', 'email',
+                   'vector_face', 'vector_dim', 'vector_dtype', 'vector_norm', 'vector_checksum',
+                   'status', 'created_at')
+LIST_MAX_LIMIT = 5000
+
+def build_list_query(args):
+    """Dựng câu SELECT cho /api/student/list từ các tham số fields, after_id, limit"""
+    fields = args.get('fields')
+    if fields:
+        columns = [c.strip() for c in fields.split(',') if c.strip()]
+        unknown = [c for c in columns if c not in STUDENT_COLUMNS]
+        if unknown:
+            raise ValueError(f"Cột không hợp lệ: {', '.join(unknown)}")
+        if 'id' not in columns:
+            columns.insert(0, 'id')
+        select = ', '.join(columns)
+    else:
+        select = '*'
+
+    after_id = int(args.get('after_id', 0))
+    limit = args.get('limit')
+    query = f"SELECT {select} FROM students WHERE id > %s ORDER BY id"
+    params = [after_id]
+    if limit is not None:
+        limit = int(limit)
+        if not 1 <= limit <= LIST_MAX_LIMIT:
+            raise ValueError(f'limit phải nằm trong khoảng 1-{LIST_MAX_LIMIT}')
+        query += " LIMIT %s"
+        params.append(limit)
+    return query, tuple(params), limit
+
+def format_student_vectors(students, vector_format):
+    """Chuyển vector_face về dạng list (hoặc base64 nhị phân nếu vector_format=binary)"""
+    for student in students:
+        if 'vector_face' in student:
+            student['vector_face'] = format_vector_output(student['vector_face'], vector_format)
+    return students
+
+def list_response(results, vector_format, limit):
+    """Payload của /api/student/list (không stream)"""
+    response = {
+        'success': True,
+        'data': format_student_vectors(results, vector_format),
+        'count': len(results)
+    }
+    if limit is not None:
+        response['next_after_id'] = results[-1]['id'] if len(results) == limit else None
+    return response
+
+def stream_students_ndjson(query, params, vector_format):
+    """Ghi từng học sinh thành một dòng JSON ngay khi đọc được từ cursor"""
+    try:
+        for student in db_manager.iter_query(query, params):
+            format_student_vectors((student,), vector_format)
+            yield flask_json.dumps(student) + '\n'
+    except Exception as e:
+        logger.error(f"Stream students error: {e}")
+        yield flask_json.dumps({'success': False, 'message': f'Lỗi server: {str(e)}'}) + '\n'
+
+@app.route('/api/student/list', methods=['GET'])
+def list_students():
+    """Lấy thông tin học sinh.
+
+    Không có tham số: trả về toàn bộ bảng như trước. Hỗ trợ thêm:
+    - fields=id,full_name,vector_face: chỉ lấy các cột cần thiết; fields=id,vector_dim,vector_checksum
+      cho biết học sinh nào có vector và vector có đổi không mà không tải vector_face
+    - after_id, limit: phân trang theo khóa (id > after_id), kèm next_after_id
+    - format=ndjson: stream từng dòng JSON, bộ nhớ server không tăng theo kích thước bảng
+    """
+    try:
+        try:
+            query, params, limit = build_list_query(request.args)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': f'Tham số không hợp lệ: {e}'
+            }), 400
+        vector_format = request.args.get('vector_format', 'list')
+
+        if request.args.get('format') == 'ndjson':
+            return Response(stream_with_context(stream_students_ndjson(query, params, vector_format)),
+                            mimetype='application/x-ndjson')
+
+        results = db_manager.execute_query(query, params)
+        
+        if results is None:
+            return jsonify({
+                'success': False,
+                'message': 'Lỗi truy vấn database'
+            }), 500
+        
+        return jsonify(list_response(results, vector_format, limit))
+        
+    except Exception as e:
+        logger.error(f"List students error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi server: {str(e)}'
+        }), 500
+
+def changes_args(args):
+    """Tham số change feed (since, after_id, limit, columns); báo ValueError nếu since/after_id/limit/fields sai"""
+    since = int(args.get('since', 0))
+    after_id = int(args.get('after_id', 0))
+    limit = int(args.get('limit', 1000))
+    if not 1 <= limit <= LIST_MAX_LIMIT:
+        raise ValueError(f'limit phải nằm trong khoảng 1-{LIST_MAX_LIMIT}')
+    fields = args.get('fields')
+    if fields:
+        columns = [c.strip() for c in fields.split(',') if c.strip()]
+        unknown = [c for c in columns if c not in STUDENT_COLUMNS]
+        if unknown:
+            raise ValueError(f"Cột không hợp lệ: {', '.join(unknown)}")
+    else:
+        columns = list(STUDENT_COLUMNS)
+
+    columns = ['id'] + [c for c in columns if c not in ('id', 'version')] + ['version']
+    return since, after_id, limit, columns
+
+def changes_query(since, after_id, limit, columns, upper):
+    """Dựng truy vấn change feed đến mốc ``upper``, trả về (query, params, deleted_query, deleted_params)"""
+    query = f"""
+        SELECT {', '.join(columns)} FROM students
+        WHERE (version > %s OR (version = %s AND id > %s)) AND version <= %s
+        ORDER BY version, id
+        LIMIT %s
+    """
+    deleted_query = "SELECT student_id FROM student_deletions WHERE version > %s AND version <= %s"
+    return query, (since, since, after_id, upper, limit), deleted_query, (since, upper)
+
+def changes_response(upserts, deleted, vector_format, since, upper, limit):
+    """Payload của /api/student/changes kèm con trỏ next_since/next_after_id"""
+    format_student_vectors(upserts, vector_format)
+
+    has_more = len(upserts) == limit
+    if has_more:
+        next_since, next_after_id = upserts[-1]['version'], upserts[-1]['id']
+    else:
+        next_since, next_after_id = max(since, upper), 0
+
+    return {
+        'success': True,
+        'upserts': upserts,
+        'deleted': [row['student_id'] for row in deleted],
+        'next_since': next_since,
+        'next_after_id': next_after_id,
+        'has_more': has_more
+    }
+
+@app.route('/api/student/changes', methods=['GET'])
+def student_changes():
+    """Change feed cho camera đồng bộ tăng dần.
+
+    Trả các học sinh có (version, id) > (since, after_id) và danh sách id đã bị xóa.
+    Client lưu next_since/next_after_id và gọi lại cho đến khi has_more = false.
+    """
+    try:
+        try:
+            since, after_id, limit, columns = changes_args(request.args)
+        except ValueError as e:
+            return jsonify({
+                'success': False,
+                'message': f'Tham số không hợp lệ: {e}'
+            }), 400
+        vector_format = request.args.get('vector_format', 'list')
+
+        bound = db_manager.execute_query(CHANGE_FEED_UPPER_QUERY, (CHANGE_FEED_SETTLE_US,))
+        if bound is None:
+            return jsonify({
+                'success': False,
+                'message': 'Lỗi truy vấn database'
+            }), 500
+        upper = int(bound[0]['upper'])
+        query, params, deleted_query, deleted_params = changes_query(since, after_id, limit, columns, upper)
+
+        upserts = db_manager.execute_query(query, params)
+        deleted = db_manager.execute_query(deleted_query, deleted_params)
+        if upserts is None or deleted is None:
+            return jsonify({
+                'success': False,
+                'message': 'Lỗi truy vấn database'
+            }), 500
+
+        return jsonify(changes_response(upserts, deleted, vector_format, since, upper, limit))
+
+    except Exception as e:
+        logger.error(f"Student changes error: {e}")
+        return jsonify({
+            'success': False,
+            'message': f'Lỗi server: {str(e)}'
+        }), 500
+
+# Model được nạp theo FACE_MODEL_CONFIG; với FACE_LAZY_LOAD=1 chỉ nạp ở request đầu tiên
+face_models = FaceModelManager(FACE_MODEL_CONFIG)
+# Với INFERENCE_WORKERS > 0, model nằm trong các tiến trình worker, tiến trình web không nạp model
+inference_pool = InferencePool(face_models, INFERENCE_POOL_CONFIG)
+if not FACE_MODEL_CONFIG['lazy'] and not INFERENCE_POOL_CONFIG['workers']:
+    face_models.get()
+def embedding_cache_model_key(config=FACE_MODEL_CONFIG):
+    """Định danh model và tiền xử lý trong key của cache embedding (cache lưu xuống SQLite):
+    đổi gói model, det_size, precision (fp32/int8), module được nạp hoặc IMAGE_TARGET_SIDE
+    đều cho embedding khác nên không được dùng lại kết quả cũ"""
+    return '{}@{}x{}:{}:{}:side{}'.format(config['name'], *config['det_size'], config['precision'],
+                                          '+'.join(sorted(config['allowed_modules'])), IMAGE_TARGET_SIDE)
+
+# Cache embedding trong tiến trình web: ảnh gửi lại không phải qua inference pool
+embedding_cache = EmbeddingCache(embedding_cache_model_key())
+
+def collect_runtime_metrics():
+    """Gauge/counter đọc từ trạng thái hiện tại của pool DB, hàng đợi inference, batcher và cache"""
+    pool = db_manager.pool_stats()
+    inference = inference_pool.stats()
+    cache = embedding_cache.stats()
+    metrics = [
+        ('db_pool_connections', 'gauge', 'Số connection trong pool theo trạng thái',
+         [({'state': state}, pool[state]) for state in ('open', 'idle', 'in_use')]),
+        ('db_pool_size', 'gauge', 'Số connection tối đa của pool', [({}, pool['pool_size'])]),
+        ('db_pool_events_total', 'counter', 'Sự kiện của pool connection',
+         [({'event': event}, pool[event]) for event in ('checkouts', 'waits', 'timeouts', 'connects', 'reconnects', 'discarded')]),
+        ('inference_in_flight', 'gauge', 'Số việc inference đang chờ + đang chạy', [({}, inference['in_flight'])]),
+        ('inference_max_queue', 'gauge', 'Giới hạn hàng đợi inference', [({}, inference['max_queue'])]),
+        ('inference_jobs_total', 'counter', 'Việc inference theo kết quả',
+         [({'result': result}, inference[result]) for result in ('completed', 'rejected', 'timeouts', 'errors')]),
+        ('embedding_cache_entries', 'gauge', 'Số embedding trong cache', [({}, cache['entries'])]),
+        ('embedding_cache_events_total', 'counter', 'Sự kiện của cache embedding',
+         [({'event': event}, cache[event]) for event in ('hits', 'misses', 'evictions', 'stores')]),
+    ]
+    batcher = face_models.stats().get('recognition_batcher')
+    if batcher:
+        metrics += [
+            ('recognition_batcher_queue_depth', 'gauge', 'Số request chờ gom batch recognition', [({}, batcher['queue_depth'])]),
+            ('recognition_batcher_events_total', 'counter', 'Batch/khuôn mặt/request đã xử lý bởi batcher',
+             [({'event': event}, batcher[event]) for event in ('batches', 'faces', 'requests', 'rejected')]),
+        ]
+    return metrics
+
+registry.register_collector(collect_runtime_metrics)
+
+def base64_to_bytes(base64_string):
+    """Chuyển base64 string (có thể kèm tiền tố data URL) thành bytes ảnh"""
+    try:
+        if ',' in base64_string:
+            base64_string = base64_string.split(',')[1]
+        return base64.b64decode(base64_string)
+    except Exception as e:
+        logger.error(f"❌ Lỗi giải mã base64: {e}")
+        return None
+
+def queue_full_response(e):
+    logger.warning(f"⏳ {e}, trả 503.")
+    count_rejection(request.endpoint, 503, 'queue_full')
+    return jsonify({'success': False, 'message': 'Server đang quá tải, vui lòng thử lại sau.', 'error_code': 503}), 503
+
+def inference_timeout_response():
+    logger.warning(f"⏳ Inference quá {INFERENCE_POOL_CONFIG['timeout']}s, trả 504.")
+    count_rejection(request.endpoint, 504, 'inference_timeout')
+    return jsonify({'success': False, 'message': 'Xử lý ảnh quá thời gian chờ, vui lòng thử lại sau.', 'error_code': 504}), 504
+
+RAW_IMAGE_CONTENT_TYPES = ('image/', 'application/octet-stream')
+
+def read_request_images(fields, raw_field):
+    """Đọc ảnh từ request theo một trong 3 dạng, trả về (images, params):
+
+    - multipart/form-data: mỗi ảnh là một file part tên ``fields``, tham số ở form
+    - body nhị phân thô (image/*, application/octet-stream): một ảnh, gán cho ``raw_field``
+    - JSON: ảnh base64 trong các khóa ``fields`` (dạng cũ)
+
+    images là dict field -> bytes (None nếu thiếu); trả (None, None) nếu request rỗng.
+    Hai dạng nhị phân không phải giải mã base64 và không tạo chuỗi Python trung gian.
+    """
+    content_type = request.mimetype or ''
+    if request.files:
+        images = {}
+        for field in fields:
+            storage = request.files.get(field)
+            images[field] = storage.read() if storage else None
+        return images, request.form
+    if content_type.startswith(RAW_IMAGE_CONTENT_TYPES):
+        data = request.get_data(cache=False)
+        if not data:
+            return None, None
+        images = {field: None for field in fields}
+        images[raw_field] = data
+        return images, request.args
+    with stage_timer('json_parse'):
+        data = request.get_json(silent=True)
+    if not data:
+        return None, None
+    # base64 lỗi -> b'' để phân biệt với thiếu ảnh (None), worker sẽ báo không đọc được ảnh (402)
+    with stage_timer('base64_decode'):
+        images = {field: (base64_to_bytes(data[field]) or b'') if data.get(field) else None for field in fields}
+    return images, data
+
+@app.route('/api/face_vector_encode', methods=['GET'])
+def encode_face_from_images_get():
+    logger.warning("❌ [GET] /api/face_vector_encode được truy cập bằng GET thay vì POST.")
+    return jsonify({
+        'success': False,
+        'message': 'Vui lòng sử dụng phương thức POST với dữ liệu JSON để truy cập API này.',
+        'error_code': 405
+    }), 405
+
+ENCODE_FIELDS = ['image_front', 'image_left', 'image_right']
+
+def split_cached_faces(uploaded):
+    """Tách ảnh encode thành (image_bytes, cached, misses).
+
+    image_bytes là [(direction, bytes)] theo thứ tự front/left/right; ảnh đã encode
+    trước đó (client retry, kiosk gửi lại) lấy thẳng từ cache, chỉ misses cần inference.
+    """
+    image_bytes = []
+    for direction in ('front', 'left', 'right'):
+        data = uploaded.get(f'image_{direction}')
+        if data is None:
+            logger.warning(f"⚠️ Thiếu ảnh {direction}, bỏ qua.")
+            continue
+        image_bytes.append((direction, data))
+
+    cached, misses = {}, []
+    for direction, data in image_bytes:
+        face = embedding_cache.get(data, 'largest')
+        if face is not None and face['det_score'] >= MIN_DET_SCORE and passes_quality(face, direction):
+            cached[direction] = dict(face, direction=direction)
+        else:
+            misses.append((direction, data))
+    return image_bytes, cached, misses
+
+def encode_response(image_bytes, cached, misses, accepted, rejected):
+    """Lưu kết quả inference vào cache và dựng (payload, status) cho /api/face_vector_encode"""
+    miss_bytes = dict(misses)
+    for face in accepted:
+        embedding_cache.put(miss_bytes[face['direction']], 'largest', face)
+    if cached:
+        logger.info(f"⚡ Dùng embedding từ cache cho ảnh: {list(cached)}")
+        accepted = sorted(accepted + list(cached.values()),
+                          key=lambda face: [d for d, _ in image_bytes].index(face['direction']))
+    for face in accepted:
+        logger.info(f"📏 Kích thước ảnh {face['direction']}: {face['image_shape']} (thu nhỏ x{face['scale']:g})")
+    for item in rejected:
+        count_rejection('face_vector_encode', item['error_code'], item['reason'])
+        if item['error_code'] == 413:
+            logger.warning(f"❌ Ảnh {item['direction']} quá lớn ({item['message']}), bỏ qua.")
+        elif item['error_code'] == 402:
+            logger.warning(f"❌ Không đọc được ảnh {item['direction']} ({item.get('message', 'base64 lỗi hoặc không phải ảnh')}), bỏ qua.")
+        elif item['reason'] == 'no_face':
+            logger.warning(f"❌ Không phát hiện khuôn mặt ở ảnh {item['direction']}, bỏ qua.")
+        elif item['reason'] in QUALITY_REASONS:
+            logger.warning(f"❌ Khuôn mặt ở ảnh {item['direction']} không đạt chất lượng "
+                           f"({QUALITY_REASONS[item['reason']]}: {item['quality']}), bỏ qua.")
+        else:
+            logger.warning(f"❌ Khuôn mặt lớn nhất ở ảnh {item['direction']} không đủ rõ (score: {item['det_score']:.3f}), bỏ qua.")
+
+    vectors = [face['embedding'] for face in accepted]
+    used_directions = [face['direction'] for face in accepted]
+    # Cho client biết ảnh nào bị bỏ và vì sao (vd. ảnh mờ) để yêu cầu chụp lại đúng ảnh đó
+    rejected_directions = [{'direction': item['direction'], 'error_code': item['error_code'], 'reason': item['reason']}
+                           for item in rejected]
+
+    if not vectors:
+        if rejected and all(item['error_code'] == 413 for item in rejected):
+            count_rejection('face_vector_encode', 413, 'all_too_large')
+            return {'success': False, 'message': 'Ảnh quá lớn, vui lòng giảm kích thước rồi tải lại.', 'error_code': 413}, 413
+        count_rejection('face_vector_encode', 420, 'no_valid_image')
+        return {'success': False, 'message': 'Không có ảnh hợp lệ nào để lấy embedding.', 'error_code': 420,
+                'rejected': rejected_directions}, 400
+
+    avg_vector = np.mean(vectors, axis=0)
+    logger.info(f"✅ Đã tính xong vector trung bình từ {len(vectors)} ảnh hợp lệ: {used_directions}")
+
+    return {
+        'success': True,
+        'vector': avg_vector.tolist(),
+        'num_images_used': len(vectors),
+        'used_directions': used_directions,
+        'rejected': rejected_directions,
+        # Gửi kèm vector_face khi update-vector/create để gallery so khớp với từng hướng
+        'templates': [{'direction': face['direction'], 'vector': l2_normalize(face['embedding']).tolist(),
+                       'det_score': round(face['det_score'], 4)} for face in accepted],
+        'fallback': len(vectors) < 3
+    }, 200
+
+@app.route('/api/face_vector_encode', methods=['POST'])
+def encode_face_from_images():
+    """API nhận 1-3 ảnh và trả về vector trung bình các mặt hợp lệ.
+
+    Ảnh gửi dạng JSON base64 (image_front/left/right), multipart/form-data với các
+    file cùng tên, hoặc một ảnh nhị phân thô trong body kèm ?direction=front|left|right.
+    """
+    try:
+        direction_param = request.args.get('direction', 'front')
+        uploaded, _ = read_request_images(ENCODE_FIELDS, f'image_{direction_param}')
+        if uploaded is None:
+            logger.warning("📭 Không có dữ liệu gửi lên (body rỗng hoặc sai định dạng).")
+            return jsonify({'success': False, 'message': 'Không có dữ liệu gửi lên', 'error_code': 400}), 400
+
+        # Chỉ đọc bytes ở đây; giải mã ảnh, detect và recognition (một batch) chạy trong inference pool
+        image_bytes, cached, misses = split_cached_faces(uploaded)
+        accepted, rejected = [], []
+        if misses:
+            try:
+                accepted, rejected = inference_pool.run(encode_image_bytes, misses, 'largest')
+            except (QueueFull, BatcherQueueFull) as e:
+                return queue_full_response(e)
+            except FutureTimeout:
+                return inference_timeout_response()
+        payload, status = encode_response(image_bytes, cached, misses, accepted, rejected)
+        return jsonify(payload), status
+
+    except Exception as e:
+        logger.exception(f"🔥 Lỗi encode face: {e}")
+        return jsonify({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}), 500
+
+def identify_response(largest_face, error_code, top_k, threshold):
+    """Tìm top-k học sinh khớp với khuôn mặt đã encode, dựng (payload, status) cho /api/face/identify"""
+    if error_code is not None:
+        count_rejection('face_identify', error_code, 'too_large' if error_code == 413 else 'unreadable' if error_code == 402 else 'no_face')
+    if error_code == 413:
+        logger.warning("❌ Ảnh nhận diện vượt giới hạn dung lượng/kích thước.")
+        return {'success': False, 'message': 'Ảnh quá lớn, vui lòng giảm kích thước rồi tải lại.', 'error_code': 413}, 413
+    if error_code == 402:
+        logger.warning("❌ Không đọc được ảnh nhận diện (base64 lỗi hoặc không phải ảnh).")
+        return {'success': False, 'message': 'Không đọc được ảnh, vui lòng tải lại.', 'error_code': 402}, 400
+    if error_code == 403:
+        logger.warning("❌ Không phát hiện khuôn mặt trong ảnh nhận diện.")
+        return {'success': False, 'message': 'Không phát hiện khuôn mặt, vui lòng tải lại.', 'error_code': 403}, 400
+    embedding = largest_face['embedding']
+
+    with stage_timer('gallery_search'):
+        matches = face_gallery.search(embedding, top_k=top_k)
+    if threshold is not None:
+        matches = [m for m in matches if m['score'] >= threshold]
+    logger.info(f"🔎 Nhận diện xong, {len(matches)} kết quả, tốt nhất: {matches[0] if matches else None}")
+
+    return {
+        'success': True,
+        'data': {
+            'bbox': [float(x) for x in largest_face['bbox']],
+            'det_score': largest_face['det_score'],
+            'matches': matches
+        },
+        'gallery': face_gallery.stats()
+    }, 200
+
+@app.route('/api/face/identify', methods=['POST'])
+def identify_face():
+    """API nhận 1 ảnh (JSON base64, multipart hoặc nhị phân thô), trả về top-k học sinh khớp nhất với khuôn mặt lớn nhất"""
+    try:
+        uploaded, data = read_request_images(['image'], 'image')
+        if uploaded is None or uploaded['image'] is None:
+            logger.warning("📭 Không có ảnh gửi lên để nhận diện.")
+            return jsonify({'success': False, 'message': 'Thiếu ảnh cần nhận diện (image)', 'error_code': 400}), 400
+
+        try:
+            top_k, threshold, _ = identify_params(data, default_top_k=5)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f'Tham số không hợp lệ: {e}', 'error_code': 400}), 400
+
+        largest_face, error_code = embedding_cache.get(uploaded['image'], 'largest'), None
+        if largest_face is None:
+            try:
+                largest_face, error_code = inference_pool.run(embed_largest_face, uploaded['image'])
+            except (QueueFull, BatcherQueueFull) as e:
+                return queue_full_response(e)
+            except FutureTimeout:
+                return inference_timeout_response()
+            if largest_face is not None:
+                embedding_cache.put(uploaded['image'], 'largest', largest_face)
+        payload, status = identify_response(largest_face, error_code, top_k, threshold)
+        return jsonify(payload), status
+
+    except Exception as e:
+        logger.exception(f"🔥 Lỗi nhận diện khuôn mặt: {e}")
+        return jsonify({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}), 500
+
+# Giới hạn của /api/face/identify/batch: số khung hình mỗi request và số mặt lấy trong mỗi khung hình
+IDENTIFY_BATCH_MAX_FRAMES = int(os.environ.get('IDENTIFY_BATCH_MAX_FRAMES', 16))
+IDENTIFY_MAX_FACES_PER_FRAME = int(os.environ.get('IDENTIFY_MAX_FACES_PER_FRAME', 64))
+
+def read_request_frames():
+    """Đọc các khung hình của /api/face/identify/batch, trả về (list bytes, params):
+
+    - multipart/form-data: nhiều file part cùng tên ``images`` (hoặc ``image``)
+    - body nhị phân thô: một khung hình
+    - JSON: {"images": [base64, ...]} hoặc {"image": base64}
+    """
+    content_type = request.mimetype or ''
+    if request.files:
+        storages = request.files.getlist('images') + request.files.getlist('image')
+        return [storage.read() for storage in storages], request.form
+    if content_type.startswith(RAW_IMAGE_CONTENT_TYPES):
+        data = request.get_data(cache=False)
+        return ([data] if data else []), request.args
+    with stage_timer('json_parse'):
+        data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return [], {}
+    return decode_json_frames(data), data
+
+def decode_json_frames(data):
+    """Ảnh base64 trong khóa images (list) hoặc image của body JSON; base64 lỗi -> b'' (worker báo 402)"""
+    images = data.get('images')
+    if not isinstance(images, list):
+        images = [data['image']] if data.get('image') else []
+    with stage_timer('base64_decode'):
+        return [(base64_to_bytes(image) or b'') if isinstance(image, str) else b'' for image in images]
+
+def identify_params(params, default_top_k=1, default_threshold=None):
+    """(top_k, threshold, include_embedding) từ tham số request của /api/face/identify(/batch); báo ValueError nếu sai"""
+    try:
+        top_k = max(1, min(int(params.get('top_k', default_top_k)), 100))
+        threshold = params.get('threshold')
+        threshold = float(threshold) if threshold is not None else default_threshold
+    except (TypeError, ValueError):
+        raise ValueError('top_k phải là số nguyên, threshold phải là số thực') from None
+    include_embedding = str(params.get('include_embedding', '1')).lower() in ('1', 'true', 'yes')
+    return top_k, threshold, include_embedding
+
+def identify_batch_response(frames, top_k, threshold, include_embedding):
+    """So khớp mọi khuôn mặt của cả batch với gallery bằng một phép nhân ma trận, dựng (payload, status)"""
+    faces = [face for frame in frames for face in frame.get('faces', ())]
+    with stage_timer('gallery_search'):
+        matches = face_gallery.search_batch(np.stack([face['embedding'] for face in faces]), top_k=top_k) if faces else []
+
+    results, position = [], 0
+    for index, frame in enumerate(frames):
+        if 'error_code' in frame:
+            count_rejection('face_identify_batch', frame['error_code'], frame['reason'])
+            results.append({'index': index, 'faces': [], 'error_code': frame['error_code'],
+                            'reason': frame['reason'], 'message': frame['message']})
+            continue
+        items = []
+        for face in frame['faces']:
+            candidates = matches[position]
+            position += 1
+            if threshold is not None:
+                candidates = [m for m in candidates if m['score'] >= threshold]
+            best = candidates[0] if candidates else None
+            item = {
+                'bbox': [float(x) for x in face['bbox']],
+                'det_score': face['det_score'],
+                'student_id': best['id'] if best else None,
+                'full_name': best['full_name'] if best else None,
+                'score': best['score'] if best else None,
+            }
+            if top_k > 1:
+                item['matches'] = candidates
+            if include_embedding:
+                item['embedding'] = face['embedding'].tolist()
+            items.append(item)
+        results.append({'index': index, 'faces': items, 'skipped': frame['skipped']})
+
+    rejected = [frame for frame in frames if 'error_code' in frame]
+    if len(rejected) == len(frames):
+        if all(frame['error_code'] == 413 for frame in rejected):
+            logger.warning("❌ Mọi khung hình đều vượt giới hạn dung lượng/kích thước.")
+            return {'success': False, 'message': 'Ảnh quá lớn, vui lòng giảm kích thước rồi tải lại.', 'error_code': 413}, 413
+        logger.warning("❌ Không đọc được khung hình nào.")
+        return {'success': False, 'message': 'Không đọc được ảnh, vui lòng tải lại.', 'error_code': 402}, 400
+
+    identified = sum(1 for frame in results for face in frame['faces'] if face['student_id'] is not None)
+    logger.info(f"🔎 Nhận diện batch xong: {len(frames)} khung hình, {len(faces)} khuôn mặt, {identified} khớp")
+    return {
+        'success': True,
+        'data': {
+            'frames': results,
+            'num_faces': len(faces),
+            'num_identified': identified
+        },
+        'gallery': face_gallery.stats()
+    }, 200
+
+@app.route('/api/face/identify/batch', methods=['POST'])
+def identify_faces_batch():
+    """API nhận một hoặc nhiều khung hình (vd. ảnh lớp học từ camera), trả về mọi khuôn mặt
+    kèm bbox, det_score, embedding và học sinh khớp nhất (điểm không dưới ``threshold``, mặc định
+    FACE_MATCH_THRESHOLD); detect từng khung hình, recognition và so khớp gallery chạy một lần cho cả batch.
+    """
+    try:
+        frames, params = read_request_frames()
+        if not frames:
+            logger.warning("📭 Không có khung hình gửi lên để nhận diện.")
+            return jsonify({'success': False, 'message': 'Thiếu ảnh cần nhận diện (images)', 'error_code': 400}), 400
+        if len(frames) > IDENTIFY_BATCH_MAX_FRAMES:
+            return jsonify({'success': False, 'message': f'Tối đa {IDENTIFY_BATCH_MAX_FRAMES} khung hình mỗi request',
+                            'error_code': 400}), 400
+        try:
+            # Không gửi threshold: mặt có điểm dưới ngưỡng nhận diện chung trả về student_id = null
+            top_k, threshold, include_embedding = identify_params(params, default_threshold=MATCH_THRESHOLD)
+        except ValueError as e:
+            return jsonify({'success': False, 'message': f'Tham số không hợp lệ: {e}', 'error_code': 400}), 400
+
+        try:
+            results = inference_pool.run(encode_frames_bytes, frames, MIN_DET_SCORE, IDENTIFY_MAX_FACES_PER_FRAME)
+        except (QueueFull, BatcherQueueFull) as e:
+            return queue_full_response(e)
+        except FutureTimeout:
+            return inference_timeout_response()
+        payload, status = identify_batch_response(results, top_k, threshold, include_embedding)
+        return jsonify(payload), status
+
+    except Exception as e:
+        logger.exception(f"🔥 Lỗi nhận diện batch: {e}")
+        return jsonify({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}), 500
+
+ARCHIVE_CONTENT_TYPES = ('application/zip', 'application/x-zip-compressed', 'application/x-tar',
+                         'application/gzip', 'application/x-gzip', 'application/octet-stream')
+
+@app.route('/api/student/bulk-enroll', methods=['POST'])
+def bulk_enroll_students():
+    """API nhận file zip/tar ảnh theo học sinh (multipart ``archive`` hoặc body nhị phân),
+    encode song song theo batch và ghi vector theo từng phần (BULK_ENROLL_WRITE_CHUNK học sinh mỗi transaction).
+
+    Tham số ?dry_run=1 chỉ encode và trả báo cáo, không ghi database.
+    """
+    request.max_content_length = BULK_ENROLL_CONFIG['max_upload_bytes']
+    try:
+        dry_run = request.args.get('dry_run', '0').lower() in ('1', 'true', 'yes')
+        upload = request.files.get('archive')
+        if upload is None and not (request.mimetype or '').startswith(ARCHIVE_CONTENT_TYPES):
+            return jsonify({'success': False, 'message': 'Thiếu file nén ảnh (archive)', 'error_code': 400}), 400
+
+        with tempfile.SpooledTemporaryFile(max_size=64 * 1024 * 1024) as archive:
+            shutil.copyfileobj(upload.stream if upload is not None else request.stream, archive)
+            archive.seek(0)
+            try:
+                source = ImageSource(fileobj=archive)
+            except ValueError as e:
+                return jsonify({'success': False, 'message': str(e), 'error_code': 400}), 400
+            if not source.students:
+                return jsonify({'success': False, 'message': 'Không có ảnh học sinh nào trong file nén', 'error_code': 400}), 400
+
+            logger.info(f"📦 Bulk enroll {len(source.students)} học sinh (dry_run={dry_run})")
+            config = dict(BULK_ENROLL_CONFIG, concurrency=BULK_ENROLL_CONFIG['concurrency'] or INFERENCE_POOL_CONFIG['workers'])
+            try:
+                report, vectors = bulk_enroll(inference_pool.run, source, dry_run=dry_run, config=config)
+            except (QueueFull, BatcherQueueFull) as e:
+                return queue_full_response(e)
+            except FutureTimeout:
+                return inference_timeout_response()
+            finally:
+                source.close()
+
+        if vectors and not dry_run:
+            face_gallery.invalidate()
+        logger.info(f"✅ Bulk enroll xong: {report['summary']}")
+        return jsonify({'success': True, 'data': report}), 200
+
+    except Exception as e:
+        logger.exception(f"🔥 Lỗi bulk enroll: {e}")
+        return jsonify({'success': False, 'message': f'Lỗi server: {str(e)}', 'error_code': 500}), 500
+
+if __name__ == '__main__':
+    print("Starting Face Recognition API Server...")
+    print(f"Database Host: {DB_CONFIG['host']}:{DB_CONFIG['port']}")
+    print(f"Database: {DB_CONFIG['database']}")
+    print("Server running at: http://localhost:5002")
+    app.run(debug=True, host='0.0.0.0', port=5002)
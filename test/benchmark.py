@@ -0,0 +1,370 @@
+"""Benchmark cục bộ cho pipeline encode và các API database, ghi kết quả ra JSON để so sánh giữa các phiên bản.
+
+Các phần:
+    codec   đo encode_vector_to_string / decode_string_to_vector (và định dạng base64 JSON cũ) theo số chiều
+    list    đo /api/student/list trên bảng giả lập 1k/10k/100k dòng; mặc định chạy app trong tiến trình
+            với SQLite thay cho MySQL, hoặc gọi server thật qua --url
+    encode  tạo tải cho /api/face_vector_encode của server đang chạy bằng test/front.jpg, left.jpg, right.jpg
+
+Cách dùng (chạy từ thư mục gốc repo):
+    python test/benchmark.py codec list --output bench_v2.json
+    python test/benchmark.py encode --url http://localhost:5002 --concurrency 8 --requests 200
+    python test/benchmark.py codec list --output bench_v3.json --compare bench_v2.json
+"""
+import argparse
+import base64
+import json
+import os
+import platform
+import re
+import sqlite3
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# Benchmark list/codec không cần model: không nạp InsightFace khi import server
+os.environ.setdefault('FACE_LAZY_LOAD', '1')
+
+CODEC_DIMS = (128, 512, 2048)
+LIST_ROWS = (1000, 10000, 100000)
+# Trả vector dạng list JSON cho bảng lớn tốn hàng GB RAM, chỉ đo đến số dòng này
+LIST_FORMAT_MAX_ROWS = 10000
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = (len(values) - 1) * p / 100
+    low, high = int(k), min(int(k) + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (k - low)
+
+
+def summarize_ms(seconds):
+    ms = [s * 1000 for s in seconds]
+    return {
+        'count': len(ms),
+        'mean_ms': round(statistics.fmean(ms), 3) if ms else None,
+        'p50_ms': round(percentile(ms, 50), 3) if ms else None,
+        'p90_ms': round(percentile(ms, 90), 3) if ms else None,
+        'p99_ms': round(percentile(ms, 99), 3) if ms else None,
+        'max_ms': round(max(ms), 3) if ms else None,
+    }
+
+
+def run_meta():
+    try:
+        revision = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT,
+                                  capture_output=True, text=True, timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        revision = None
+    return {
+        'git_revision': revision,
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+# ---------------------------------------------------------------- codec
+
+def bench_codec(dims=CODEC_DIMS, number=2000):
+    from server import decode_string_to_vector, encode_vector_to_string
+
+    results = []
+    rng = np.random.default_rng(0)
+    for dim in dims:
+        vector = rng.standard_normal(dim).astype(np.float32)
+        encoded = encode_vector_to_string(vector)
+        legacy = base64.b64encode(json.dumps(vector.tolist()).encode())
+        cases = {
+            'encode_binary': lambda: encode_vector_to_string(vector),
+            'decode_binary': lambda: decode_string_to_vector(encoded),
+            'encode_legacy_base64_json': lambda: base64.b64encode(json.dumps(vector.tolist()).encode()),
+            'decode_legacy_base64_json': lambda: decode_string_to_vector(legacy),
+        }
+        for name, fn in cases.items():
+            best = min(timeit.repeat(fn, number=number, repeat=5)) / number
+            results.append({'case': name, 'dim': dim, 'us_per_op': round(best * 1e6, 3),
+                            'ops_per_sec': round(1 / best),
+                            'bytes': len(encoded) if 'binary' in name else len(legacy)})
+            print(f"  codec {name:28s} dim={dim:5d} {best * 1e6:9.2f} µs/op")
+    return results
+
+
+# ---------------------------------------------------------------- list
+
+class _SqliteCursor:
+    """Cursor giả lập mysql.connector (paramstyle %s, dictionary=True) trên SQLite"""
+
+    def __init__(self, connection, dictionary):
+        self._cursor = connection.cursor()
+        self._dictionary = dictionary
+        self.rowcount = -1
+        self.lastrowid = None
+
+    def execute(self, query, params=None):
+        self._cursor.execute(query.replace('%s', '?'), tuple(params or ()))
+        self.rowcount = self._cursor.rowcount
+        self.lastrowid = self._cursor.lastrowid
+
+    def _rows(self, rows):
+        if not self._dictionary:
+            return rows
+        names = [column[0] for column in self._cursor.description]
+        return [dict(zip(names, row)) for row in rows]
+
+    def fetchall(self):
+        return self._rows(self._cursor.fetchall())
+
+    def fetchmany(self, size):
+        return self._rows(self._cursor.fetchmany(size))
+
+    def close(self):
+        self._cursor.close()
+
+
+class _SqliteConnection:
+    def __init__(self, path):
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+    @property
+    def in_transaction(self):
+        return self._connection.in_transaction
+
+    def cursor(self, dictionary=False, buffered=True):
+        return _SqliteCursor(self._connection, dictionary)
+
+    def ping(self, reconnect=False):
+        pass
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+def build_sqlite_students(path, rows, dim=512, seed=0):
+    """Tạo bảng students giả lập với ``rows`` dòng, vector_face nhị phân float32"""
+    from vector_codec import encode_vector, vector_metadata
+
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    connection.execute("""
+        CREATE TABLE students (
+            id INTEGER PRIMARY KEY, full_name TEXT, code_student TEXT, phone TEXT, address TEXT, email TEXT,
+            vector_face BLOB, vector_dim INTEGER, vector_dtype TEXT, vector_norm REAL, vector_checksum INTEGER,
+            status TEXT, created_at INTEGER, version INTEGER
+        )
+    """)
+    rng = np.random.default_rng(seed)
+    now = int(time.time())
+    batch = []
+    for student_id in range(1, rows + 1):
+        encoded = encode_vector(rng.standard_normal(dim).astype(np.float32))
+        batch.append((student_id, f'Học sinh {student_id}', f'HS{student_id:06d}', '0900000000', 'Hà Nội',
+                      f'hs{student_id}@example.com', encoded) + vector_metadata(encoded)
+                     + ('active', now, now * 1000000 + student_id))
+        if len(batch) == 5000:
+            connection.executemany(f"INSERT INTO students VALUES ({', '.join(['?'] * 14)})", batch)
+            batch = []
+    if batch:
+        connection.executemany(f"INSERT INTO students VALUES ({', '.join(['?'] * 14)})", batch)
+    connection.commit()
+    connection.close()
+
+
+def _list_cases(rows):
+    cases = [
+        ('json_binary', {'fields': 'id,full_name,vector_face', 'vector_format': 'binary'}),
+        ('ndjson_binary', {'fields': 'id,full_name,vector_face', 'vector_format': 'binary', 'format': 'ndjson'}),
+        ('paged_5000_binary', {'fields': 'id,full_name,vector_face', 'vector_format': 'binary', 'limit': 5000}),
+        ('json_no_vector', {'fields': 'id,full_name,vector_dim,vector_checksum'}),
+    ]
+    if rows <= LIST_FORMAT_MAX_ROWS:
+        cases.insert(0, ('json_all_columns_list', {}))
+    return cases
+
+
+def _fetch_all_pages(get, params):
+    """Gọi /api/student/list theo next_after_id cho đến hết; trả về (số byte, số dòng)"""
+    total_bytes, total_rows, after_id = 0, 0, 0
+    while True:
+        status, body = get(dict(params, after_id=after_id))
+        if status != 200:
+            raise RuntimeError(f'/api/student/list trả {status}')
+        total_bytes += len(body)
+        if params.get('format') == 'ndjson':
+            return total_bytes, body.count(b'\n')
+        data = json.loads(body)
+        total_rows += len(data['data'])
+        after_id = data.get('next_after_id')
+        if 'limit' not in params or not after_id:
+            return total_bytes, total_rows
+
+
+def bench_list(row_counts=LIST_ROWS, repeat=3, url=None, workdir='/tmp'):
+    results = []
+    if url:
+        import requests
+        session = requests.Session()
+
+        def get(params):
+            response = session.get(f'{url}/api/student/list', params=params, timeout=600)
+            return response.status_code, response.content
+
+        # Server thật: dùng bảng students hiện có, không tạo dữ liệu giả
+        row_counts = (None,)
+    else:
+        import database
+        import server
+        client = server.app.test_client()
+
+        def get(params):
+            response = client.get('/api/student/list', query_string=params)
+            return response.status_code, response.get_data()
+
+    for rows in row_counts:
+        if rows is not None:
+            path = os.path.join(workdir, f'bench_students_{rows}.sqlite')
+            started = time.perf_counter()
+            build_sqlite_students(path, rows)
+            print(f"  list: đã tạo bảng {rows} dòng trong {time.perf_counter() - started:.1f}s")
+            database.mysql.connector.connect = lambda path=path, **kwargs: _SqliteConnection(path)
+            # Connection cũ trong pool trỏ tới file của lần trước
+            database.db_manager = server.db_manager = database.DatabaseManager()
+        for name, params in _list_cases(rows or 0):
+            timings, size = [], None
+            for _ in range(repeat):
+                started = time.perf_counter()
+                size, returned = _fetch_all_pages(get, params)
+                timings.append(time.perf_counter() - started)
+            result = {'case': name, 'rows': rows if rows is not None else returned, 'response_bytes': size,
+                      'rows_per_sec': round(returned / min(timings)) if returned else None, **summarize_ms(timings)}
+            results.append(result)
+            print(f"  list {name:24s} rows={result['rows']:7d} {result['p50_ms']:10.1f} ms  {size / 1e6:8.1f} MB")
+    return results
+
+
+# ---------------------------------------------------------------- encode
+
+def bench_encode(url, concurrency=4, total_requests=100, mode='json', warmup=3):
+    import requests
+
+    images = {}
+    for direction in ('front', 'left', 'right'):
+        with open(os.path.join(ROOT, 'test', f'{direction}.jpg'), 'rb') as f:
+            images[direction] = f.read()
+    payload = {f'image_{d}': base64.b64encode(data).decode() for d, data in images.items()}
+    endpoint = f'{url}/api/face_vector_encode'
+    local = threading.local()
+
+    def send():
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        started = time.perf_counter()
+        if mode == 'multipart':
+            response = session.post(endpoint, files={f'image_{d}': (f'{d}.jpg', data, 'image/jpeg')
+                                                     for d, data in images.items()}, timeout=120)
+        else:
+            response = session.post(endpoint, json=payload, timeout=120)
+        return response.status_code, time.perf_counter() - started
+
+    for _ in range(warmup):
+        send()
+
+    statuses, timings = {}, []
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for status, elapsed in executor.map(lambda _: send(), range(total_requests)):
+            statuses[str(status)] = statuses.get(str(status), 0) + 1
+            if status == 200:
+                timings.append(elapsed)
+    wall = time.perf_counter() - started
+    result = {'mode': mode, 'concurrency': concurrency, 'requests': total_requests, 'statuses': statuses,
+              'throughput_rps': round(len(timings) / wall, 2), 'wall_seconds': round(wall, 2), **summarize_ms(timings)}
+    print(f"  encode {mode} c={concurrency}: {result['throughput_rps']} req/s, p50 {result['p50_ms']} ms, "
+          f"p99 {result['p99_ms']} ms, status {statuses}")
+    return result
+
+
+# ---------------------------------------------------------------- so sánh
+
+def compare(current, previous):
+    """In tỉ lệ thay đổi của các chỉ số thời gian giữa hai file kết quả (>1 là chậm hơn)"""
+    def index(section, key_fields, metric):
+        return {tuple(item.get(k) for k in key_fields): item.get(metric) for item in section or []}
+
+    pairs = [('codec', ('case', 'dim'), 'us_per_op'), ('list', ('case', 'rows'), 'p50_ms')]
+    for section, keys, metric in pairs:
+        before = index(previous.get(section), keys, metric)
+        for key, value in index(current.get(section), keys, metric).items():
+            old = before.get(key)
+            if old and value:
+                ratio = value / old
+                flag = '⚠️ ' if ratio > 1.1 else ''
+                print(f"  {flag}{section} {key}: {old} -> {value} {metric} (x{ratio:.2f})")
+    for mode in ('encode',):
+        old, new = previous.get(mode), current.get(mode)
+        if old and new and old.get('p50_ms') and new.get('p50_ms'):
+            print(f"  {mode} p50: {old['p50_ms']} -> {new['p50_ms']} ms, "
+                  f"throughput: {old['throughput_rps']} -> {new['throughput_rps']} req/s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark pipeline encode và API database')
+    parser.add_argument('parts', nargs='+', choices=['codec', 'list', 'encode'])
+    parser.add_argument('--output', default='benchmark_results.json', help='File JSON ghi kết quả')
+    parser.add_argument('--compare', help='File JSON kết quả của phiên bản trước để so sánh')
+    parser.add_argument('--url', help='Server đang chạy, vd. http://localhost:5002 (bắt buộc với encode)')
+    parser.add_argument('--rows', default=','.join(map(str, LIST_ROWS)), help='Số dòng bảng giả lập, phân cách dấu phẩy')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--concurrency', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--mode', choices=['json', 'multipart'], default='json')
+    args = parser.parse_args()
+
+    results = {'meta': run_meta()}
+    if 'codec' in args.parts:
+        print("🧪 Codec vector...")
+        results['codec'] = bench_codec()
+    if 'list' in args.parts:
+        print("🧪 /api/student/list...")
+        rows = tuple(int(r) for r in re.split(r'[,\s]+', args.rows) if r)
+        results['list'] = bench_list(rows, repeat=args.repeat, url=args.url)
+    if 'encode' in args.parts:
+        if not args.url:
+            parser.error('encode cần --url của server đang chạy')
+        print("🧪 /api/face_vector_encode...")
+        results['encode'] = bench_encode(args.url, concurrency=args.concurrency,
+                                         total_requests=args.requests, mode=args.mode)
+
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, ensure_ascii=False, indent=2)
+    print(f"✅ Đã ghi kết quả vào {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            previous = json.load(f)
+        print(f"📊 So sánh với {args.compare} ({previous.get('meta', {}).get('git_revision')}):")
+        compare(results, previous)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+"""So sánh model INT8 (FACE_MODEL_PRECISION=int8, tạo bằng quantize_models.py) với bản fp32
+trên các ảnh trong test/: độ lệch detection, độ tương đồng cosine của embedding và độ trễ CPU.
+
+Với mỗi ảnh:
+    detection    IoU bbox và chênh lệch det_score của khuôn mặt lớn nhất
+    recognition  cosine giữa embedding fp32 và int8 trên CÙNG ảnh đã căn chỉnh (chỉ sai số recognition)
+    end_to_end   cosine giữa embedding fp32 và embedding qua toàn bộ pipeline int8 (detect, căn chỉnh, recognition)
+Ngoài ra so sánh ma trận cosine giữa các ảnh (fp32 và int8) để thấy thứ hạng nhận diện có đổi không.
+
+Cách dùng (chạy từ thư mục gốc repo, cần chạy quantize_models.py trước):
+    python test/quantization_check.py
+    python test/quantization_check.py --repeat 50 --output quantization_check.json
+    python test/quantization_check.py --min-cosine 0.99   # mã thoát 1 nếu cosine thấp hơn ngưỡng
+"""
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from benchmark import ROOT, run_meta, summarize_ms
+
+from face_models import FACE_MODEL_CONFIG, FaceModels
+from face_pipeline import align_face, box_iou, select_face
+
+CPU_CONFIG = dict(FACE_MODEL_CONFIG, providers=['CPUExecutionProvider'], batch_size=0)
+
+
+def cosine(a, b):
+    return float(np.dot(a, b) / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+def largest_face(models, img):
+    return select_face(*models.det_model.detect(img, max_num=0, metric='default'), select='largest')
+
+
+def embed(models, img, kps):
+    return models.models['recognition'].get_feat([align_face(models, img, kps)])[0]
+
+
+def timed(fn, repeat):
+    seconds = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        seconds.append(time.perf_counter() - started)
+    return summarize_ms(seconds)
+
+
+def check_images(fp32, int8, images):
+    per_image, fp32_embeddings, int8_embeddings = [], [], []
+    for path, img in images:
+        name = os.path.basename(path)
+        face, face_q = largest_face(fp32, img), largest_face(int8, img)
+        if face is None or face_q is None:
+            per_image.append({'image': name, 'error': 'không tìm thấy khuôn mặt',
+                              'fp32_found': face is not None, 'int8_found': face_q is not None})
+            continue
+        reference = embed(fp32, img, face['kps'])
+        same_crop = embed(int8, img, face['kps'])
+        end_to_end = embed(int8, img, face_q['kps'])
+        fp32_embeddings.append(reference)
+        int8_embeddings.append(end_to_end)
+        per_image.append({
+            'image': name,
+            'bbox_iou': round(float(box_iou(face['bbox'], face_q['bbox'])[0, 0]), 4),
+            'det_score_fp32': round(face['det_score'], 4),
+            'det_score_delta': round(face_q['det_score'] - face['det_score'], 4),
+            'recognition_cosine': round(cosine(reference, same_crop), 4),
+            'end_to_end_cosine': round(cosine(reference, end_to_end), 4),
+        })
+
+    pairwise = None
+    if len(fp32_embeddings) > 1:
+        a = np.stack(fp32_embeddings)
+        b = np.stack(int8_embeddings)
+        a /= np.linalg.norm(a, axis=1, keepdims=True)
+        b /= np.linalg.norm(b, axis=1, keepdims=True)
+        upper = np.triu_indices(len(a), k=1)
+        pairwise = {
+            'fp32': np.round((a @ a.T)[upper], 4).tolist(),
+            'int8': np.round((b @ b.T)[upper], 4).tolist(),
+            'max_abs_delta': round(float(np.abs((a @ a.T) - (b @ b.T))[upper].max()), 4),
+        }
+    return per_image, pairwise
+
+
+def check_latency(models, img, repeat):
+    face = largest_face(models, img)
+    detect = timed(lambda: models.det_model.detect(img, max_num=0, metric='default'), repeat)
+    if face is None:
+        return {'detect': detect}
+    crop = align_face(models, img, face['kps'])
+    recognition = models.models['recognition']
+    return {
+        'detect': detect,
+        'recognition_1': timed(lambda: recognition.get_feat([crop]), repeat),
+        'recognition_8': timed(lambda: recognition.get_feat([crop] * 8), repeat),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='So sánh model INT8 với fp32 trên ảnh test/')
+    parser.add_argument('--images', default=os.path.join(ROOT, 'test', '*.jpg'), help='glob ảnh cần so sánh')
+    parser.add_argument('--repeat', type=int, default=20, help='số lần đo độ trễ mỗi model')
+    parser.add_argument('--min-cosine', type=float, default=0.98, help='ngưỡng cosine end-to-end tối thiểu')
+    parser.add_argument('--output', help='File JSON ghi kết quả')
+    args = parser.parse_args()
+
+    images = [(path, cv2.imread(path)) for path in sorted(glob.glob(args.images))]
+    images = [(path, img) for path, img in images if img is not None]
+    if not images:
+        parser.error(f'Không có ảnh nào khớp {args.images}')
+
+    fp32 = FaceModels(dict(CPU_CONFIG, precision='fp32'))
+    int8 = FaceModels(dict(CPU_CONFIG, precision='int8'))
+    if set(int8.module_precision.values()) == {'fp32'}:
+        sys.exit('Chưa có model int8, chạy python quantize_models.py trước')
+
+    print(f"🧪 So sánh {len(images)} ảnh (int8: {int8.module_precision})...")
+    per_image, pairwise = check_images(fp32, int8, images)
+    for row in per_image:
+        print('   ', row)
+    if pairwise:
+        print(f"    Cosine giữa các ảnh fp32={pairwise['fp32']} int8={pairwise['int8']} "
+              f"(lệch tối đa {pairwise['max_abs_delta']})")
+
+    print(f"🧪 Độ trễ CPU ({args.repeat} lần, ảnh {os.path.basename(images[0][0])})...")
+    latency = {'fp32': check_latency(fp32, images[0][1], args.repeat),
+               'int8': check_latency(int8, images[0][1], args.repeat)}
+    for stage, stats in latency['fp32'].items():
+        quantized = latency['int8'].get(stage)
+        if quantized:
+            print(f"    {stage:<14} fp32 p50 {stats['p50_ms']:>8.2f} ms   int8 p50 {quantized['p50_ms']:>8.2f} ms   "
+                  f"x{stats['p50_ms'] / quantized['p50_ms']:.2f}")
+
+    results = {'meta': run_meta(), 'module_precision': int8.module_precision,
+               'images': per_image, 'pairwise': pairwise, 'latency': latency}
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"✅ Đã ghi kết quả vào {args.output}")
+
+    cosines = [row['end_to_end_cosine'] for row in per_image if 'end_to_end_cosine' in row]
+    if len(cosines) < len(per_image) or min(cosines, default=0.0) < args.min_cosine:
+        print(f"❌ Có ảnh lệch quá ngưỡng (cosine end-to-end nhỏ nhất {min(cosines, default=None)}, "
+              f"ngưỡng {args.min_cosine})")
+        sys.exit(1)
+    print(f"✅ Cosine end-to-end nhỏ nhất {min(cosines)} >= {args.min_cosine}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,125 @@
+"""Mã hóa nhị phân cho vector_face.
+
+Định dạng (little-endian), header 12 byte:
+
+    magic  b'\\x93VF'  (3 byte)
+    version            (1 byte)  - hiện tại là 1
+    dtype              (1 byte)  - 1: float32, 2: float16
+    reserved           (3 byte)
+    dim                (4 byte, uint32)
+
+theo sau là ``dim`` phần tử dtype tương ứng. Dữ liệu cũ (base64 của JSON list)
+vẫn đọc được: base64 không bao giờ bắt đầu bằng byte 0x93.
+"""
+import base64
+import binascii
+import json
+import struct
+import zlib
+
+import numpy as np
+
+MAGIC = b'\x93VF'
+VERSION = 1
+HEADER = struct.Struct('<3sBB3xI')
+
+DTYPE_CODES = {
+    'float32': 1,
+    'float16': 2,
+}
+CODE_DTYPES = {
+    1: np.dtype('<f4'),
+    2: np.dtype('<f2'),
+}
+
+
+class VectorCodecError(ValueError):
+    pass
+
+
+def encode_vector(vector, dtype='float32'):
+    """Mã hóa vector 1 chiều thành bytes theo định dạng nhị phân ở trên"""
+    if dtype not in DTYPE_CODES:
+        raise VectorCodecError(f'dtype không hỗ trợ: {dtype}')
+    code = DTYPE_CODES[dtype]
+    array = np.ascontiguousarray(np.asarray(vector).ravel(), dtype=CODE_DTYPES[code])
+    return HEADER.pack(MAGIC, VERSION, code, array.size) + array.tobytes()
+
+
+def is_binary_vector(data):
+    return isinstance(data, (bytes, bytearray, memoryview)) and bytes(data[:3]) == MAGIC
+
+
+def read_vector_header(data):
+    """Đọc (dtype, dim) từ 12 byte header mà không cần phần dữ liệu; None nếu không phải định dạng nhị phân"""
+    if not is_binary_vector(data) or len(data) < HEADER.size:
+        return None
+    _, version, code, dim = HEADER.unpack_from(bytes(data[:HEADER.size]))
+    if version != VERSION or code not in CODE_DTYPES:
+        return None
+    return CODE_DTYPES[code].name, dim
+
+
+def vector_metadata(data):
+    """Metadata lưu kèm vector_face: (dim, dtype, norm L2, CRC32 của bytes đã mã hóa).
+
+    CRC32 trùng với hàm CRC32() của MySQL nên có thể kiểm tra ngay trong SQL:
+    ``WHERE CRC32(vector_face) <> vector_checksum``. Trả về 4 giá trị None nếu không có vector.
+    """
+    if not data:
+        return None, None, None, None
+    vector = decode_vector(data)
+    norm = float(np.linalg.norm(vector.astype(np.float32)))
+    return int(vector.size), vector.dtype.name, norm, zlib.crc32(bytes(data))
+
+
+def decode_vector(data):
+    """Giải mã vector từ bytes nhị phân hoặc chuỗi base64/JSON cũ.
+
+    Với dữ liệu nhị phân, mảng trả về là view trên buffer gốc (không sao chép).
+    """
+    if data is None or len(data) == 0:
+        return None
+    if isinstance(data, str):
+        data = data.encode()
+    if is_binary_vector(data):
+        if len(data) < HEADER.size:
+            raise VectorCodecError('Dữ liệu vector bị cắt cụt (thiếu header)')
+        _, version, code, dim = HEADER.unpack_from(data)
+        if version != VERSION:
+            raise VectorCodecError(f'Phiên bản định dạng vector không hỗ trợ: {version}')
+        if code not in CODE_DTYPES:
+            raise VectorCodecError(f'Mã dtype không hỗ trợ: {code}')
+        dtype = CODE_DTYPES[code]
+        if len(data) != HEADER.size + dim * dtype.itemsize:
+            raise VectorCodecError('Độ dài dữ liệu vector không khớp với header')
+        return np.frombuffer(data, dtype=dtype, count=dim, offset=HEADER.size)
+    return decode_legacy_vector(data)
+
+
+def decode_legacy_vector(data):
+    """Giải mã định dạng cũ: base64 của JSON list các số thực"""
+    try:
+        vector_list = json.loads(base64.b64decode(bytes(data)))
+    except (binascii.Error, ValueError) as e:
+        raise VectorCodecError(f'Dữ liệu vector cũ không hợp lệ: {e}')
+    return np.asarray(vector_list, dtype=np.float32)
+
+
+def vector_to_text(data):
+    """Bytes nhị phân -> base64 để trả về trong JSON (nhỏ hơn ~5 lần so với list số thực)"""
+    return base64.b64encode(bytes(data)).decode()
+
+
+def text_to_vector(text):
+    """Nhận chuỗi từ client: base64 của định dạng nhị phân hoặc base64/JSON cũ"""
+    try:
+        raw = base64.b64decode(text.encode() if isinstance(text, str) else text, validate=True)
+    except binascii.Error as e:
+        raise VectorCodecError(f'Chuỗi vector không phải base64: {e}')
+    if is_binary_vector(raw):
+        return decode_vector(raw)
+    try:
+        return np.asarray(json.loads(raw), dtype=np.float32)
+    except ValueError as e:
+        raise VectorCodecError(f'Dữ liệu vector cũ không hợp lệ: {e}')